@@ -1,4 +1,7 @@
 #!/usr/bin/env python3
+import time
+# the startup time is measured from here, so it includes importing pygame and numpy
+STARTUP_S = time.perf_counter()
 import pygame
 import math
 import numpy as np
@@ -8,19 +11,34 @@ from pygame.locals import *
 from dataclasses import dataclass
 from typing import List
 
-from roller.calculations import vectorProjection, scalarProduct, world2screen
-from roller.bots import Spherebot, Bot
-from roller.overlay import JsonOverlay
+from roller.calculations import vectorProjection, scalarProduct, world2screen, screen2world, clip
+from roller.bots import Spherebot, Bot, collide_bots
+from roller.overlay import JsonOverlay, LinePlot
 from roller.conditions import g_player_conditions
-from roller.performance import g_performance
+from roller.performance import g_performance, StartupTimer
 from roller.datatypes import Point
 from roller.config import g_config
 from roller import colors
 from roller import sensors
 from roller import characters
 from roller import camera
-from roller import material
 from roller import sounds
+from roller import mapcache
+from roller import spatial
+from roller import collision
+from roller import visibility
+from roller.heat import HeatField
+from roller.water import WaterSimulation
+from roller.memory import OccupancyMemory
+from roller import paging
+from roller.maps import g_maps
+from roller.lod import g_lod
+from roller.thermal import g_thermal
+from roller.navigation import g_paths
+from roller.behaviours import g_behaviours
+from roller.music import g_music
+from roller.snapshots import g_snapshots
+from roller.dirtytiles import DirtyTiles
 
 
 
@@ -29,8 +47,31 @@ class World:
     surface: pygame.surface.Surface
     interpretation: pygame.surface.Surface
     memory: pygame.surface.Surface
+    layers: mapcache.CompiledMap | paging.PagedMap
+    """Arrays of the world raster's channels and the material properties derived from them"""
     x: float = 0  # screen coordinates of the top-right corner
     y: float = 0
+    scale: float = 1.0
+    """How many pixels of the render surface one world pixel is drawn as. Follows g_config.render_scale,
+    so the same part of the world is visible at every render scale"""
+    map_name: str = None
+    """The name of the map in the map registry, also used as the key for roller.places"""
+    occupancy: collision.OccupancyGrid = None
+    """Coarse grid of where the ground is, used to speed up collision queries"""
+    entity_index: spatial.SpatialHash = None
+    """Spatial hash of the bots in the world, rebuilt every tick. Lets sensors see bots, which are not part of the world raster"""
+    heat: HeatField = None
+    """Heat given off by the sensors, on top of the temperature layer of the map"""
+    water: WaterSimulation = None
+    """Water flowing through the world, initialised from the water pixels of the map"""
+    opacity: collision.OccupancyGrid = None
+    """Coarse grid of where light is likely to be scattered, used by sensors with many lasers"""
+    memory_grid: OccupancyMemory = None
+    """Occupancy grid built from the lidar returns of all bots, drawn onto memory_grid_surface"""
+    memory_grid_surface: pygame.surface.Surface = None
+    """The memory_grid as drawn to the screen, below the memory surface"""
+    interpretation_dirty: DirtyTiles = None
+    """The tiles of the interpretation surface the sensors drew to since the latest snapshot (see roller.snapshots)"""
 
 
 
@@ -41,15 +82,108 @@ def drawWorld(world):
     # Drawing
     screen.fill(colors.black)
 
-    if g_config.debug:
-        screen.blit(world.surface, (world.x, world.y))
+    # a paged world has no surface for the whole map
+    if g_config.debug and world.surface is not None:
+        blit_world_layer(screen, world.surface, world)
+    g_performance.mark_phase("render")
 
     for entity in g_entities:
+        # sensors are gated like physics: bots far outside the camera view don't run their sensors on
+        # every tick, and sleeping bots don't run them at all. The player sees through their bot's sensors,
+        # so those keep running while the bot rests
+        if entity.lod_steps == 0 or (entity.is_sleeping and entity.joystick is None):
+            continue
         for sensor in entity.sensors:
             if sensor.is_enabled:
                 sensor.run(entity, world)
-    
-    screen.blit(world.interpretation, (world.x, world.y))
+
+    # the lidar returns of all sensors are added to the memory at once
+    world.memory_grid.update()
+    g_performance.mark_phase("sensors")
+    world.memory_grid.render(world.memory_grid_surface)
+    if g_player_conditions["you have a memory bank for sensor data"]:
+        blit_world_layer(screen, world.memory_grid_surface, world)
+        blit_world_layer(screen, world.memory, world)
+
+    blit_world_layer(screen, world.interpretation, world)
+    g_performance.mark_phase("render")
+
+def enter_map(world, map_name):
+    """Switch the world to another map. The map comes from the map registry, so switching
+    does not stall the game if the map has been prefetched. Sensor data drawn on the previous map is discarded"""
+    loaded_map = g_maps.get(map_name)
+    world.map_name = map_name
+    world.surface = loaded_map.surface
+    world.layers = loaded_map.layers
+    if loaded_map.occupancy is None:
+        # the grid of a paged map is filled in chunk by chunk, as it is queried
+        loaded_map.occupancy = collision.OccupancyGrid(loaded_map.layers)
+    world.occupancy = loaded_map.occupancy
+    # the heat field, the water and the opacity grid are made from the whole map at once,
+    # so a paged map, which may not fit into memory, goes without them
+    is_paged = isinstance(loaded_map.layers, paging.PagedMap)
+    if loaded_map.heat is None and not is_paged:
+        loaded_map.heat = HeatField(loaded_map.layers)
+    world.heat = loaded_map.heat
+    if loaded_map.water is None and not is_paged:
+        loaded_map.water = WaterSimulation(loaded_map.layers)
+    world.water = loaded_map.water
+    if loaded_map.opacity is None and not is_paged:
+        loaded_map.opacity = visibility.create_opacity_grid(loaded_map.layers)
+    world.opacity = loaded_map.opacity
+    world.interpretation = pygame.Surface(loaded_map.layers.get_size(), pygame.SRCALPHA)
+    world.interpretation_dirty = DirtyTiles(g_config.snapshot_tile_size)
+    world.memory = pygame.Surface(loaded_map.layers.get_size(), pygame.SRCALPHA)
+    world.memory.fill((0,0,0,0))
+    world.memory_grid = OccupancyMemory(loaded_map.layers.get_size())
+    world.memory_grid_surface = pygame.Surface(loaded_map.layers.get_size(), pygame.SRCALPHA)
+    world.memory_grid_surface.fill((0,0,0,0))
+
+def get_render_surface(display, render_surface=None):
+    """Returns the surface that the world, sensors and bots are rendered onto.
+    When `g_config.render_scale` is 1.0 this is the display surface itself. For smaller
+    scales an offscreen surface of the scaled size is returned, which is reused as long as
+    the scale does not change.
+
+    :param display: The display surface returned by pygame.display.set_mode
+    :param render_surface: The render surface used on the previous frame, if any
+    """
+    if g_config.render_scale >= 1.0:
+        return display
+
+    size = (
+        int(display.get_width() * g_config.render_scale),
+        int(display.get_height() * g_config.render_scale),
+    )
+    if render_surface is not None and render_surface is not display and render_surface.get_size() == size:
+        return render_surface
+    return pygame.Surface(size).convert()
+
+def blit_world_layer(screen, surface, world):
+    """Draw a surface the size of the map onto the render surface, scaled by `world.scale`.
+    Only the part of the surface that is visible on the screen is scaled"""
+    if world.scale == 1.0:
+        screen.blit(surface, (world.x, world.y))
+        return
+    top_left = screen2world(Point(0, 0), world)
+    visible = pygame.Rect(int(top_left.x), int(top_left.y),
+                          math.ceil(screen.get_width() / world.scale) + 1, math.ceil(screen.get_height() / world.scale) + 1)
+    visible = visible.clip(surface.get_rect())
+    if visible.width == 0 or visible.height == 0:
+        return
+    size = (round(visible.width * world.scale), round(visible.height * world.scale))
+    screen.blit(pygame.transform.scale(surface.subsurface(visible), size), world2screen(Point(visible.x, visible.y), world))
+
+def present(screen, display):
+    """Upscale the render surface onto the display. Does nothing when rendering at native resolution"""
+    if screen is display:
+        return
+    pygame.transform.scale(screen, display.get_size(), display)
+
+def change_render_scale(step):
+    """Change the render scale by `step`. The new render surface is allocated
+    at the start of the next frame"""
+    g_config.render_scale = clip(g_config.render_scale + step, g_config.render_scale_min, 1.0)
 
 def handle_events(bot):
     global RUNNING
@@ -86,6 +220,17 @@ def handle_events(bot):
             elif event.key == pygame.K_0 and sensor_count > 9:
                 bot.sensors[9].toggle()
 
+            elif event.key == pygame.K_MINUS:
+                change_render_scale(-g_config.render_scale_step)
+            elif event.key == pygame.K_EQUALS:
+                change_render_scale(g_config.render_scale_step)
+
+            elif event.key == pygame.K_p:
+                g_config.show_plots = not g_config.show_plots
+
+            elif event.key == pygame.K_r:
+                g_snapshots.rewind(g_entities, g_camera, world)
+
             elif event.key == pygame.K_ESCAPE:  # Exit fullscreen on ESC key press
                 RUNNING = False
 
@@ -152,39 +297,104 @@ def execute_tick(world, screen):
     # one entity and the next
     g_camera.set_goal(g_camera.targets[g_camera.target_index])
     g_camera.update_pid((g_current_tick_ms - g_previous_tick_ms)/1000)
+    world.scale = screen.get_width() / display.get_width()
     g_camera.move(world, screen)
 
     handle_events(g_camera.targets[g_camera.target_index])
+
+    top_left = screen2world(Point(0, 0), world)
+    bottom_right = screen2world(Point(screen.get_width(), screen.get_height()), world)
+    camera_rect = (top_left.x, top_left.y, bottom_right.x, bottom_right.y)
+    if g_config.paged_world:
+        world.layers.prefetch_around(g_entities, camera_rect)
+
+    # decide which bots are simulated on this tick, and by how many ticks they are advanced
+    g_lod.update(g_entities, camera_rect)
+    g_performance.mark_phase("other")
+
+    # sensors are run at the bots' current positions
+    world.entity_index.rebuild(g_entities)
+    # pushing colliding bots apart moves them, so the index is rebuilt for the sensors
+    if collide_bots(world.entity_index) > 0:
+        world.entity_index.rebuild(g_entities)
+    g_performance.mark_phase("physics")
+
     drawWorld(world)
 
     for entity in g_entities:
         # TODO: This should be a more generic "physics tick"
         # for entities. Not all of them need collide and rotate physics
 
-        entity.run_physics(world)
+        # entities simulated at a reduced rate are skipped on most ticks,
+        # and advanced by several ticks at once on the others (see roller.lod)
+        if entity.lod_steps > 0 and not entity.is_sleeping:
+            entity.run_physics(world, entity.lod_steps)
+    g_performance.mark_phase("physics")
 
-        entity.run_behaviours()
-        
-        ambient_temperature = material.get_temperature_at(entity, world)
-        for sensor in entity.sensors:
-            sensor.update_temperature(
-                ambient_temperature,
-                (g_current_tick_ms - g_previous_tick_ms) / 1000
-            )
+    # the behaviours of all simulated entities are run at once, grouped by their class
+    g_behaviours.run([entity for entity in g_entities if entity.lod_steps > 0], world)
+    g_performance.mark_phase("behaviours")
 
+    for entity in g_entities:
         if entity.joystick != None:
             entity.run_player_input()
 
 
         entity.render(world,screen)
+    g_performance.mark_phase("render")
+
+    # the sensors of all entities are heated and cooled at once (see roller.thermal)
+    g_thermal.step(g_entities, world, (g_current_tick_ms - g_previous_tick_ms) / 1000)
+    if world.heat is not None:
+        world.heat.update((g_current_tick_ms - g_previous_tick_ms) / 1000)
+    if world.water is not None:
+        world.water.update(world)
+    g_performance.mark_phase("physics")
+
+    # the state at the end of the tick is recorded every few ticks, so the game can be rewound
+    g_snapshots.update(g_entities, g_camera, world)
+    g_performance.mark_phase("other")
+
+    # the world has been drawn at the render scale, the overlay is drawn
+    # on top of it at the display's native resolution
+    present(screen, display)
+    g_performance.mark_phase("render")
 
     overlay_data = dict(
         housekeeping = g_camera.targets[g_camera.target_index].get_housekeeping(),
         preformance = g_performance.get_housekeeping(),
     )
+    overlay_data['lod'] = g_lod.get_housekeeping()
+    if world.heat is not None:
+        overlay_data['heat'] = world.heat.get_housekeeping()
+    if world.water is not None:
+        overlay_data['water'] = world.water.get_housekeeping()
+    overlay_data['memory'] = world.memory_grid.get_housekeeping()
+    overlay_data['paths'] = g_paths.get_housekeeping()
+    overlay_data['behaviours'] = g_behaviours.get_housekeeping()
+    overlay_data['music'] = g_music.get_housekeeping()
+    overlay_data['sounds'] = sounds.g_sounds.get_housekeeping()
+    overlay_data['startup'] = g_startup.get_housekeeping()
+    overlay_data['snapshots'] = g_snapshots.get_housekeeping()
+    if g_config.paged_world:
+        overlay_data['world'] = world.layers.get_housekeeping()
     # overlay_data = g_camera.targets[g_camera.target_index].get_housekeeping()
     overlay.render_housekeeping(overlay_data)
 
+    if g_config.show_plots:
+        draw_plots(g_camera.targets[g_camera.target_index])
+
+def draw_plots(bot):
+    """Add the latest telemetry values to the plots and draw them on the display"""
+    plots['fps'].add_data(g_performance.fps)
+    plots['tick_period_ms'].add_data(g_performance.tick_period_s * 1000)
+    if bot.sensors:
+        plots['sensor_temperature'].add_data(max(sensor.temperature for sensor in bot.sensors))
+    for phase in g_performance.PHASES:
+        plots[f'{phase}_ms'].add_data(g_performance.phase_ms[phase])
+    for plot in plots.values():
+        plot.draw()
+
 
 
 SAMPLE_RATE = 44100  # Standard sample rate for audio (44.1 kHz)
@@ -201,6 +411,8 @@ def generate_sine_wave(freq, duration, sample_rate=SAMPLE_RATE, volume=VOLUME):
 
 if __name__ == "__main__":
 
+    g_startup = StartupTimer(STARTUP_S)
+    g_startup.mark("imports")
 
     # Initialize Pygame and the mixer for sound output
     # 44.1kHz, 16-bit signed, mono sound
@@ -208,32 +420,39 @@ if __name__ == "__main__":
 
     # Initialize Pygame
     pygame.init()
+    g_startup.mark("pygame_init")
+
+    # the music is synthesized and played on a background thread
+    g_music.start()
+    sounds.g_sounds.init()
+    g_startup.mark("audio")
 
 
     # Set up the game window
     if g_config.fullscreen:
-        screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN)
+        display = pygame.display.set_mode((0,0), pygame.FULLSCREEN)
     else:
-        screen = pygame.display.set_mode((g_config.width, g_config.height))
+        display = pygame.display.set_mode((g_config.width, g_config.height))
     g_config.width = pygame.display.Info().current_w
     g_config.height = pygame.display.Info().current_h
+    g_startup.mark("display")
 
     # Set up the game clock
     clock = pygame.time.Clock()
 
-    # Create playble characters and other entities
+    # Create playble characters and other entities. Only the characters that are spawned are built
     g_entities = [
-        characters.player1,
-        characters.Aros,
-        characters.Skiv,
-        characters.elevator1,
+        characters.spawn('player1'),
+        characters.spawn('Aros'),
+        characters.spawn('Skiv'),
+        characters.spawn('elevator1'),
     ]
+    g_thermal.register(g_entities)
 
     g_camera = camera.Camera()
-    g_camera.add_target(characters.player1)
-    g_camera.add_target(characters.Aros)
-    g_camera.add_target(characters.Skiv)
-    g_camera.add_target(characters.elevator1)
+    for entity in g_entities:
+        g_camera.add_target(entity)
+    g_startup.mark("characters")
 
 
     # Game pad/controller support
@@ -253,26 +472,40 @@ if __name__ == "__main__":
         ), indent = 4))
 
 
-    world_surface = pygame.image.load('roller/assets/map5.png').convert()
-
+    # the map is loaded through the map registry from its compiled cache
     world = World(
         x=0, 
         y=0,
-        surface = world_surface,
-        interpretation = pygame.Surface(world_surface.get_size(), pygame.SRCALPHA),
-        memory = pygame.Surface(world_surface.get_size(), pygame.SRCALPHA),
+        surface = None,
+        layers = None,
+        interpretation = None,
+        memory = None,
+        entity_index = spatial.SpatialHash(),
     )
-
-    world.memory.fill((0,0,0,0))
+    enter_map(world, 'map5.png')
+    g_startup.mark("map")
 
     # Create the overlay object jor displaying robot housekeeping
-    overlay = JsonOverlay(screen)
+    overlay = JsonOverlay(display, refresh_hz=g_config.overlay_refresh_hz)
+
+    # Real-time telemetry plots, stacked in the top right corner of the display
+    plots = dict(
+        fps = LinePlot(display, pygame.Rect(display.get_width() - 310, 10, 300, 60), line_color=colors.Cyberpunk.green),
+        tick_period_ms = LinePlot(display, pygame.Rect(display.get_width() - 310, 80, 300, 60), line_color=colors.Cyberpunk.yellow),
+        sensor_temperature = LinePlot(display, pygame.Rect(display.get_width() - 310, 150, 300, 60), line_color=colors.Cyberpunk.red),
+    )
+    # how long each phase of a tick takes, below the other plots
+    phase_colors = dict(physics=colors.Cyberpunk.blue, behaviours=colors.Cyberpunk.purple, sensors=colors.Cyberpunk.cyan, render=colors.Cyberpunk.orange)
+    for i, phase in enumerate(g_performance.PHASES):
+        plots[f'{phase}_ms'] = LinePlot(display, pygame.Rect(display.get_width() - 310, 220 + i * 50, 300, 40), line_color=phase_colors[phase])
+    g_startup.mark("overlay")
 
     # contols which part of the world is rendered on screen
 
 
     g_current_tick_ms = 0
     g_previous_tick_ms = 0
+    screen = get_render_surface(display)
     # Game loop
     RUNNING = True
     while RUNNING:
@@ -284,10 +517,18 @@ if __name__ == "__main__":
         g_current_tick_ms = pygame.time.get_ticks()
         world.y +=1
 
+        # the render scale may have been changed during the previous tick
+        screen = get_render_surface(display, screen)
         execute_tick(world, screen)
 
         pygame.display.flip()  # Update the display
 
+        if "first_frame" not in g_startup.phases:
+            g_startup.mark("first_frame")
+            print(g_startup)
+            if g_startup.get_total_ms() > g_config.startup_budget_ms:
+                print(f"Startup took {g_startup.get_total_ms()} ms, more than the budget of {g_config.startup_budget_ms} ms")
+
         # when using cProfile to profile performance, quit after 10 seconds.
         # this give easier to compare timing values, as the profiling
         # period stays constant
@@ -298,4 +539,5 @@ if __name__ == "__main__":
         clock.tick(g_config.fps)
 
     # Clean up
+    g_music.stop()
     pygame.quit()
@@ -6,8 +6,13 @@ when not controlled by a player Joystick
 import numpy as np
 import math
 import random
+from collections import defaultdict
+from functools import lru_cache
 import pygame
 
+from roller.config import g_config
+from roller.navigation import g_paths
+
 
 class Behaviour:
     """Base class for bot behaviours. Inherit from this class when
@@ -19,12 +24,22 @@ class Behaviour:
     def __init__(self, bot):
         self.bot = bot
 
-    def run(self):
+    def run(self, world):
         """Execute one game tick of the behaviour. This method is automatically called
         by the Bot object to which your behaviour object is associated with. 
-        Raises NotImplementedError is not implemented by a Behaviour subclass."""
+        Raises NotImplementedError is not implemented by a Behaviour subclass.
+
+        :param world: the world the bot is in"""
         raise NotImplementedError()
 
+    @classmethod
+    def run_all(cls, behaviours, world):
+        """Execute one game tick of all the behaviours of this class at once (see BehaviourScheduler).
+        Subclasses that can evaluate many behaviours together over arrays override this, by default
+        the behaviours are run one by one"""
+        for behaviour in behaviours:
+            behaviour.run(world)
+
 class Blinking(Behaviour):
     """:param sensor_index: index of the Bot.sensors array to blink
     :param period: The speed at which the the sensor is toggled (seconds)
@@ -37,19 +52,21 @@ class Blinking(Behaviour):
         self.period = period
         self.duty_cycle = duty_cycle
 
-    def run(self):
+    def run(self, world):
         """Simulates a square wave determined by `period` and `duty_cycle`.
         The sensor is disabled when the square wave is 0, and enabled when 1"""
-        is_enabled = square_wave(
-            t = pygame.time.get_ticks()/1000,
-            period = self.period,
-            duty_cycle = self.duty_cycle
-        )
+        self.run_all([self], world)
 
-        if is_enabled:
-            self.bot.sensors[self.sensor_index].enable()
-        else:
-            self.bot.sensors[self.sensor_index].disable()
+    @classmethod
+    def run_all(cls, behaviours, world):
+        """Looks up the square waves of all the behaviours from their waveform tables at once"""
+        tables = get_waveform_tables(square_wave, [(b.period, b.duty_cycle) for b in behaviours])
+        is_enabled = tables.lookup(pygame.time.get_ticks())
+        for behaviour, enabled in zip(behaviours, is_enabled.tolist()):
+            if enabled:
+                behaviour.bot.sensors[behaviour.sensor_index].enable()
+            else:
+                behaviour.bot.sensors[behaviour.sensor_index].disable()
 
 
 class OscillateSensor(Behaviour):
@@ -70,13 +87,73 @@ class OscillateSensor(Behaviour):
         self.phi_max = phi_max
         self.period = period
 
-    def run(self):
+    def run(self, world):
         """Updates the `mount_angle` of the specified sensor on the specified bot to execute the oscillation"""
-        t = pygame.time.get_ticks()/1000
-        phase = np.sin(t* 2*np.pi* (1/self.period))
+        self.run_all([self], world)
+
+    @classmethod
+    def run_all(cls, behaviours, world):
+        """Looks up the phases of all the oscillations from their waveform tables at once"""
+        tables = get_waveform_tables(sine_wave, [(b.period,) for b in behaviours])
+        phase = tables.lookup(pygame.time.get_ticks())
+        phi_min = np.fromiter((b.phi_min for b in behaviours), dtype=np.float64, count=len(behaviours))
+        phi_max = np.fromiter((b.phi_max for b in behaviours), dtype=np.float64, count=len(behaviours))
         # we map the values -1.0 ... +1.0 to match phi_min ... phi_max
-        phi = self.phi_min + (phase + 1) * (self.phi_max - self.phi_min) / 2
-        self.bot.sensors[self.sensor_index].mount_angle = phi
+        phi = phi_min + (phase + 1) * (phi_max - phi_min) / 2
+        for behaviour, angle in zip(behaviours, phi.tolist()):
+            behaviour.bot.sensors[behaviour.sensor_index].mount_angle = angle
+
+
+class NavigateToPlace(Behaviour):
+    """Roll a Spherebot to a place of the map it is in (see roller.places), along a path planned by roller.navigation.
+
+    :param place: the name of the place in roller.places
+    :param source: "terrain" to plan with the ground of the map, or "memory" to plan with what the bots'
+        lidars have seen (see roller.memory)
+    :param gain: how hard the bot accelerates, like the gain of the player's input
+    """
+
+    def __init__(self, bot, place: str, source: str = "terrain", gain: float = 1.0, **kwargs):
+        super().__init__(bot, **kwargs)
+        assert source in ("terrain", "memory")
+        self.place = place
+        self.source = source
+        self.gain = gain
+        self.ticks = 0
+        self.target_x = None
+        """The x of the center of the next cell of the path, None if the bot has arrived or can't get to the place"""
+        self.deadband = 0
+        self.has_arrived = False
+
+    def get_cell(self, planner):
+        """Returns the cell the bottom of the bot is in. Bots sunk into the ground are in the first free cell above"""
+        size = planner.cell_size
+        cx = min(max(int(self.bot.x) // size, 0), planner.shape[0] - 1)
+        cy = min(max(int(self.bot.y + self.bot.radius - 1) // size, 0), planner.shape[1] - 1)
+        while cy > 0 and planner.blocked[cx + 2, cy + 2]:
+            cy -= 1
+        return cx, cy
+
+    def run(self, world):
+        """Replan every g_config.path_replan_ticks ticks, and accelerate towards the next cell of the path"""
+        if self.ticks % g_config.path_replan_ticks == 0:
+            planner = g_paths.get_planner(world, self.place, self.source)
+            cell = self.get_cell(planner)
+            planner.compute(cell)
+            next_cell = planner.get_next_cell(cell)
+            self.target_x = None if next_cell is None else (next_cell[0] + 0.5) * planner.cell_size
+            self.deadband = planner.cell_size / 4
+            self.has_arrived = cell == planner.get_cell(planner.goal)
+        self.ticks += 1
+
+        if self.target_x is None:
+            return
+        # falling straight down needs no acceleration
+        if self.target_x < self.bot.x - self.deadband:
+            self.bot.accelerate_left(self.gain)
+        elif self.target_x > self.bot.x + self.deadband:
+            self.bot.accelerate_right(self.gain)
+
 
 def square_wave(t, period, duty_cycle, terms=8):
     """
@@ -98,4 +175,97 @@ def square_wave(t, period, duty_cycle, terms=8):
         f_t += (4 * np.sin(n * np.pi * D) / (n * np.pi)) * np.cos(2 * np.pi * n * t / T)
     
     
-    return f_t > 1
\ No newline at end of file
+    return f_t > 1
+
+
+def sine_wave(t, period):
+    """A sine wave with the given period (seconds) at the time t, which can be an array of times"""
+    return np.sin(t* 2*np.pi* (1/period))
+
+MAX_TABLE_MS = 10000
+"""The longest waveform table, in milliseconds"""
+
+def get_table_ms(period):
+    """The game time is counted in milliseconds, so a waveform repeats on the game clock after the first whole
+    number of milliseconds that is also a whole number of its periods. Returns that number, or None if it's
+    longer than MAX_TABLE_MS"""
+    period_ms = period * 1000
+    for count in range(1, int(MAX_TABLE_MS / period_ms) + 1):
+        table_ms = round(period_ms * count)
+        if abs(period_ms * count - table_ms) < 1e-6:
+            return table_ms
+    return None
+
+@lru_cache(maxsize=None)
+def get_waveform_table(waveform, parameters):
+    """The values of the waveform on every millisecond until it repeats, or None if it doesn't repeat soon
+    enough to be tabulated (see get_table_ms)"""
+    table_ms = get_table_ms(parameters[0])
+    if table_ms is None:
+        return None
+    return waveform(np.arange(table_ms) / 1000, *parameters)
+
+
+class WaveformTables:
+    """The waveform tables of a group of behaviours, concatenated so they can all be looked up at once.
+    The waveforms that have no table are calculated on each lookup
+
+    :param waveform: function(t, period, ...) that returns the values of a waveform at the times t (seconds)
+    :param parameters: the parameters of the waveform of each behaviour, starting with its period
+    """
+
+    def __init__(self, waveform, parameters):
+        self.waveform = waveform
+        tables = [get_waveform_table(waveform, p) for p in parameters]
+        self.calculated = [(index, p) for index, (p, table) in enumerate(zip(parameters, tables)) if table is None]
+        """(index, parameters) of the behaviours whose waveform has no table"""
+        # those look up a placeholder value, which is then overwritten
+        tables = [waveform(np.zeros(1), *p) if table is None else table for p, table in zip(parameters, tables)]
+        self.values = np.concatenate(tables)
+        self.lengths = np.array([len(table) for table in tables], dtype=np.int64)
+        self.offsets = np.cumsum(self.lengths) - self.lengths
+
+    def lookup(self, ticks):
+        """Returns the value of each behaviour's waveform at the game time `ticks` (milliseconds)"""
+        values = self.values[self.offsets + int(ticks) % self.lengths]
+        for index, parameters in self.calculated:
+            values[index] = self.waveform(ticks / 1000, *parameters)
+        return values
+
+
+@lru_cache(maxsize=64)
+def get_waveform_tables_cached(waveform, parameters):
+    return WaveformTables(waveform, parameters)
+
+def get_waveform_tables(waveform, parameters):
+    """Returns the WaveformTables of a group of behaviours. Cached, since groups stay the same from tick to tick
+
+    :param waveform: function(t, period, ...) that returns the values of a waveform at the times t (seconds)
+    :param parameters: list of the parameters of the waveform for each behaviour
+    """
+    return get_waveform_tables_cached(waveform, tuple(parameters))
+
+
+class BehaviourScheduler:
+    """Runs the behaviours of many bots once per tick, grouped by their class, so each group can be
+    evaluated at once over arrays (see Behaviour.run_all)"""
+
+    def __init__(self):
+        self.groups = {}
+        """Lists of behaviours keyed by their class, as of the latest tick"""
+
+    def run(self, entities, world):
+        """Run the behaviours of the entities. Groups are run in the order their classes first appear"""
+        groups = defaultdict(list)
+        for entity in entities:
+            for behaviour in entity.behaviours:
+                groups[type(behaviour)].append(behaviour)
+        for behaviour_class, behaviours in groups.items():
+            behaviour_class.run_all(behaviours, world)
+        self.groups = groups
+
+    def get_housekeeping(self):
+        return {behaviour_class.__name__: len(behaviours) for behaviour_class, behaviours in self.groups.items()}
+
+
+g_behaviours = BehaviourScheduler()
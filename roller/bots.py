@@ -1,5 +1,7 @@
 import math
+from functools import lru_cache
 
+import numpy as np
 import pygame
 from typing import List, Dict
 from dataclasses import dataclass, field
@@ -11,6 +13,21 @@ from roller.sensors import SpectraScan_SX30, Sensor
 from roller.conditions import g_player_conditions
 from roller.config import g_config
 from roller.behaviours import Behaviour
+from roller import terrain
+from roller import collision
+from roller import sounds
+from roller.raycache import g_ray_cache
+
+@lru_cache(maxsize=None)
+def get_pixel_offsets(radius: float):
+    """Returns the arrays (dx, dy, distance) for all pixels in the bounding box of a circle
+    with the given radius. The arrays are indexed [dx + floor(radius), dy + floor(radius)]
+    like the pygame.surfarray arrays. Cached, since bots don't change size"""
+    r = math.floor(radius)
+    dx, dy = np.meshgrid(np.arange(-r, r + 1), np.arange(-r, r + 1), indexing="ij")
+    distance = np.sqrt(dx**2 + dy**2) # pythagoras
+    return dx, dy, distance
+
 
 @dataclass
 class Bot():
@@ -26,6 +43,17 @@ class Bot():
     keybinds: Dict[str,int] = field(default_factory=dict)
     joystick: pygame.joystick.Joystick = None
     behaviours: List[Behaviour] = field(default_factory=list)
+    is_sleeping: bool = False
+    """Sleeping bots are at rest, and their physics is not simulated until they are woken up (see roller.lod)"""
+    rest_ticks: int = 0
+    """How many consecutive ticks the bot has been at rest"""
+    lod: object = None
+    """The roller.lod.SimulationLOD the bot was simulated at on the latest tick"""
+    lod_steps: int = 1
+    """How many ticks to advance the bot by on the current tick. Set by roller.lod"""
+    own_terrain: pygame.Rect = None
+    """The part of the world raster that is terrain the bot carries, e.g. an elevator's platform.
+    The bot's own lidar rays pass through it. None if the bot carries no terrain"""
 
     def get_xy(self):
         return (self.x, self.y)
@@ -56,17 +84,36 @@ class Bot():
         # are placed in a satisfying way. Maybe implemented in the subclasses
         self.sensors.append(sensor)
 
-    def run_physics(self, world):
+    def run_physics(self, world, steps=1):
         """How collisions, gravity, etc. physics effect the bot. This will
-        be executed before any player input via a joystick object or Behavious object"""
+        be executed before any player input via a joystick object or Behavious object
+
+        :param steps: how many ticks worth of motion to simulate at once (see roller.lod)"""
         raise NotImplementedError()
 
-    def run_behaviours(self):
+    def wake(self):
+        """Wake the bot up, so its physics are simulated again"""
+        self.is_sleeping = False
+        self.rest_ticks = 0
+
+    def update_sleep(self, is_at_rest):
+        """Put the bot to sleep after it has been at rest for g_config.lod_sleep_ticks ticks"""
+        if not is_at_rest:
+            self.rest_ticks = 0
+            return
+        self.rest_ticks += 1
+        if self.rest_ticks >= g_config.lod_sleep_ticks:
+            self.is_sleeping = True
+            self.vx = 0
+            self.vy = 0
+            self.omega = 0
+
+    def run_behaviours(self, world):
         """Gets and executes upon player inputs and automated behaviours
         Player inputs are only executed if the bot has a joystick object associated with it"""
 
         for behaviour in self.behaviours:
-            behaviour.run()
+            behaviour.run(world)
 
     def run_player_input(self):
         """the player should implement how the inputs from a game controller
@@ -83,17 +130,28 @@ class Bot():
 
 
 class Elevator(Bot):
+    """:param platform_size: (width, height) of a platform of ground below the elevator that moves with it. No platform if None"""
 
-    def __init__(self, *args, **kwargs):
+    radius: float = 20
+
+    def __init__(self, *args, platform_size=None, **kwargs):
         # this passess all other arguments given to this initializer to the 
         # parent calss to take care of
         super().__init__(*args, **kwargs)
+        self.platform = None if platform_size is None else terrain.TerrainSprite.filled(*platform_size)
     
-    def run_physics(self, world):
+    def run_physics(self, world, steps=1):
         # move based on velocity
-        self.y += self.vy
+        self.y += self.vy * steps
         # apply some friction
-        self.vy *= 0.90
+        self.vy *= 0.90 ** steps
+
+        if self.platform is not None:
+            # the platform is part of the world raster, so bots collide with it and sensors see it.
+            # The elevator's own sensors look through it, so moving it keeps their cached rays
+            with g_ray_cache.moving_own_terrain(self, self.platform):
+                self.platform.place(world, self.x - self.platform.channels.shape[0]/2, self.y + self.radius)
+            self.own_terrain = self.platform.rect
 
     def run_player_input(self):
 
@@ -107,7 +165,7 @@ class Elevator(Bot):
 
         origin = world2screen(self, world)
         
-        pygame.draw.circle(screen, self.color, origin, 20)
+        pygame.draw.circle(screen, self.color, origin, self.radius * world.scale)
 
 
 
@@ -133,34 +191,90 @@ class Spherebot(Bot):
         """just to easily access the xy position for pygame functions"""
         return (self.x, self.y)
 
-    def run_physics(self, world):
+    def run_physics(self, world, steps=1):
         """Run physics for spherebot. TODO: this implementation still
         intermingles user input and physics instead of running all physics
-        before user input."""
-        if (self.touch(world)):
+        before user input.
+
+        :param steps: how many ticks worth of motion to simulate at once (see roller.lod).
+            Large steps rely on the continuous collision detection to not pass through terrain"""
+        is_touching = self.touch(world)
+        if (is_touching):
             self.collide(world);
             self.rotate();
         
         # friction
-        self.vy *= 0.99;
-        self.vx *= 0.99;
-        self.omega *= 0.95;
+        self.vy *= 0.99 ** steps;
+        self.vx *= 0.99 ** steps;
+        self.omega *= 0.95 ** steps;
 
         # Gravity
-        self.vy += g_config.gravity_acceleration 
-
-        # Rotate and move
-        self.phi += self.omega;
-        self.x += self.vx;
-        self.y += self.vy;
+        self.vy += g_config.gravity_acceleration * steps
+
+        # Buoyancy and drag of water
+        self.apply_water_forces(world, steps)
+
+        # Rotate and move. Fast bots only move towards the ground up to where they would first touch it,
+        # so they can't pass through terrain thinner than the distance they move in one tick
+        dx, dy = self.get_free_motion(world, steps)
+        self.phi += self.omega * steps;
+        self.x += dx;
+        self.y += dy;
+
+        # a bot lying on the ground that is not moving can go to sleep
+        self.update_sleep(
+            is_touching
+            and self.vx*self.vx + self.vy*self.vy < g_config.lod_sleep_speed**2
+            and abs(self.omega) < g_config.lod_sleep_omega
+        )
 
-        
+    def apply_water_forces(self, world, steps=1):
+        """Push the bot up and slow it down in proportion to how much of it is under water (see roller.water)"""
+        if world.water is None:
+            return
+        radius = math.floor(self.radius)
+        _, _, pixelDistance = get_pixel_offsets(self.radius)
+        submerged = world.water.get_submerged_fraction(
+            math.floor(self.x) - radius, math.floor(self.y) - radius, pixelDistance <= self.radius)
+        if submerged == 0:
+            return
+        self.vy -= g_config.gravity_acceleration * g_config.water_buoyancy * submerged * steps
+        drag = (1 - g_config.water_drag * submerged) ** steps
+        self.vx *= drag
+        self.vy *= drag
+        self.omega *= drag
+
+    def get_free_motion(self, world, steps=1):
+        """Returns the (dx, dy) the bot can move this tick without passing through ground.
+        When the bot would touch new ground, it moves up to the point of contact, and the rest of its motion
+        slides along the surface: only the part of the motion into the ground is clipped.
+        Bots moving less than g_config.ccd_speed_fraction times their radius can't tunnel, and move freely"""
+        dx = self.vx * steps
+        dy = self.vy * steps
+        if dx*dx + dy*dy < (self.radius * g_config.ccd_speed_fraction)**2:
+            return dx, dy
+        fraction, normalX, normalY = collision.get_time_of_impact(world, self.x, self.y, self.radius, dx, dy)
+        if fraction >= 1:
+            return dx, dy
+        contactX = dx * fraction
+        contactY = dy * fraction
+        restX = dx - contactX
+        restY = dy - contactY
+        into = restX*normalX + restY*normalY
+        if into < 0:
+            restX -= into * normalX
+            restY -= into * normalY
+        # the slide can't pass through ground either, but it doesn't slide again
+        slide, _, _ = collision.get_time_of_impact(world, self.x + contactX, self.y + contactY, self.radius, restX, restY)
+        return contactX + restX*slide, contactY + restY*slide
 
     def accelerate_left(self, gain):
+        self.wake()
         self.accelerating = True
         self.omega += gain * (-1 - self.omega) * 0.1
         return
     def accelerate_right(self, gain):
+        self.wake()
         self.accelerating = True
         self.omega += gain * ( 1 - self.omega) * 0.1
         return
@@ -198,38 +312,41 @@ class Spherebot(Bot):
         of any possible bounces after a collision.
         """
 
-        # Loop through the pixels around the self
+        # The pixels around the bot are read from the precompiled ground layer of the world
+        # in one slice, instead of checking the color of each pixel in a loop
 
         origin = Point(self.x, self.y)
         
         radius = math.floor(self.radius)
         x = math.floor(origin.x)
         y = math.floor(origin.y)
-        pixelSumX = 0
-        pixelSumY =  0
-        pixelsHit = 0
         self.closest_pixel_distance = self.radius
         self.collisionDirectionX = 0
         self.collisionDirectionY = 0 
-        for dx in range(-radius, radius+1):
-            for dy in range(-radius, radius+1):
-                pixel_x = x + dx
-                pixel_y = y + dy
-                pixelDistance = math.sqrt(dx**2 + dy**2) # pythagoras
-
-                # check pixel values from the world surface itself
-                color = world.surface.get_at((pixel_x, pixel_y))
-                if colors.is_ground_color(color) and pixelDistance <= self.radius:
-                    pixelsHit += 1
-                    pixelSumX += dx
-                    pixelSumY += dy
-                    # we store the closes distance to a pixel as a metric
-                    # of how hard we have collided (how far into the terrain the player is)
-                    if pixelDistance < self.closest_pixel_distance:
-                        self.closest_pixel_distance = pixelDistance
 
-        
+        # the part of the bot's bounding box that is inside the world raster
+        width, height = world.layers.get_size()
+        x_start, x_end = max(x - radius, 0), min(x + radius + 1, width)
+        y_start, y_end = max(y - radius, 0), min(y + radius + 1, height)
+        if x_start >= x_end or y_start >= y_end:
+            return False
+
+        dx, dy, pixelDistance = get_pixel_offsets(self.radius)
+        offsets = (
+            slice(x_start - (x - radius), x_end - (x - radius)),
+            slice(y_start - (y - radius), y_end - (y - radius)),
+        )
+        ground = world.layers.ground[x_start:x_end, y_start:y_end]
+        hits = ground & (pixelDistance[offsets] <= self.radius)
+
+        pixelsHit = int(np.count_nonzero(hits))
         if(pixelsHit != 0):
+            pixelSumX = int(dx[offsets][hits].sum())
+            pixelSumY = int(dy[offsets][hits].sum())
+            # we store the closes distance to a pixel as a metric
+            # of how hard we have collided (how far into the terrain the player is)
+            self.closest_pixel_distance = min(self.closest_pixel_distance, float(pixelDistance[offsets][hits].min()))
+
             # this is the kind of average "center" location of all the pixels we hit. 
             weightMedX = pixelSumX / pixelsHit;
             weightMedY = pixelSumY / pixelsHit;
@@ -261,6 +378,52 @@ class Spherebot(Bot):
 
 
 
+    def collide_with(self, other):
+        """Push this bot and an other overlapping Spherebot apart, and bounce them off each other.
+        The bots are treated as discs with mass proportional to radius squared. The bounce uses
+        the same 1.5 multiplication factor as colliding with the ground, applied to the relative velocity"""
+        dx = other.x - self.x
+        dy = other.y - self.y
+        distance = math.sqrt(dx*dx + dy*dy)
+        if distance == 0:
+            # the bots are exactly on top of each other, any direction will do
+            dx, dy, distance = 1, 0, 1
+        # unit vector from this bot towards the other
+        normalX = dx / distance
+        normalY = dy / distance
+
+        mass = self.radius**2
+        other_mass = other.radius**2
+        # the lighter bot moves more
+        share = other_mass / (mass + other_mass)
+        other_share = mass / (mass + other_mass)
+
+        # pop the bots apart so they only touch
+        overlap = self.radius + other.radius - distance
+        self.x -= normalX * overlap * share
+        self.y -= normalY * overlap * share
+        other.x += normalX * overlap * other_share
+        other.y += normalY * overlap * other_share
+        self.wake()
+        other.wake()
+
+        # only bounce if the bots are moving towards each other
+        relativeVX = self.vx - other.vx
+        relativeVY = self.vy - other.vy
+        speed = relativeVX*normalX + relativeVY*normalY
+        if speed <= 0:
+            return
+        if speed >= g_config.collision_sound_speed:
+            # a few loudness levels, so the cache keeps a few sounds
+            loudness = min(int(speed / g_config.collision_sound_speed), 4)
+            sounds.g_sounds.play(sounds.generate_white_noise, 0.04, amplitude=2000 * loudness,
+                                 priority=sounds.COLLISION_PRIORITY)
+        velocity_change = vectorProjection(relativeVX, relativeVY, normalX, normalY)
+        self.vx -= 1.5 * velocity_change[0] * share
+        self.vy -= 1.5 * velocity_change[1] * share
+        other.vx += 1.5 * velocity_change[0] * other_share
+        other.vy += 1.5 * velocity_change[1] * other_share
+
     def rotate(self):
         """run the physics for how the sphere's translation velocity
         has an effect on it's rotational velocity when making contact with
@@ -302,7 +465,7 @@ class Spherebot(Bot):
 
         origin = world2screen(self, world)
         
-        pygame.draw.circle(screen, self.color, origin, self.radius)
+        pygame.draw.circle(screen, self.color, origin, self.radius * world.scale)
 
         for sensor in self.sensors:
             sensor.render(self, world, screen)
@@ -313,7 +476,18 @@ class Spherebot(Bot):
 
         if g_config.debug:
             collsion_center_xy = (
-                origin.x + self.collisionDirectionX * self.closest_pixel_distance,
-                origin.y + self.collisionDirectionY * self.closest_pixel_distance
+                origin.x + self.collisionDirectionX * self.closest_pixel_distance * world.scale,
+                origin.y + self.collisionDirectionY * self.closest_pixel_distance * world.scale
             )
             pygame.draw.circle(screen, (255,128,0), collsion_center_xy, 2)
+
+
+def collide_bots(entity_index):
+    """Resolve collisions between all overlapping Spherebots in the spatial hash.
+    Other bots (e.g elevators) are not pushed around. Returns the number of collisions"""
+    collisions = 0
+    for a, b in entity_index.get_overlapping_pairs():
+        if isinstance(a, Spherebot) and isinstance(b, Spherebot):
+            a.collide_with(b)
+            collisions += 1
+    return collisions
@@ -1,6 +1,7 @@
 import math
 import random
 import pygame
+import numpy as np
 from roller.datatypes import Point, Line
 from roller import colors
 from roller import material
@@ -48,21 +49,68 @@ def get_line_endpoint(start: Point, distance:float, angle:float):
     y2 = start.y + distance * math.sin(angle)
     return Point(x2, y2)
 
-def get_first_matching_line_pixel(line: Line, matching_callback, surface: pygame.Surface):
+LINE_BATCH_SIZE = 64
+"""How many pixels along a line are read at once from a layer of a paged world"""
+
+def get_line_pixel_batches(line: Line, width, height):
+    """Yields the (xs, ys) of the pixels along the line, in lists of up to LINE_BATCH_SIZE pixels, in the order
+    Bresenham's algorithm visits them. Stops when the line leaves the width x height layer"""
+    x0, y0 = line.start.x, line.start.y
+    x1, y1 = line.end.x, line.end.y
+    dx = abs(x1 - x0)
+    dy = abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx - dy
+    xs, ys = [], []
+    while True:
+        x, y = int(x0), int(y0)
+        if not (0 <= x < width and 0 <= y < height):
+            break
+        xs.append(x)
+        ys.append(y)
+        if (abs(x0 - x1) < 1) and (abs(y0 - y1) < 1):
+            break
+        if len(xs) == LINE_BATCH_SIZE:
+            yield xs, ys
+            xs, ys = [], []
+        e2 = 2 * err
+        if e2 > -dy:
+            err -= dy
+            x0 += sx
+        if e2 < dx:
+            err += dx
+            y0 += sy
+    if xs:
+        yield xs, ys
+
+def get_first_matching_line_pixel(line: Line, matching_callback, layer):
     """
     Returns the coordinates of the first pixel along the line from (x0, y0) to (x1, y1) that returns True from the callback function.
-    Uses Bresenham's algorithm to trace the line. The function exits early when a matching pixel is found.
+    Uses Bresenham's algorithm to trace the line. The function exits early when a matching pixel is found,
+    or when the line leaves the layer.
 
     This is a faster alternative to get_line_pixels, which will store the coordinates
     of all the pixels along a line in a list. This version does not store pixel coordinates,
     and only returns one point if a matching pixel is found.
 
     :param line: line along which pixels are evaluated
-    :param matching_callback: A callback function to check if a given pixel color is interesting. Return True if it matches search criteria
+    :param matching_callback: A callback function to check if a given pixel value is interesting. Return True if it matches search criteria
+    :param layer: A layer of the world map, indexed `layer[x, y]` (see roller.mapcache)
     :returns: The coordinates of the first pixel that mached the callback, or None if no pixel is found.
     """
     x0, y0 = line.start.x, line.start.y
     x1, y1 = line.end.x, line.end.y
+    width, height = layer.shape[:2]
+
+    if not isinstance(layer, np.ndarray):
+        # reading the pixels of a paged layer one by one would look up their chunk every time,
+        # so they are read a batch at a time (see roller.paging)
+        for xs, ys in get_line_pixel_batches(line, width, height):
+            for x, y, value in zip(xs, ys, layer[np.array(xs), np.array(ys)]):
+                if matching_callback(value):
+                    return Point(x, y)
+        return None
 
     dx = abs(x1 - x0)
     dy = abs(y1 - y0)
@@ -71,10 +119,14 @@ def get_first_matching_line_pixel(line: Line, matching_callback, surface: pygame
     err = dx - dy
 
     while True:
-        # Check if the current pixel is black using the provided callback function
-        pixel_color = surface.get_at(  (int(x0),int(y0))  )
-        if matching_callback(pixel_color):
-            return Point(int(x0), int(y0))  # Return the first black pixel coordinates
+        x, y = int(x0), int(y0)
+        # nothing outside the world can be matched
+        if not (0 <= x < width and 0 <= y < height):
+            break
+
+        # Check if the current pixel matches using the provided callback function
+        if matching_callback(layer[x, y]):
+            return Point(x, y)  # Return the first matching pixel coordinates
         
         # If we have reached the end point, stop
         if (abs(x0 - x1) < 1) and (abs(y0 - y1) < 1):
@@ -94,12 +146,20 @@ def get_first_matching_line_pixel(line: Line, matching_callback, surface: pygame
 def get_lidar_return(origin, max_range, theta, world) -> Point:
     """function used for sensors. Calculates coordinates for all pixels along 
     the line going from origin, in direction theta all the way to the max_range.
-    Then scans trhough and returns the coordinates of the first soil/ground pixel along the line"""
+    Then scans trhough and returns the coordinates of the first pixel along the line that scatters the light.
+    Bots are not part of the world raster, so they are intersected with the ray analytically,
+    and the closer of the terrain and bot hits is returned"""
+    bot_hit = world.entity_index.raycast(origin, theta, max_range, exclude=origin)
+    if bot_hit is not None:
+        # terrain behind the bot can't be seen, so the ray only needs to be traced up to the bot
+        max_range = bot_hit[0]
     # the pixel coordinates at max_range from origin in direction theta
     end_point = get_line_endpoint(origin, max_range, theta)
     # coordinates for all pixels along the ray
     line = Line(origin, end_point)
-    point = get_first_matching_line_pixel(line, material.is_light_scattering, world.surface)
+    point = get_first_matching_line_pixel(line, material.is_scattering, world.layers.scatter)
+    if point is None and bot_hit is not None:
+        return Point(int(end_point.x), int(end_point.y))
     return point
 
 
@@ -114,7 +174,7 @@ def clip(value, min, max):
 
 
 def screen2world(screen_point:Point, world):
-    return Point(screen_point.x - world.x, screen_point.y - world.y)
+    return Point((screen_point.x - world.x) / world.scale, (screen_point.y - world.y) / world.scale)
 
 def world2screen(world_point: Point, world):
-    return Point(world_point.x + world.x, world_point.y + world.y)
\ No newline at end of file
+    return Point(world_point.x * world.scale + world.x, world_point.y * world.scale + world.y)
\ No newline at end of file
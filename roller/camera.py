@@ -38,8 +38,8 @@ class Camera:
     def move(self, world, screen):
         """Updates the coordinates of the world object so that the camera's (x,y) coordiantes are int the middle of the screen
         (Since there is no such thing as moving the camera, we just move the world raster in reference to the screen)"""
-        world.x = - self.x + screen.get_width()/2
-        world.y = - self.y + screen.get_height()/2
+        world.x = - self.x * world.scale + screen.get_width()/2
+        world.y = - self.y * world.scale + screen.get_height()/2
 
     def update_pid(self, dt):
         """
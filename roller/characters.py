@@ -1,6 +1,10 @@
 """The characters module initializes a number of different Bot objects with various sensors and starting locations.
 
 Many of these Bots are mean't to be playable characters that the player can choose with the camera focus mechanic
+
+The characters are only built when they are first spawned (see `spawn`), so characters that aren't used
+in the game don't take up startup time or memory. They can also be accessed as attributes of this module,
+e.g. `characters.player1`, which spawns them.
 """
 
 import pygame
@@ -14,104 +18,153 @@ from roller import behaviours
 from roller import colors
 palette = colors.Cyberpunk
 
-player1 = Spherebot(
-    x = 800,  # world coordinates
-    y = 200, 
-    radius = 20,
-    color = palette.dark,
-    sensors = [
-        sensors.NAV1_InertiaCore(color = palette.yellow),
-        sensors.SpectraScan_LX1(color = palette.blue).disable() ,
-        sensors.SpectraScan_SX30(color = palette.blue, laser_count = 16) ,
-        # sensors.FOTIRS(),
-        # sensors.NAV1_InertiaCore(color = palette.pink).disable() ,
-
-    ],
-    keybinds = {
-        'left': pygame.K_LEFT, 
-        'right': pygame.K_RIGHT
-    },
-    has_camera = True
-);
-
-player2 = Spherebot(
-    x = 700,
-    y = 700,
-    keybinds = {
-        'left': pygame.K_a, 
-        'right': pygame.K_d
-    },
-    sensors = [
-        # sensors.SpectraScan_SX30(color=colors.orange),
-        sensors.SpectraScan_LX1(mount_angle=0),
-        sensors.SpectraScan_LX1(mount_angle=math.pi * 1/3),
-        sensors.SpectraScan_LX1(mount_angle=math.pi * 2/3),
-    ]
-)
 
-Aros  = Spherebot(
-    x = 700,
-    y = 700,
-    radius = 30,
-    color = (10,10,10),
-    sensors = [
-        sensors.SpectraScan_SX30(color=colors.orange, laser_count = 16),
-        sensors.NAV1_InertiaCore(color=colors.orange),
-    ],
-    keybinds = {
-        'left': pygame.K_q, 
-        'right': pygame.K_e
-    },
-)
+def create_player1():
+    player1 = Spherebot(
+        x = 800,  # world coordinates
+        y = 200, 
+        radius = 20,
+        color = palette.dark,
+        sensors = [
+            sensors.NAV1_InertiaCore(color = palette.yellow),
+            sensors.SpectraScan_LX1(color = palette.blue).disable() ,
+            sensors.SpectraScan_SX30(color = palette.blue, laser_count = 16) ,
+            # sensors.FOTIRS(),
+            # sensors.NAV1_InertiaCore(color = palette.pink).disable() ,
 
-Aros.add_behaviour(
-    behaviours.Blinking(
-        bot = Aros,               # Aros is controlling itself
-        sensor_index = 0,
-        duty_cycle = 0.2,
-        period = 0.5,
+        ],
+        keybinds = {
+            'left': pygame.K_LEFT, 
+            'right': pygame.K_RIGHT
+        },
+        has_camera = True
     )
-)
+    return player1
 
 
-Skiv  = Spherebot(
-    x = places['map5.png']['scrap_yard_exit'][0],
-    y = places['map5.png']['scrap_yard_exit'][1],
-    radius = 10,
-    color = (20,20,20),
-    sensors = [
-        sensors.NAV1_InertiaCore(color=colors.Cyberpunk.pink),
-        sensors.NAV1_InertiaCore(color=colors.Cyberpunk.pink, mount_angle=math.pi),
-        sensors.SpectraScan_LX1(color=colors.Cyberpunk.pink, mount_angle=math.pi/2),
-        sensors.SpectraScan_LX1(color=colors.Cyberpunk.pink, mount_angle=3*math.pi/2),
-    ],
+def create_player2():
+    player2 = Spherebot(
+        x = 700,
+        y = 700,
+        keybinds = {
+            'left': pygame.K_a, 
+            'right': pygame.K_d
+        },
+        sensors = [
+            # sensors.SpectraScan_SX30(color=colors.orange),
+            sensors.SpectraScan_LX1(mount_angle=0),
+            sensors.SpectraScan_LX1(mount_angle=math.pi * 1/3),
+            sensors.SpectraScan_LX1(mount_angle=math.pi * 2/3),
+        ]
+    )
+    return player2
 
-)
 
-elevator1 = Elevator(
-    x = places['map5.png']['elevator'][0],
-    y = places['map5.png']['elevator'][1],
-    color = (50,50,50),
-    sensors = [
-        sensors.SpectraScan_LX1(color=colors.Cyberpunk.yellow, retension_period = 0.5, mount_angle=math.pi/2),
-        sensors.SpectraScan_LX1(color=colors.Cyberpunk.yellow, retension_period = 0.5, mount_angle=3*math.pi/2),
-    ]
-)
-elevator1.add_behaviour(
-    behaviours.OscillateSensor(
-        bot = elevator1,
-        sensor_index = 0,
-        period = 2,
-        phi_min = np.radians(90-20),
-        phi_max = np.radians(90+20),
+def create_Aros():
+    Aros = Spherebot(
+        x = 700,
+        y = 700,
+        radius = 30,
+        color = (10,10,10),
+        sensors = [
+            sensors.SpectraScan_SX30(color=colors.orange, laser_count = 16),
+            sensors.NAV1_InertiaCore(color=colors.orange),
+        ],
+        keybinds = {
+            'left': pygame.K_q, 
+            'right': pygame.K_e
+        },
     )
-)
-elevator1.add_behaviour(
-    behaviours.OscillateSensor(
-        bot = elevator1,
-        sensor_index = 1,
-        period = 2,
-        phi_min = np.radians(270-20),
-        phi_max = np.radians(270+20),
+
+    Aros.add_behaviour(
+        behaviours.Blinking(
+            bot = Aros,               # Aros is controlling itself
+            sensor_index = 0,
+            duty_cycle = 0.2,
+            period = 0.5,
+        )
+    )
+    Aros.add_behaviour(
+        behaviours.NavigateToPlace(
+            bot = Aros,
+            place = 'scrap_yard',
+        )
+    )
+    return Aros
+
+
+def create_Skiv():
+    Skiv = Spherebot(
+        x = places['map5.png']['scrap_yard_exit'][0],
+        y = places['map5.png']['scrap_yard_exit'][1],
+        radius = 10,
+        color = (20,20,20),
+        sensors = [
+            sensors.NAV1_InertiaCore(color=colors.Cyberpunk.pink),
+            sensors.NAV1_InertiaCore(color=colors.Cyberpunk.pink, mount_angle=math.pi),
+            sensors.SpectraScan_LX1(color=colors.Cyberpunk.pink, mount_angle=math.pi/2),
+            sensors.SpectraScan_LX1(color=colors.Cyberpunk.pink, mount_angle=3*math.pi/2),
+            sensors.Sonar(color=colors.Cyberpunk.pink),
+        ],
+
     )
-)
\ No newline at end of file
+    return Skiv
+
+
+def create_elevator1():
+    elevator1 = Elevator(
+        x = places['map5.png']['elevator'][0],
+        y = places['map5.png']['elevator'][1],
+        color = (50,50,50),
+        platform_size = (80, 6),
+        sensors = [
+            sensors.SpectraScan_LX1(color=colors.Cyberpunk.yellow, retension_period = 0.5, mount_angle=math.pi/2),
+            sensors.SpectraScan_LX1(color=colors.Cyberpunk.yellow, retension_period = 0.5, mount_angle=3*math.pi/2),
+        ]
+    )
+    elevator1.add_behaviour(
+        behaviours.OscillateSensor(
+            bot = elevator1,
+            sensor_index = 0,
+            period = 2,
+            phi_min = np.radians(90-20),
+            phi_max = np.radians(90+20),
+        )
+    )
+    elevator1.add_behaviour(
+        behaviours.OscillateSensor(
+            bot = elevator1,
+            sensor_index = 1,
+            period = 2,
+            phi_min = np.radians(270-20),
+            phi_max = np.radians(270+20),
+        )
+    )
+    return elevator1
+
+
+definitions = dict(
+    player1 = create_player1,
+    player2 = create_player2,
+    Aros = create_Aros,
+    Skiv = create_Skiv,
+    elevator1 = create_elevator1,
+)
+"""The functions that build each character, keyed by the character's name"""
+
+spawned = {}
+"""The characters that have been built, keyed by name"""
+
+
+def spawn(name):
+    """Returns the character with the given name, building it the first time it is spawned"""
+    if name not in spawned:
+        spawned[name] = definitions[name]()
+    return spawned[name]
+
+
+def __getattr__(name):
+    """Characters are spawned when they are first accessed as attributes of the module"""
+    if name in definitions:
+        return spawn(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,141 @@
+"""
+The collision module implements continuous collision detection between moving bots and the terrain.
+
+`Spherebot.touch` only checks for ground pixels at the bot's position after it has moved, so a bot that
+moves more than its radius in one tick can pass through thin terrain. `get_time_of_impact` finds how far
+along its motion for the tick a bot can move before it first touches ground. The bot is stopped at the
+surface in the direction of the ground, slides along it for the rest of the tick, and collides normally on
+the next tick.
+
+A coarse `OccupancyGrid` of the ground layer is used to skip the pixel level test when the bot
+moves through open space. The grid of a paged world (see roller.paging) is filled in one chunk at a time,
+when it is first queried there, so it doesn't read the whole map.
+"""
+
+import math
+import numpy as np
+
+from roller import paging
+from roller import terrain
+from roller.config import g_config
+
+
+class OccupancyGrid:
+    """A coarse grid where each cell tells if there are any ground pixels in the corresponding
+    cell_size x cell_size block of the world raster. Kept up to date with terrain edits.
+
+    :param layers: the layers of the world (a CompiledMap or PagedMap)
+    :param cell_size: width and height in pixels of a grid cell
+    :param layer: the name of the layer whose pixels occupy the cells
+    :param threshold: if given, only pixels of the layer with values >= threshold occupy the cells.
+        Otherwise all non-zero pixels do
+    """
+
+    def __init__(self, layers, cell_size=None, layer="ground", threshold=None):
+        self.cell_size = g_config.occupancy_cell_size if cell_size is None else cell_size
+        self.layer = layer
+        self.threshold = threshold
+        width, height = layers.get_size()
+        self.cells = np.zeros((-(-width // self.cell_size), -(-height // self.cell_size)), dtype=np.bool_)
+        """True for cells that contain ground (or other occupying pixels), indexed [cx, cy].
+        Read it through get_cells, so the cells of a paged world are filled in first"""
+        self.layers = None
+        """The PagedMap the cells are filled in from, or None if all cells are filled in"""
+        if isinstance(layers, paging.PagedMap):
+            self.layers = layers
+            # the cells are filled in blocks that cover whole chunks of the map
+            self.block_cells = max(1, layers.chunk_size // self.cell_size)
+            self.filled = np.zeros((-(-self.cells.shape[0] // self.block_cells), -(-self.cells.shape[1] // self.block_cells)), dtype=np.bool_)
+            """Blocks of block_cells x block_cells cells that have been filled in"""
+            return
+        # the ground layer is read in vertical strips, so that only a strip is converted at a time
+        strip_width = self.cell_size * max(1, 1024 // self.cell_size)
+        for x in range(0, width, strip_width):
+            self.update_region(layers, x, 0, min(x + strip_width, width), height)
+
+    def get_cells(self, cx0, cy0, cx1, cy1):
+        """Returns the cells (cx0, cy0)...(cx1, cy1) (end exclusive, clipped to the grid), filling them in first
+        if the grid is of a paged world"""
+        cx0, cy0 = max(cx0, 0), max(cy0, 0)
+        cx1, cy1 = min(max(cx1, cx0), self.cells.shape[0]), min(max(cy1, cy0), self.cells.shape[1])
+        if self.layers is not None and cx0 < cx1 and cy0 < cy1:
+            blocks = self.block_cells
+            bx0, by0, bx1, by1 = cx0 // blocks, cy0 // blocks, -(-cx1 // blocks), -(-cy1 // blocks)
+            size = blocks * self.cell_size
+            for bx, by in zip(*np.nonzero(~self.filled[bx0:bx1, by0:by1])):
+                bx, by = int(bx) + bx0, int(by) + by0
+                self.filled[bx, by] = True
+                self.update_region(self.layers, bx * size, by * size, (bx + 1) * size, (by + 1) * size)
+        return self.cells[cx0:cx1, cy0:cy1]
+
+    def update_region(self, layers, x0, y0, x1, y1):
+        """Recompute the cells that overlap the pixels (x0, y0)...(x1, y1) (end exclusive)"""
+        size = self.cell_size
+        width, height = layers.get_size()
+        # expand the region to whole cells, within the map
+        cx0, cy0 = max(x0 // size, 0), max(y0 // size, 0)
+        cx1, cy1 = min(-(-x1 // size), self.cells.shape[0]), min(-(-y1 // size), self.cells.shape[1])
+        if cx0 >= cx1 or cy0 >= cy1:
+            return
+        occupied = np.zeros(((cx1 - cx0) * size, (cy1 - cy0) * size), dtype=np.bool_)
+        window = getattr(layers, self.layer)[cx0*size:min(cx1*size, width), cy0*size:min(cy1*size, height)]
+        if self.threshold is not None:
+            window = window >= self.threshold
+        occupied[:window.shape[0], :window.shape[1]] = window
+        self.cells[cx0:cx1, cy0:cy1] = occupied.reshape(cx1 - cx0, size, cy1 - cy0, size).any(axis=(1, 3))
+
+    def has_ground(self, x0, y0, x1, y1):
+        """Whether there may be ground pixels in the rectangle (x0, y0)...(x1, y1) (end exclusive)"""
+        size = self.cell_size
+        return bool(self.get_cells(x0 // size, y0 // size, -(-x1 // size), -(-y1 // size)).any())
+
+
+@terrain.register_derived_layer
+def update_occupancy(world, rect):
+    """Keeps world.occupancy up to date when the terrain is edited"""
+    if world.occupancy is not None:
+        world.occupancy.update_region(world.layers, rect.left, rect.top, rect.right, rect.bottom)
+
+
+def get_time_of_impact(world, x, y, radius, dx, dy):
+    """Sweep a circle from (x, y) along the motion (dx, dy), and find the first time it touches a ground pixel
+    that it wasn't already touching at the start. Ground pixels within radius + 1 of the start are left for
+    Spherebot.touch to handle, so a bot rolling along the ground doesn't stop on the pixels it grazes.
+
+    :returns: (fraction, normal_x, normal_y). The fraction 0...1 of the motion the circle can move before
+        touching new ground, and the unit normal of the ground at the point of contact, pointing away from it.
+        (1, 0, 0) if the motion is free
+    """
+    width, height = world.layers.get_size()
+    # the bounding box of the swept circle, clipped to the world
+    x0 = max(math.floor(min(x, x + dx) - radius), 0)
+    y0 = max(math.floor(min(y, y + dy) - radius), 0)
+    x1 = min(math.ceil(max(x, x + dx) + radius) + 1, width)
+    y1 = min(math.ceil(max(y, y + dy) + radius) + 1, height)
+    if x0 >= x1 or y0 >= y1 or not world.occupancy.has_ground(x0, y0, x1, y1):
+        return 1.0, 0.0, 0.0
+
+    ground_x, ground_y = np.nonzero(world.layers.ground[x0:x1, y0:y1])
+    if len(ground_x) == 0:
+        return 1.0, 0.0, 0.0
+
+    # solve |(x, y) + t*(dx, dy) - pixel| = radius for t, for every ground pixel at once
+    fx = x - (ground_x + x0)
+    fy = y - (ground_y + y0)
+    a = dx*dx + dy*dy
+    b = fx*dx + fy*dy
+    distance_squared = fx*fx + fy*fy
+    discriminant = b*b - a*(distance_squared - radius*radius)
+    # pixels that are not near the circle at the start, and are reached during the motion
+    entering = (distance_squared > (radius + 1)**2) & (discriminant > 0) & (b < 0)
+    if not entering.any():
+        return 1.0, 0.0, 0.0
+    t = (-b[entering] - np.sqrt(discriminant[entering])) / a
+    first = np.argmin(t)
+    if t[first] >= 1:
+        return 1.0, 0.0, 0.0
+    # at the time of impact the first pixel hit is exactly one radius away from the center
+    fraction = float(t[first])
+    normal_x = (fx[entering][first] + fraction*dx) / radius
+    normal_y = (fy[entering][first] + fraction*dy) / radius
+    return fraction, float(normal_x), float(normal_y)
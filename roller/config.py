@@ -25,6 +25,176 @@ class GameConfig:
     width: int = 1600
     """Window size in pixels if not in full screen mode"""
 
+    render_scale: float = 1.0
+    """Fraction of the display resolution that the world and sensor data are rendered at.
+    The world is drawn scaled down by the same factor onto an offscreen surface of this relative size,
+    which is then upscaled to the display once per frame, so the same part of the world stays visible. The overlay text is always drawn at native resolution.
+    Can be changed at runtime with the - and = keys"""
+    render_scale_step: float = 0.25
+    """How much the render_scale changes per key press"""
+    render_scale_min: float = 0.25
+    """The smallest allowed render_scale"""
+
+    overlay_refresh_hz: float = 0
+    """How many times per second the housekeeping overlay text is updated. 0 means on every frame"""
+
+    show_plots: bool = False
+    """Whether the real-time telemetry plots are drawn. Can be toggled at runtime with the P key"""
+
+    paged_world: bool = False
+    """When True, the world map is loaded in chunks as they are needed (see roller.paging) instead of all at once"""
+    world_chunk_size: int = 256
+    """Width and height in pixels of the chunks of a paged world map"""
+    world_max_chunks: int = 256
+    """How many chunks of a paged world map are kept in memory"""
+    world_prefetch_lookahead: int = 30
+    """How many game ticks ahead along a bot's velocity the chunks of a paged world map are prefetched"""
+
+    max_loaded_maps: int = 3
+    """How many maps the map registry keeps loaded at the same time (see roller.maps)"""
+
+    spatial_hash_cell_size: int = 64
+    """Width and height in pixels of the grid cells used to find nearby bots (see roller.spatial)"""
+
+    occupancy_cell_size: int = 16
+    """Width and height in pixels of the cells of the coarse ground occupancy grid (see roller.collision)"""
+    ccd_speed_fraction: float = 0.5
+    """Bots moving faster than this fraction of their radius per tick use continuous collision detection against the terrain"""
+
+    lod_sleep_speed: float = 0.5
+    """Bots touching the ground and moving slower than this (pixels per tick) are at rest (see roller.lod)"""
+    lod_sleep_omega: float = 0.01
+    """Bots rotating slower than this (radians per tick) are at rest"""
+    lod_sleep_ticks: int = 30
+    """How many consecutive ticks a bot has to be at rest before it goes to sleep"""
+    lod_far_distance: float = 1000
+    """Bots further than this many pixels outside the camera view are simulated at a reduced rate"""
+    lod_reduced_interval: int = 4
+    """Bots simulated at a reduced rate are simulated once every this many ticks"""
+
+    heat_cell_size: int = 8
+    """Width and height in pixels of the cells of the heat field (see roller.heat)"""
+
+    heat_block_size: int = 16
+    """Width and height in cells of the blocks the heat field is updated in. Only blocks that are not at equilibrium are updated"""
+
+    heat_update_hz: float = 10
+    """How many times per second the heat field is advanced"""
+
+    heat_diffusion_rate: float = 1.0
+    """How fast heat spreads to the neighbouring cells of the heat field, per second"""
+
+    heat_relaxation_rate: float = 0.05
+    """How fast the heat field returns to the temperature of the map, as a fraction per second"""
+
+    heat_cell_capacity: float = 20
+    """Heat capacity of a cell of the heat field in J/K. Smaller values make the environment heat up faster"""
+
+    heat_active_threshold: float = 0.01
+    """Blocks of the heat field that differ less than this many kelvin from the temperature of the map are put to rest"""
+
+    water_chunk_size: int = 64
+    """Width and height in pixels of the chunks the water simulation is stored and updated in (see roller.water)"""
+
+    water_max_fall_speed: float = 6
+    """The fastest water can fall, in pixels per tick"""
+
+    water_spread_passes: int = 4
+    """How many pixels per tick water can spread sideways. More passes level out pools faster"""
+
+    water_settle_ticks: int = 60
+    """A chunk of water where nothing has fallen for this many ticks is settled, and is no longer simulated"""
+
+    water_buoyancy: float = 1.5
+    """Upward force on a fully submerged bot, relative to gravity. Bots float when this is above 1"""
+
+    water_drag: float = 0.08
+    """Fraction of a fully submerged bot's velocity that is lost per tick in water"""
+
+    visibility_min_rays: int = 32
+    """Sensors with at least this many laser rays find their returns with one visibility sweep instead of tracing each ray (see roller.visibility)"""
+
+    visibility_angular_bins: int = 720
+    """Angular resolution of the visibility sweep"""
+
+    ray_cache_capacity: int = 2048
+    """The maximum number of lidar ray profiles kept in the ray cache (see roller.raycache)"""
+
+    ray_cache_position_step: float = 2
+    """Rays from origins closer than this many pixels to each other share a cached ray profile"""
+
+    ray_cache_angle_step: float = 0.002
+    """Rays with angles closer than this many radians to each other share a cached ray profile"""
+
+    ray_cache_tile_size: int = 128
+    """Size in pixels of the tiles used to find the cached rays that pass through an edited region of the terrain"""
+
+    memory_cell_size: int = 4
+    """Width and height in pixels of the cells of the bots' occupancy grid memory (see roller.memory)"""
+
+    memory_tile_size: int = 32
+    """Width and height in cells of the tiles the occupancy grid memory is redrawn in"""
+
+    memory_log_odds_hit: float = 0.85
+    """How much a lidar return increases the log-odds that the cell it scattered in is occupied"""
+
+    memory_log_odds_free: float = -0.4
+    """How much a lidar ray passing through a cell changes the log-odds that the cell is occupied"""
+
+    memory_log_odds_limit: float = 4
+    """The log-odds of the cells are clamped to +-this, so the memory can still change when the terrain changes"""
+
+    path_cell_size: int = 16
+    """Width and height in pixels of the cells of the grid paths are planned on (see roller.navigation). A multiple of memory_cell_size"""
+
+    path_climb_cost: float = 3.0
+    """The cost of climbing a step of one cell on a path, relative to rolling one cell sideways"""
+
+    path_replan_ticks: int = 5
+    """How many ticks bots navigating to a place roll towards the same cell before they look up their path again"""
+
+    audio_block_size: int = 1024
+    """Number of samples audio effects process at a time (see roller.effects)"""
+
+    music_volume: float = 0.3
+    """Volume of the ambient music (0...1, see roller.music)"""
+
+    music_block_size: int = 8192
+    """Number of samples of music synthesized and queued to the mixer at a time"""
+
+    mixer_voice_count: int = 8
+    """Number of mixer channels sound effects are played on (see roller.sounds.SoundManager)"""
+
+    sound_cache_capacity: int = 64
+    """The maximum number of generated sound effects that are kept in memory"""
+
+    collision_sound_speed: float = 1.0
+    """Bots that hit each other at least this fast (pixels per tick) make a sound, louder the faster they are"""
+
+    sonar_rings_per_tick: int = 2
+    """How many rings of cells the sound wave of a sonar spreads by on each tick (see roller.wavefront)"""
+
+    sonar_speed_of_sound: float = 3430
+    """Speed of sound in pixels per second, used for the echo times of the sonar"""
+
+    cpu_sample_period_ms: float = 1000
+    """How often the cpu usage shown in the performance overlay is measured"""
+
+    startup_budget_ms: float = 500
+    """The startup report printed after the first frame warns when the game took longer than this to start"""
+
+    snapshot_enabled: bool = True
+    """Whether snapshots the game can be rewound to are recorded (see roller.snapshots)"""
+
+    snapshot_period_ticks: int = 30
+    """How many ticks apart the snapshots are captured"""
+
+    snapshot_capacity: int = 60
+    """How many snapshots are kept. Older snapshots are dropped"""
+
+    snapshot_tile_size: int = 32
+    """Width and height of the tiles that changes to the sensor data surface (in pixels) and to the occupancy grid memory (in cells) are recorded in"""
+
     mixer_sample_frequency = 44100 
     """The sample frequency used by pygame.mixer audio output and other audio processing subsystems"""
     mixer_datatype = -16
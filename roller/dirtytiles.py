@@ -0,0 +1,42 @@
+"""
+The dirtytiles module keeps track of which parts of a 2d array, e.g. the pixels of a surface, were changed.
+
+Code that draws onto a tracked surface passes the rects returned by its pygame.draw calls to `DirtyTiles.add`,
+and code that needs to know what changed (see roller.snapshots) takes the tiles with `DirtyTiles.pop`,
+instead of comparing the whole array.
+"""
+
+import numpy as np
+
+
+class DirtyTiles:
+    """The set of tiles of an array indexed [x, y] that changed since they were last popped
+
+    :param tile_size: width and height of the tiles in array elements
+    """
+
+    def __init__(self, tile_size):
+        self.tile_size = tile_size
+        self.tiles = set()
+        """(tx, ty) of the changed tiles"""
+
+    def add(self, rect):
+        """Mark the tiles that a pygame.Rect overlaps as changed. Returns the rect, so a draw call can be
+        wrapped in this"""
+        if rect.width > 0 and rect.height > 0:
+            size = self.tile_size
+            for tx in range(rect.left // size, (rect.right - 1) // size + 1):
+                for ty in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                    self.tiles.add((tx, ty))
+        return rect
+
+    def add_indices(self, xs, ys):
+        """Mark the tiles of the elements at the [xs, ys] index arrays as changed"""
+        size = self.tile_size
+        tiles = np.unique((xs // size) * (1 << 32) + ys // size)
+        self.tiles.update(zip((tiles >> 32).tolist(), (tiles & 0xffffffff).tolist()))
+
+    def pop(self):
+        """Returns the changed tiles, and starts over with no changed tiles"""
+        tiles, self.tiles = self.tiles, set()
+        return tiles
@@ -0,0 +1,194 @@
+"""
+The effects module implements audio effects that process a waveform one block of samples at a time.
+
+Each effect keeps the state it needs between blocks (the output of a filter, the delay line of an
+echo, the position in a tremolo or an envelope), so a chain of effects gives the same result whether a
+whole waveform is processed at once (see `process_offline`) or it is streamed through the chain in
+blocks of any size. All the effects are vectorized over the samples of a block. Filters are run as
+a parallel prefix scan, so there is no loop over the samples.
+
+Blocks are float64 arrays of samples, in the same units as the waveform (e.g. -1...1, or int16 range).
+"""
+
+import numpy as np
+
+from roller.config import g_config
+
+sample_rate = g_config.mixer_sample_frequency
+
+
+def scan_one_pole(inputs, pole, state=0.0):
+    """Returns y[n] = inputs[n] + pole * y[n-1] for all n, where y[-1] is `state`.
+
+    The recurrence is computed in log2(n) vectorized passes: after the pass with distance d, every y[n]
+    is the sum of the 2d latest inputs weighted with the powers of the pole. Once the power of the pole
+    is negligible the older inputs don't matter, so filters that forget quickly take only a few passes.
+    """
+    outputs = np.array(inputs, dtype=np.float64)
+    if len(outputs) == 0:
+        return outputs
+    outputs[0] += pole * state
+    distance, power = 1, pole
+    while distance < len(outputs) and abs(power) > 1e-17:
+        outputs[distance:] += power * outputs[:-distance]
+        distance, power = distance * 2, power * power
+    return outputs
+
+
+class Effect:
+    """Base class for effects. An effect is called with each block of samples in order, and returns the
+    processed block of the same length"""
+
+    def process(self, block):
+        raise NotImplementedError()
+
+    def reset(self):
+        """Forget the state from the previous blocks, e.g. to start a new waveform"""
+        pass
+
+
+class LowPassFilter(Effect):
+    """First order low pass filter, y[n] = alpha * x[n] + (1 - alpha) * y[n-1]
+
+    :param cutoff_freq: the cutoff frequency in Hz
+    """
+
+    def __init__(self, cutoff_freq, sample_rate=sample_rate):
+        rc = 1 / (2 * np.pi * cutoff_freq)
+        self.alpha = sample_rate * rc / (sample_rate * rc + 1)
+        self.state = 0.0
+        """The last output sample of the previous block"""
+
+    def process(self, block):
+        output = scan_one_pole(self.alpha * np.asarray(block, dtype=np.float64), 1 - self.alpha, self.state)
+        if len(output):
+            self.state = output[-1]
+        return output
+
+    def reset(self):
+        self.state = 0.0
+
+
+class Echo(Effect):
+    """Adds one echo of the waveform, and halves the result
+
+    :param delay: the delay of the echo in seconds
+    :param decay: the amplitude of the echo relative to the waveform
+    """
+
+    def __init__(self, delay, decay, sample_rate=sample_rate):
+        self.delay_samples = int(delay * sample_rate)
+        self.decay = decay
+        self.history = np.zeros(self.delay_samples)
+        """The last delay_samples input samples"""
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if self.delay_samples == 0:
+            return block * (1 + self.decay) * 0.5
+        delayed = np.concatenate([self.history, block])
+        self.history = delayed[-self.delay_samples:]
+        return (block + self.decay * delayed[:len(block)]) * 0.5
+
+    def reset(self):
+        self.history = np.zeros(self.delay_samples)
+
+
+class Tremolo(Effect):
+    """Modulates the amplitude of the waveform between 0 and 1 with a sine wave
+
+    :param mod_freq: the frequency of the modulation in Hz
+    """
+
+    def __init__(self, mod_freq, sample_rate=sample_rate):
+        self.mod_freq = mod_freq
+        self.sample_rate = sample_rate
+        self.phase = 0.0
+        """The phase of the modulation at the next sample, in cycles. Kept in 0...1, so it stays precise for long streams"""
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        step = self.mod_freq / self.sample_rate
+        phase = self.phase + np.arange(len(block)) * step
+        self.phase = (self.phase + len(block) * step) % 1
+        return block * 0.5 * (1 + np.sin(2 * np.pi * phase))
+
+    def reset(self):
+        self.phase = 0.0
+
+
+class Envelope(Effect):
+    """Multiplies the waveform with a piecewise linear envelope. Samples after the last point are multiplied by its value
+
+    :param points: (sample index, value) of the corners of the envelope, in order of the index
+    """
+
+    def __init__(self, points):
+        self.indices = np.maximum.accumulate(np.array([index for index, _ in points], dtype=np.float64))
+        self.values = np.array([value for _, value in points], dtype=np.float64)
+        self.position = 0
+        """The index of the next sample in the waveform"""
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        envelope = np.interp(self.position + np.arange(len(block)), self.indices, self.values)
+        self.position += len(block)
+        return block * envelope
+
+    def reset(self):
+        self.position = 0
+
+
+def adsr_envelope(length, attack=0.3, decay=0.5, sustain_level=0.3, release=0.5, sample_rate=sample_rate):
+    """Returns the Envelope of a note of `length` samples: a linear attack to 1 and decay to the sustain level,
+    then full amplitude until the release from the sustain level to 0 at the end of the note. Times are in seconds.
+    Where the phases overlap in a short note, the later phase is used"""
+    attack_samples = int(attack * sample_rate)
+    decay_samples = int(decay * sample_rate)
+    release_start = length - int(release * sample_rate)
+    # (first sample, number of samples, first value, last value) of each phase, spaced like np.linspace
+    phases = [
+        (0, attack_samples, 0.0, 1.0),
+        (attack_samples, decay_samples, 1.0, sustain_level),
+        (attack_samples + decay_samples, release_start - attack_samples - decay_samples, 1.0, 1.0),
+        (release_start, length - release_start, sustain_level, 0.0),
+    ]
+    points = []
+    for index, (start, count, first_value, last_value) in enumerate(phases):
+        end = min([start + count] + [later_start for later_start, _, _, _ in phases[index + 1:]])
+        if end > start:
+            step = (last_value - first_value) / (count - 1) if count > 1 else 0
+            points += [(start, first_value), (end - 1, first_value + step * (end - 1 - start))]
+    return Envelope(points)
+
+
+def fade_envelope(length, attack_time, decay_time, sample_rate=sample_rate):
+    """Returns the Envelope of a note of `length` samples that fades in over attack_time and out over decay_time seconds"""
+    attack_samples = int(attack_time * sample_rate)
+    decay_samples = int(decay_time * sample_rate)
+    return Envelope([(0, 0.0 if attack_samples > 0 else 1.0), (attack_samples - 1, 1.0), (length - decay_samples, 1.0), (length - 1, 0.0)])
+
+
+class Chain(Effect):
+    """Runs each block through several effects in order"""
+
+    def __init__(self, *effects):
+        self.effects = list(effects)
+
+    def process(self, block):
+        for effect in self.effects:
+            block = effect.process(block)
+        return block
+
+    def reset(self):
+        for effect in self.effects:
+            effect.reset()
+
+
+def process_offline(effect, wave, block_size=None):
+    """Process a whole waveform with an effect, in blocks of g_config.audio_block_size samples"""
+    block_size = g_config.audio_block_size if block_size is None else block_size
+    wave = np.asarray(wave, dtype=np.float64)
+    if len(wave) == 0:
+        return wave
+    return np.concatenate([effect.process(wave[start:start + block_size]) for start in range(0, len(wave), block_size)])
@@ -0,0 +1,114 @@
+"""
+The heat module simulates how heat given off by the bots' sensors spreads through the environment.
+
+The ambient temperature of the world is the temperature layer (the HEATMAP channel) of the map. On top of
+that, a `HeatField` keeps a coarse grid of how much warmer (or colder) each cell currently is than the map
+says. Sensors that dissipate heat deposit it into the cell their bot is in, where it diffuses to the
+neighbouring cells and slowly relaxes back to the map's temperature. Bots clustered around hot sensors
+therefore heat each other up.
+
+The field is advanced at `g_config.heat_update_hz`, which is lower than the frame rate. Only blocks of cells
+that are away from equilibrium are updated (the active blocks), so the cost depends on how much of the
+map has been heated, not on the size of the map.
+"""
+
+import numpy as np
+
+from roller.config import g_config
+
+
+class HeatField:
+    """:param layers: the layers of the world (a CompiledMap or PagedMap)"""
+
+    def __init__(self, layers):
+        self.cell_size = g_config.heat_cell_size
+        self.block_size = g_config.heat_block_size
+        width, height = layers.get_size()
+        self.excess = np.zeros((-(-width // self.cell_size), -(-height // self.cell_size)), dtype=np.float64)
+        """Temperature difference in kelvin to the temperature layer of the map, indexed [cx, cy]"""
+        self.active_blocks = set()
+        """(bx, by) of the blocks of block_size x block_size cells that are not at equilibrium"""
+        self.time_since_step = 0
+        self.step_count = 0
+
+    def get_cells(self, xs, ys):
+        """Returns the cell coordinates of world positions, clipped to the grid"""
+        cxs = np.clip(np.asarray(xs, dtype=np.intp) // self.cell_size, 0, self.excess.shape[0] - 1)
+        cys = np.clip(np.asarray(ys, dtype=np.intp) // self.cell_size, 0, self.excess.shape[1] - 1)
+        return cxs, cys
+
+    def get_excess(self, xs, ys):
+        """Returns how much warmer than the temperature layer the world is at the positions"""
+        return self.excess[self.get_cells(xs, ys)]
+
+    def deposit(self, xs, ys, energy):
+        """Add heat to the cells at the positions.
+
+        :param energy: heat in joules for each position. Negative values cool the cell
+        """
+        cxs, cys = self.get_cells(xs, ys)
+        np.add.at(self.excess, (cxs, cys), np.asarray(energy) / g_config.heat_cell_capacity)
+        for cx, cy in zip((cxs // self.block_size).tolist(), (cys // self.block_size).tolist()):
+            self.active_blocks.add((cx, cy))
+
+    def update(self, dt):
+        """Advance the field by `dt` seconds, in steps of 1 / g_config.heat_update_hz seconds"""
+        step_length = 1 / g_config.heat_update_hz
+        self.time_since_step += dt
+        while self.time_since_step >= step_length:
+            self.time_since_step -= step_length
+            self.step(step_length)
+
+    def get_block_window(self, bx, by):
+        """Returns the cell range (x0, y0, x1, y1) of a block, clipped to the grid"""
+        width, height = self.excess.shape
+        x0, y0 = bx * self.block_size, by * self.block_size
+        return x0, y0, min(x0 + self.block_size, width), min(y0 + self.block_size, height)
+
+    def step(self, dt):
+        """Diffuse and relax the active blocks by one step of `dt` seconds"""
+        self.step_count += 1
+        # the explicit diffusion stencil is only stable up to 0.25
+        diffusion = min(g_config.heat_diffusion_rate * dt, 0.25)
+        relaxation = min(g_config.heat_relaxation_rate * dt, 1.0)
+        width, height = self.excess.shape
+
+        # all blocks are computed from the values of the previous step before any of them are written
+        updates = []
+        for bx, by in self.active_blocks:
+            x0, y0, x1, y1 = self.get_block_window(bx, by)
+            # the block with a border of one cell from the neighbouring blocks. At the
+            # edges of the map the border repeats the edge cells, so no heat flows out of the map
+            window = self.excess[max(x0 - 1, 0):min(x1 + 1, width), max(y0 - 1, 0):min(y1 + 1, height)]
+            window = np.pad(window, ((int(x0 == 0), int(x1 == width)), (int(y0 == 0), int(y1 == height))), mode="edge")
+            center = window[1:-1, 1:-1]
+            laplacian = window[:-2, 1:-1] + window[2:, 1:-1] + window[1:-1, :-2] + window[1:-1, 2:] - 4 * center
+            updates.append((bx, by, center + diffusion * laplacian - relaxation * center))
+
+        threshold = g_config.heat_active_threshold
+        blocks_x = -(-width // self.block_size)
+        blocks_y = -(-height // self.block_size)
+        for bx, by, values in updates:
+            x0, y0, x1, y1 = self.get_block_window(bx, by)
+            magnitude = np.abs(values)
+            if magnitude.max() < threshold:
+                # the remaining difference is too small to matter
+                self.excess[x0:x1, y0:y1] = 0
+                self.active_blocks.discard((bx, by))
+                continue
+            self.excess[x0:x1, y0:y1] = values
+            # heat spreads to the neighbouring blocks through the edges of the block
+            if bx > 0 and magnitude[0, :].max() >= threshold:
+                self.active_blocks.add((bx - 1, by))
+            if bx < blocks_x - 1 and magnitude[-1, :].max() >= threshold:
+                self.active_blocks.add((bx + 1, by))
+            if by > 0 and magnitude[:, 0].max() >= threshold:
+                self.active_blocks.add((bx, by - 1))
+            if by < blocks_y - 1 and magnitude[:, -1].max() >= threshold:
+                self.active_blocks.add((bx, by + 1))
+
+    def get_housekeeping(self):
+        return {
+            "active_blocks": len(self.active_blocks),
+            "steps": self.step_count,
+        }
@@ -0,0 +1,76 @@
+"""
+The lod module decides how much simulation each bot gets on each game tick (simulation level-of-detail).
+
+- AWAKE bots are simulated fully on every tick.
+- SLEEPING bots are resting on the ground. Their physics and sensors are skipped until something wakes
+  them up: player or behaviour input, a collision with another bot, or an edit of the terrain around them.
+- REDUCED bots are far outside the camera view. They are simulated and run their sensors only every
+  `g_config.lod_reduced_interval` ticks, with a correspondingly larger time step.
+
+Each tick `LevelOfDetail.update` sets `bot.lod_steps` to the number of ticks the bot should be advanced by
+on this tick. 0 means the bot is skipped on this tick.
+"""
+
+from enum import Enum, auto
+
+from roller import terrain
+from roller.config import g_config
+
+
+class SimulationLOD(Enum):
+    AWAKE = auto(),
+    SLEEPING = auto(),
+    REDUCED = auto(),
+
+
+class LevelOfDetail:
+
+    def __init__(self):
+        self.tick = 0
+        self.counts = {lod: 0 for lod in SimulationLOD}
+        """How many bots were at each level of detail on the latest tick"""
+
+    def get_lod(self, entity, camera_rect):
+        """Returns the SimulationLOD of an entity.
+
+        :param camera_rect: (x0, y0, x1, y1) of the visible part of the world in world coordinates
+        """
+        if entity.is_sleeping:
+            return SimulationLOD.SLEEPING
+        # bots controlled by a player are always fully simulated
+        if entity.joystick is not None:
+            return SimulationLOD.AWAKE
+        x0, y0, x1, y1 = camera_rect
+        margin = g_config.lod_far_distance
+        if x0 - margin < entity.x < x1 + margin and y0 - margin < entity.y < y1 + margin:
+            return SimulationLOD.AWAKE
+        return SimulationLOD.REDUCED
+
+    def update(self, entities, camera_rect):
+        """Set `lod_steps` for all entities for the current tick"""
+        self.tick += 1
+        interval = g_config.lod_reduced_interval
+        self.counts = {lod: 0 for lod in SimulationLOD}
+        for i, entity in enumerate(entities):
+            entity.lod = self.get_lod(entity, camera_rect)
+            self.counts[entity.lod] += 1
+            if entity.lod == SimulationLOD.REDUCED:
+                # the entities are spread over the ticks, so they are not all simulated on the same tick
+                entity.lod_steps = interval if (self.tick + i) % interval == 0 else 0
+            else:
+                entity.lod_steps = 1
+
+    def get_housekeeping(self):
+        return {lod.name.lower(): count for lod, count in self.counts.items()}
+
+
+@terrain.register_derived_layer
+def wake_bots_near_edit(world, rect):
+    """Bots resting on or near terrain that is edited need to be woken up, e.g. the ground below them may be gone"""
+    if world.entity_index is None:
+        return
+    for entity in world.entity_index.query_rect(rect.left, rect.top, rect.right, rect.bottom):
+        entity.wake()
+
+
+g_lod = LevelOfDetail()
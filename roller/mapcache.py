@@ -0,0 +1,160 @@
+"""
+The mapcache module compiles world raster images into a cache file that holds the
+raster's color channels and the layers derived from them (ground, scattering probability,
+temperature) as plain arrays. The cache file is memory-mapped when loaded, so no image
+decoding or per-pixel color interpretation needs to happen at startup or during the game.
+
+The cache file is keyed by a hash of the source image, and is only rebuilt when the image changes.
+All layers are indexed like pygame.surfarray arrays, i.e `layer[x, y]`.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+import pygame
+
+from roller import material
+
+CACHE_VERSION = 2
+"""Increment this when the cache file format or the way layers are derived changes, so old cache files are rebuilt"""
+
+CACHE_DIR = "roller/assets/cache"
+"""Default directory where compiled maps are stored"""
+
+MAGIC = b"ROLLMAP\0"
+ALIGNMENT = 64
+"""Each layer starts at a file offset that is a multiple of this"""
+
+
+def derive_ground(channels):
+    """Vectorized version of colors.is_ground_color. Pure black pixels are ground"""
+    return ~channels.any(axis=2)
+
+def derive_scatter(channels):
+    """Vectorized version of material.get_scattering_probability for the SCATTERMAP channel"""
+    return (1 - channels[:, :, material.SCATTERMAP].astype(np.float32) / 255) ** 2
+
+def derive_temperature(channels):
+    """The HEATMAP channel directly represents the ambient temperature in celcius"""
+    return channels[:, :, material.HEATMAP].astype(np.float32)
+
+def derive_water(channels):
+    """Vectorized version of colors.is_water_color. Pixels with only a blue component are water"""
+    return (channels[:, :, 0] == 0) & (channels[:, :, 1] == 0) & (channels[:, :, 2] > 0)
+
+LAYERS = {
+    # name: (dtype, function that derives the layer from the channels)
+    "ground": (np.bool_, derive_ground),
+    "scatter": (np.float32, derive_scatter),
+    "temperature": (np.float32, derive_temperature),
+    "water": (np.bool_, derive_water),
+}
+"""Derived layers that are stored in the cache file in addition to the raw channels"""
+
+
+class CompiledMap:
+    """The layers of a compiled world raster. Each layer is available as an attribute with the layer's name.
+
+    :param source: path to the image the map was compiled from
+    :param layers: dict of layer name to array. Must contain at least "channels"
+    """
+
+    def __init__(self, source, layers: dict):
+        self.source = source
+        self.layers = layers
+        for name, layer in layers.items():
+            setattr(self, name, layer)
+
+    def get_size(self):
+        """The (width, height) of the map in pixels"""
+        return self.channels.shape[:2]
+
+    def make_surface(self):
+        """Create a pygame Surface from the color channels of the map.
+        Requires that the display mode has been set, as the surface is converted to the display format"""
+        return pygame.surfarray.make_surface(self.channels).convert()
+
+
+def get_source_hash(source):
+    """Returns a hex digest identifying the contents of the source image and the cache format version"""
+    digest = hashlib.sha1(f"{CACHE_VERSION}".encode())
+    with open(source, "rb") as file:
+        digest.update(file.read())
+    return digest.hexdigest()
+
+def get_cache_path(source, cache_dir=CACHE_DIR):
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(cache_dir, f"{name}-{get_source_hash(source)}.rollmap")
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def compile_map(source, cache_path):
+    """Decode the source image and write the channels and all derived layers into `cache_path`."""
+    channels = pygame.surfarray.array3d(pygame.image.load(source))
+    layers = dict(channels=channels)
+    for name, (dtype, derive) in LAYERS.items():
+        layers[name] = derive(channels).astype(dtype)
+
+    # The header describes where in the file each layer is stored.
+    # It's written after we know its length, so the layer offsets are computed relative to the header end
+    header = dict(source=os.path.basename(source), layers={})
+    offset = 0
+    for name, layer in layers.items():
+        header["layers"][name] = dict(dtype=layer.dtype.str, shape=list(layer.shape), offset=offset)
+        offset = _align(offset + layer.nbytes)
+    header_bytes = json.dumps(header).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    temporary_path = cache_path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(len(header_bytes).to_bytes(8, "little"))
+        file.write(header_bytes)
+        for name, layer in layers.items():
+            file.seek(data_start + header["layers"][name]["offset"])
+            file.write(np.ascontiguousarray(layer).tobytes())
+    # the rename makes sure a partially written cache is never loaded
+    os.replace(temporary_path, cache_path)
+
+def read_map(cache_path, source=None):
+    """Memory-map all layers of a compiled map. The memory maps are copy-on-write,
+    so changes to the layers are never written back to the cache file"""
+    with open(cache_path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{cache_path} is not a compiled map")
+        header_length = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(header_length))
+    data_start = _align(len(MAGIC) + 8 + header_length)
+
+    layers = {}
+    for name, layout in header["layers"].items():
+        # np.asarray drops the memmap subclass (but keeps the mapping), which makes indexing the layers faster
+        layers[name] = np.asarray(np.memmap(
+            cache_path,
+            dtype=np.dtype(layout["dtype"]),
+            mode="c",
+            offset=data_start + layout["offset"],
+            shape=tuple(layout["shape"]),
+        ))
+    return CompiledMap(source or header["source"], layers)
+
+def remove_stale_caches(source, cache_path):
+    """Delete cache files (and files derived from them) compiled from previous versions of the source image"""
+    name = os.path.splitext(os.path.basename(source))[0]
+    current = os.path.splitext(os.path.basename(cache_path))[0]
+    cache_dir = os.path.dirname(cache_path)
+    for filename in os.listdir(cache_dir):
+        if filename.startswith(f"{name}-") and not filename.startswith(current):
+            os.remove(os.path.join(cache_dir, filename))
+
+def load_map(source, cache_dir=CACHE_DIR) -> CompiledMap:
+    """Returns the compiled map for the source image, compiling it first if there is
+    no cache file for the current contents of the image"""
+    cache_path = get_cache_path(source, cache_dir)
+    if not os.path.exists(cache_path):
+        compile_map(source, cache_path)
+        remove_stale_caches(source, cache_path)
+    return read_map(cache_path, source)
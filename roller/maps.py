@@ -0,0 +1,163 @@
+"""
+The maps module keeps track of the world maps shipped in roller/assets. Maps are resolved by
+name (e.g "map5.png", the same keys as used in roller.places), loaded when they are first needed,
+and kept in a bounded LRU so that moving back and forth between levels doesn't reload them.
+
+Maps can be loaded ahead of time in a background thread with `MapRegistry.prefetch`, e.g. by code
+that is about to switch the world to another map.
+"""
+
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import pygame
+
+from roller import mapcache
+from roller import paging
+from roller.config import g_config
+
+ASSET_DIR = "roller/assets"
+
+
+class LoadedMap:
+    """A decoded map and the layers derived from it.
+
+    :param name: the name of the map, e.g. "map5.png"
+    :param layers: a CompiledMap, or a PagedMap if g_config.paged_world is set
+    :param surface: a Surface with the whole map, or None for paged maps, and when g_config.debug is off
+    """
+
+    def __init__(self, name, layers, surface):
+        self.name = name
+        self.layers = layers
+        self.surface = surface
+        self.occupancy = None
+        """Coarse ground occupancy grid of the map (see roller.collision), created when the map is entered"""
+        self.heat = None
+        """Heat given off by the bots into the map (see roller.heat), created when the map is entered. Paged maps have none"""
+        self.water = None
+        """Water flowing in the map (see roller.water), created when the map is entered. Paged maps have none"""
+        self.opacity = None
+        """Coarse grid of where light is scattered in the map (see roller.visibility), created when the map is entered.
+        Paged maps have none, their sensors trace each ray"""
+
+    def close(self):
+        """Release the file and the thread a paged map holds, when the map is evicted"""
+        if isinstance(self.layers, paging.PagedMap):
+            self.layers.close()
+
+
+class MapRegistry:
+    """Resolves maps by name and keeps the most recently used ones loaded.
+
+    :param asset_dir: directory the map images are in
+    :param max_maps: how many maps are kept loaded at the same time
+    """
+
+    def __init__(self, asset_dir=ASSET_DIR, max_maps=None):
+        self.asset_dir = asset_dir
+        self.max_maps = g_config.max_loaded_maps if max_maps is None else max_maps
+
+        self.maps = OrderedDict()
+        """Loaded maps keyed by name. Least recently used maps are first"""
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        """Maps that had to be loaded in the game loop, because they had not been prefetched"""
+        self.prefetched = 0
+        self.evictions = 0
+
+        self.prefetch_queue = queue.Queue()
+        self.pending = set()
+        """Names of maps that are in the prefetch queue"""
+        self.prefetch_thread = None
+        """Started on the first prefetch"""
+
+    def resolve(self, name):
+        """Returns the path to the image of the named map. The .png extension can be left out"""
+        if not name.endswith(".png"):
+            name = name + ".png"
+        path = os.path.join(self.asset_dir, name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No map named {name} in {self.asset_dir}")
+        return path
+
+    def load(self, name, convert=True):
+        """Decode the named map from its compiled cache. The surface of the whole map is only
+        made when g_config.debug is set, since in normal play it is not drawn and making it takes a
+        large part of the startup time
+
+        :param convert: Convert the surface to the display format. Only possible from the main thread
+        """
+        path = self.resolve(name)
+        if g_config.paged_world:
+            return LoadedMap(name, paging.load_paged_map(path), None)
+        layers = mapcache.load_map(path)
+        if not g_config.debug:
+            return LoadedMap(name, layers, None)
+        surface = layers.make_surface() if convert else pygame.surfarray.make_surface(layers.channels)
+        return LoadedMap(name, layers, surface)
+
+    def insert(self, loaded_map):
+        evicted = []
+        with self.lock:
+            self.maps[loaded_map.name] = loaded_map
+            self.maps.move_to_end(loaded_map.name)
+            while len(self.maps) > self.max_maps:
+                evicted.append(self.maps.popitem(last=False)[1])
+                self.evictions += 1
+        # closing waits for the prefetch thread of a paged map, so it's done outside the lock
+        for evicted_map in evicted:
+            evicted_map.close()
+
+    def get(self, name) -> LoadedMap:
+        """Returns the named map, loading it if it's not loaded yet"""
+        with self.lock:
+            loaded_map = self.maps.get(name)
+            if loaded_map is not None:
+                self.maps.move_to_end(name)
+                self.hits += 1
+                return loaded_map
+            self.misses += 1
+        loaded_map = self.load(name)
+        self.insert(loaded_map)
+        return loaded_map
+
+    def prefetch(self, name):
+        """Queue the named map to be loaded by the background thread, unless it's already loaded or queued"""
+        with self.lock:
+            if name in self.maps or name in self.pending:
+                return
+            self.pending.add(name)
+            if self.prefetch_thread is None:
+                self.prefetch_thread = threading.Thread(target=self.run_prefetching, daemon=True)
+                self.prefetch_thread.start()
+        self.prefetch_queue.put(name)
+
+    def run_prefetching(self):
+        """Loop of the background thread that loads the maps in the prefetch queue"""
+        while True:
+            name = self.prefetch_queue.get()
+            with self.lock:
+                is_loaded = name in self.maps
+            if not is_loaded:
+                # the surface is not converted, since that is only safe to do from the main thread.
+                # In normal play world.surface is not drawn, so the surface format does not matter
+                self.insert(self.load(name, convert=False))
+                self.prefetched += 1
+            with self.lock:
+                self.pending.discard(name)
+
+    def get_housekeeping(self):
+        return dict(
+            loaded_maps = list(self.maps.keys()),
+            hits = self.hits,
+            misses = self.misses,
+            prefetched = self.prefetched,
+            evictions = self.evictions,
+        )
+
+
+g_maps = MapRegistry()
@@ -29,10 +29,17 @@ def get_scattering_probability(scattermap_value: int):
     return (1 - scattermap_value / 255) ** 2
 
 def get_temperature_at(point: Point, world):
-    pixel_color = world.surface.get_at((int(point.x),int(point.y)))
-    temperature = pixel_color[HEATMAP]
+    # the temperature layer is the HEATMAP channel precompiled by roller.mapcache
+    temperature = float(world.layers.temperature[int(point.x), int(point.y)])
+    # heat given off by sensors nearby (see roller.heat)
+    if world.heat is not None:
+        temperature += float(world.heat.get_excess(point.x, point.y))
     return temperature
 
+def is_scattering(scattering_probability: float):
+    """Randomly decides if light is scattered, given the scattering probability of a pixel from the `scatter` layer of the world"""
+    return random.random() < scattering_probability
+
 def is_light_scattering(pixel_color: tuple):
     scattering_propability =  get_scattering_probability(pixel_color[SCATTERMAP])
     return random.random() < scattering_propability
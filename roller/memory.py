@@ -0,0 +1,139 @@
+"""
+The memory module implements the bots' memory bank for sensor data, as a probabilistic occupancy grid.
+
+The world is divided into cells of `g_config.memory_cell_size` pixels. Each cell holds the log-odds that it
+is occupied by something that reflects light. Every lidar return (a `Line` from the bot to the point the
+light scattered at) is evidence that the cells along the ray are free, and that the cell at its end is
+occupied. The returns of all the lidars are collected during a tick and added to the grid at once, and only
+the cells that changed are redrawn onto `world.memory_grid_surface`. The grid has a surface of its own, since
+redrawing a cell overwrites its pixels, and other sensors draw onto `world.memory`.
+"""
+
+import numpy as np
+import pygame
+
+from roller import colors
+from roller.config import g_config
+from roller.dirtytiles import DirtyTiles
+
+
+class OccupancyMemory:
+    """:param size: (width, height) of the world in pixels
+    :param cell_size: width and height in pixels of a grid cell"""
+
+    def __init__(self, size, cell_size=None):
+        self.cell_size = g_config.memory_cell_size if cell_size is None else cell_size
+        self.size = size
+        shape = (-(-size[0] // self.cell_size), -(-size[1] // self.cell_size))
+        self.log_odds = np.zeros(shape, dtype=np.float32)
+        """Log-odds of each cell being occupied, indexed [cx, cy]. 0 means unknown"""
+        self.dirty = np.zeros(shape, dtype=np.bool_)
+        """Cells that changed since they were last rendered"""
+        self.dirty_tiles = set()
+        """(tx, ty) of the tiles of g_config.memory_tile_size cells that have dirty cells"""
+        self.changed_tiles = DirtyTiles(g_config.snapshot_tile_size)
+        """The tiles of the log-odds that changed since the latest snapshot (see roller.snapshots)"""
+        self.pending = []
+        """Arrays of [x0, y0, x1, y1] of the lidar returns added during this tick"""
+        self.color = np.array(colors.Cyberpunk.gray, dtype=np.uint8)
+        self.ray_count = 0
+        """The number of lidar returns added on the latest update"""
+        self.updates = 0
+        """The number of updates that added lidar returns, so users of the grid can tell when it changed"""
+
+    def add_lines(self, lines):
+        """Add lidar returns to be included in the next update"""
+        if lines:
+            self.pending.append(np.array([(line.start.x, line.start.y, line.end.x, line.end.y) for line in lines], dtype=np.float32))
+
+    def update(self):
+        """Add all the lidar returns of this tick to the grid at once"""
+        self.ray_count = 0
+        if not self.pending:
+            return
+        rays = np.concatenate(self.pending)
+        self.pending = []
+        size = self.cell_size
+        width, height = self.log_odds.shape
+
+        # the cells the rays hit. Returns are always inside the world
+        hit_x = np.clip((rays[:, 2] // size).astype(np.intp), 0, width - 1)
+        hit_y = np.clip((rays[:, 3] // size).astype(np.intp), 0, height - 1)
+
+        # sample every ray twice per cell, from its start up to its end
+        dx = rays[:, 2] - rays[:, 0]
+        dy = rays[:, 3] - rays[:, 1]
+        samples = np.maximum(np.ceil(np.hypot(dx, dy) * 2 / size).astype(np.intp), 1)
+        ray = np.repeat(np.arange(len(rays)), samples)
+        t = (np.arange(samples.sum()) - np.repeat(np.cumsum(samples) - samples, samples)) / samples[ray]
+        free_x = np.clip(((rays[ray, 0] + t * dx[ray]) // size).astype(np.intp), 0, width - 1)
+        free_y = np.clip(((rays[ray, 1] + t * dy[ray]) // size).astype(np.intp), 0, height - 1)
+        free_cells = free_x * height + free_y
+        hit_cells = hit_x * height + hit_y
+        # the hit cell is not free, and each ray counts only once for each cell it passes. A straight ray
+        # never returns to a cell, so its repeated samples of a cell are next to each other
+        first_sample = np.ones(len(ray), dtype=np.bool_)
+        first_sample[1:] = (free_cells[1:] != free_cells[:-1]) | (ray[1:] != ray[:-1])
+        free_cells = free_cells[first_sample & (free_cells != hit_cells[ray])]
+
+        log_odds = self.log_odds.reshape(-1)
+        np.add.at(log_odds, free_cells, g_config.memory_log_odds_free)
+        np.add.at(log_odds, hit_cells, g_config.memory_log_odds_hit)
+        changed = np.concatenate([free_cells, hit_cells])
+        # clamping keeps the memory able to change its mind, e.g. when the terrain changes
+        log_odds[changed] = np.clip(log_odds[changed], -g_config.memory_log_odds_limit, g_config.memory_log_odds_limit)
+
+        self.dirty.reshape(-1)[changed] = True
+        self.changed_tiles.add_indices(changed // height, changed % height)
+        tile_size = g_config.memory_tile_size
+        tiles = np.zeros((-(-width // tile_size), -(-height // tile_size)), dtype=np.bool_)
+        tiles[changed // height // tile_size, changed % height // tile_size] = True
+        self.dirty_tiles.update(zip(*(indices.tolist() for indices in np.nonzero(tiles))))
+        self.ray_count = len(rays)
+        self.updates += 1
+
+    def invalidate(self, cx0, cy0, cx1, cy1):
+        """Redraw the cells cx0...cx1, cy0...cy1 (end exclusive) on the next render, e.g. after the
+        log-odds have been set directly"""
+        self.dirty[cx0:cx1, cy0:cy1] = True
+        tile_size = g_config.memory_tile_size
+        width, height = self.log_odds.shape
+        for tx in range(cx0 // tile_size, -(-min(cx1, width) // tile_size)):
+            for ty in range(cy0 // tile_size, -(-min(cy1, height) // tile_size)):
+                self.dirty_tiles.add((tx, ty))
+
+    def render(self, surface):
+        """Redraw the dirty cells onto the surface. Occupied cells are drawn more opaque the more certain they are"""
+        if not self.dirty_tiles:
+            return
+        size = self.cell_size
+        tile_size = g_config.memory_tile_size
+        rgb = pygame.surfarray.pixels3d(surface)
+        alpha = pygame.surfarray.pixels_alpha(surface)
+        width, height = surface.get_size()
+        for tx, ty in self.dirty_tiles:
+            cells = (slice(tx * tile_size, (tx + 1) * tile_size), slice(ty * tile_size, (ty + 1) * tile_size))
+            dirty = self.dirty[cells].copy()
+            certainty = np.clip(self.log_odds[cells] / g_config.memory_log_odds_limit, 0, 1)
+            self.dirty[cells] = False
+
+            # scale the cells up to pixels, clipped to the surface
+            x0, y0 = tx * tile_size * size, ty * tile_size * size
+            x1, y1 = min(x0 + dirty.shape[0] * size, width), min(y0 + dirty.shape[1] * size, height)
+            mask = dirty.repeat(size, axis=0).repeat(size, axis=1)[:x1 - x0, :y1 - y0]
+            cell_alpha = (certainty * 255).astype(np.uint8).repeat(size, axis=0).repeat(size, axis=1)[:x1 - x0, :y1 - y0]
+            alpha[x0:x1, y0:y1][mask] = cell_alpha[mask]
+            rgb[x0:x1, y0:y1][mask] = self.color
+        self.dirty_tiles.clear()
+        # the surface is locked as long as the pixel arrays exist
+        del rgb, alpha
+
+    def get_probability(self, x, y):
+        """Returns the probability that the cell at the world position (x, y) is occupied"""
+        return float(1 / (1 + np.exp(-self.log_odds[int(x) // self.cell_size, int(y) // self.cell_size])))
+
+    def get_housekeeping(self):
+        return {
+            "rays": self.ray_count,
+            "dirty_tiles": len(self.dirty_tiles),
+        }
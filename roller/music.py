@@ -0,0 +1,135 @@
+"""
+The music module plays endless ambient music while the game runs.
+
+The music is synthesized one block of samples at a time by a generator (`generate_ambient_music`)
+on a background thread, which queues the blocks to a reserved `pygame.mixer.Channel`. The game loop
+is never blocked, and slow game ticks don't interrupt the music. Only the playing block, the queued
+block and the one being synthesized exist at a time, so the memory used stays the same however long the
+game runs, and the music starts as soon as the first block is synthesized.
+
+If the next block isn't queued before the channel runs out of sound, the music skips. These underruns
+are counted in the housekeeping.
+"""
+
+import random
+import threading
+
+import numpy as np
+import pygame
+
+from roller.config import g_config
+
+PENTATONIC_G_MAJOR = [392, 440, 493.88, 587.33, 659.25]
+"""Frequencies of the notes of the G major pentatonic scale, in Hz"""
+
+
+def note_frequency(n):
+    """Returns the frequency of the note n semitones above A4"""
+    return 440*2**(n/12)
+
+
+def generate_ambient_music(frequencies, block_size, sample_rate, detune=1, wave_count=5):
+    """Generates blocks of `block_size` samples of notes with random frequencies and lengths, forever.
+    Each note is a layered tone of `wave_count` sine waves detuned by up to +-detune Hz (-1...1 amplitude)"""
+    detunes = np.linspace(-detune, detune, wave_count)[:, np.newaxis]
+    block = np.empty(block_size)
+    frequency, length, position = 0, 0, 0
+    while True:
+        filled = 0
+        while filled < block_size:
+            if position == length:
+                # start the next note
+                frequency = random.choice(frequencies)
+                length = int(np.random.uniform(1, 3) * sample_rate)  # Randomize note lengths
+                position = 0
+            count = min(block_size - filled, length - position)
+            # the time since the start of the note, so the note continues smoothly from block to block
+            t = (position + np.arange(count)) / sample_rate
+            block[filled:filled + count] = np.sin(2 * np.pi * (frequency + detunes) * t).mean(axis=0)
+            filled += count
+            position += count
+        yield block.copy()
+
+
+class AmbientMusic:
+    """Streams music from a generator of blocks to a mixer channel.
+
+    :param blocks: a generator of blocks of float samples in -1...1, e.g. `generate_ambient_music`.
+        The default is ambient music in the G major pentatonic scale
+    :param effect: an effect (see roller.effects) the blocks are processed with
+    """
+
+    def __init__(self, blocks=None, effect=None):
+        self.blocks = blocks
+        self.effect = effect
+        self.channel = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.underruns = 0
+        """How many times the channel ran out of sound before the next block was queued"""
+        self.blocks_played = 0
+
+    def start(self):
+        """Start synthesizing and playing the music. Does nothing if the mixer is not initialized"""
+        mixer_settings = pygame.mixer.get_init()
+        if mixer_settings is None or self.thread is not None:
+            return
+        sample_rate, _, channels = mixer_settings
+        if self.blocks is None:
+            self.blocks = generate_ambient_music(PENTATONIC_G_MAJOR, g_config.music_block_size, sample_rate)
+        # the music gets a channel of its own, so sound effects don't take it over
+        pygame.mixer.set_reserved(1)
+        self.channel = pygame.mixer.Channel(0)
+        self.channel.set_volume(g_config.music_volume)
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, args=(sample_rate, channels), name="music", daemon=True)
+        self.thread.start()
+
+    def make_sound(self, block, channels):
+        """Returns a pygame Sound of a block of samples"""
+        if self.effect is not None:
+            block = self.effect.process(block)
+        samples = (np.clip(block, -1, 1) * 32767).astype(np.int16)
+        if channels > 1:
+            samples = np.repeat(samples[:, np.newaxis], channels, axis=1)
+        return pygame.sndarray.make_sound(samples)
+
+    def run(self, sample_rate, channels):
+        """Runs on the background thread until the music is stopped. The next block is synthesized while
+        the current one plays, and queued to the channel once the channel's queue is free"""
+        # the channel is checked several times per block, so a block is never queued late
+        poll_interval = g_config.music_block_size / sample_rate / 8
+        for block in self.blocks:
+            sound = self.make_sound(block, channels)
+            while self.channel.get_queue() is not None:
+                if self.stopping.wait(poll_interval):
+                    return
+            if self.stopping.is_set():
+                return
+            if self.channel.get_busy():
+                self.channel.queue(sound)
+            else:
+                # the first block starts the music, after that the channel should never be idle
+                if self.blocks_played > 0:
+                    self.underruns += 1
+                self.channel.play(sound)
+            self.blocks_played += 1
+
+    def stop(self):
+        """Stop the music and the background thread"""
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.channel.stop()
+        self.channel = None
+
+    def get_housekeeping(self):
+        return {
+            "blocks_played": self.blocks_played,
+            "underruns": self.underruns,
+        }
+
+
+g_music = AmbientMusic()
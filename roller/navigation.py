@@ -0,0 +1,284 @@
+"""
+The navigation module plans paths for bots that roll to a place on their own (see `behaviours.NavigateToPlace`).
+
+Paths are planned on a coarse grid of `g_config.path_cell_size` pixel cells, where a cell is blocked if it
+contains ground. The blocked cells come either from the terrain, or from the lidar memory of the bots
+(`world.memory_grid`, see roller.memory), where cells that haven't been seen yet are assumed to be free.
+A bot can roll sideways and climb a one cell step on top of blocked cells, roll off edges and fall down,
+but it can't move up through the air.
+
+Each `PathPlanner` searches backwards from the goal with Lifelong Planning A* (LPA*), so when cells become
+blocked or free only the distances that changed are recomputed. The search has no heuristic, so its keys
+don't depend on where the bots are, and one planner serves all the bots heading to the same place.
+The planners are shared through the `PathCache` `g_paths`.
+
+Bots of all sizes share the same grid, so a path can lead through gaps a large bot doesn't fit through.
+"""
+
+import heapq
+import math
+
+import numpy as np
+
+from roller import terrain
+from roller.collision import OccupancyGrid
+from roller.config import g_config
+from roller.places import places
+
+INFINITY = math.inf
+
+DIRECTIONS = ((0, 1), (-1, 0), (1, 0), (-1, 1), (1, 1), (-1, -1), (1, -1))
+"""(dx, dy) of the moves from a cell: falling, rolling sideways, rolling down a slope and climbing a step"""
+
+
+def get_move_costs(blocked, climb_cost):
+    """Returns the cost of moving from each cell in each of the DIRECTIONS (inf if the move is not possible).
+
+    :param blocked: boolean array of blocked cells, with a border of blocked cells around the cells the
+        costs are computed for
+    :returns: array of shape (len(DIRECTIONS), width, height) for the cells inside the border
+    """
+    def shifted(dx, dy):
+        return blocked[1 + dx:blocked.shape[0] - 1 + dx, 1 + dy:blocked.shape[1] - 1 + dy]
+
+    free = ~shifted(0, 0)
+    # cells on top of a blocked cell can be rolled on
+    supported = free & shifted(0, 1)
+    costs = np.full((len(DIRECTIONS),) + free.shape, INFINITY, dtype=np.float64)
+    for direction, (dx, dy) in enumerate(DIRECTIONS):
+        if dx == 0:
+            possible = free & ~shifted(0, 1)
+            cost = 1
+        elif dy == 0:
+            possible = supported & ~shifted(dx, 0)
+            cost = 1
+        elif dy == 1:
+            # without squeezing through the corner of two blocked cells
+            possible = supported & ~shifted(dx, 0) & ~shifted(dx, 1)
+            cost = math.sqrt(2)
+        else:
+            # onto a step that is one cell high
+            possible = supported & ~shifted(0, -1) & ~shifted(dx, -1) & shifted(dx, 0)
+            cost = climb_cost
+        costs[direction][possible] = cost
+    return costs
+
+
+class PathPlanner:
+    """Distances to a goal from all the cells of a grid, that are kept up to date when cells become blocked or free.
+
+    :param blocked: boolean array of the blocked cells, indexed [cx, cy]
+    :param goal: (cx, cy) of the goal cell
+    :param cell_size: width and height in pixels of a cell
+    """
+
+    def __init__(self, blocked, goal, cell_size):
+        self.cell_size = cell_size
+        self.shape = blocked.shape
+        # the grid is stored with a border of blocked cells, so moves never leave it. It is two cells wide,
+        # so the moves from the cells of the inner ring of the border don't leave the lists either
+        self.blocked = np.ones((self.shape[0] + 4, self.shape[1] + 4), dtype=np.bool_)
+        self.blocked[2:-2, 2:-2] = blocked
+        self.stride = self.shape[1] + 4
+        """Cells are stored in flat lists, the cell (cx, cy) is at index (cx + 2) * stride + cy + 2"""
+        self.offsets = [dx * self.stride + dy for dx, dy in DIRECTIONS]
+        size = self.blocked.size
+        self.costs = [[INFINITY] * size for _ in DIRECTIONS]
+        """The cost of moving from each cell in each of the DIRECTIONS"""
+        self.update_costs(0, 0, *self.shape)
+
+        self.g = [INFINITY] * size
+        """The distance to the goal of each cell, as of the latest search"""
+        self.rhs = [INFINITY] * size
+        """The distance to the goal of each cell, looking one move ahead. Cells where it differs from g are in the queue"""
+        self.queue = []
+        self.goal = self.get_index(*goal)
+        self.rhs[self.goal] = 0
+        heapq.heappush(self.queue, (0, self.goal))
+        self.expansions = 0
+        """The number of cells expanded by all searches"""
+
+    def get_index(self, cx, cy):
+        return (cx + 2) * self.stride + cy + 2
+
+    def get_cell(self, index):
+        return index // self.stride - 2, index % self.stride - 2
+
+    def update_costs(self, cx0, cy0, cx1, cy1):
+        """Recompute the costs of the moves from the cells (cx0, cy0)...(cx1, cy1) (end exclusive)"""
+        cx0, cy0 = max(cx0, 0), max(cy0, 0)
+        cx1, cy1 = min(cx1, self.shape[0]), min(cy1, self.shape[1])
+        if cx0 >= cx1 or cy0 >= cy1:
+            return
+        # the costs of the moves depend on the cells around the moving cell
+        costs = get_move_costs(self.blocked[cx0 + 1:cx1 + 3, cy0 + 1:cy1 + 3], g_config.path_climb_cost)
+        for direction in range(len(DIRECTIONS)):
+            direction_costs = self.costs[direction]
+            for cx in range(cx0, cx1):
+                start = self.get_index(cx, cy0)
+                direction_costs[start:start + cy1 - cy0] = costs[direction, cx - cx0].tolist()
+
+    def update_vertex(self, index):
+        """Recompute the distance of a cell looking one move ahead, and queue it if it changed"""
+        if index != self.goal:
+            g = self.g
+            self.rhs[index] = min(
+                direction_costs[index] + g[index + offset]
+                for direction_costs, offset in zip(self.costs, self.offsets)
+            )
+        key = min(self.g[index], self.rhs[index])
+        if self.g[index] != self.rhs[index]:
+            heapq.heappush(self.queue, (key, index))
+
+    def compute(self, start):
+        """Update the distances until the distance of the start cell is known.
+
+        :param start: (cx, cy) of the cell a bot is in
+        """
+        start = self.get_index(*start)
+        g, rhs, queue = self.g, self.rhs, self.queue
+        costs, offsets = self.costs, self.offsets
+        while queue and (queue[0][0] < min(g[start], rhs[start]) or g[start] != rhs[start]):
+            key, index = heapq.heappop(queue)
+            # cells are queued again when their distance changes, older entries are skipped
+            if g[index] == rhs[index] or key != min(g[index], rhs[index]):
+                continue
+            self.expansions += 1
+            if g[index] > rhs[index]:
+                g[index] = rhs[index]
+                # the cells that can move to this cell may now be closer to the goal
+                for direction_costs, offset in zip(costs, offsets):
+                    neighbour = index - offset
+                    distance = direction_costs[neighbour] + g[index]
+                    if distance < rhs[neighbour]:
+                        rhs[neighbour] = distance
+                        heapq.heappush(queue, (distance, neighbour))
+            else:
+                g[index] = INFINITY
+                self.update_vertex(index)
+                for offset in offsets:
+                    self.update_vertex(index - offset)
+
+    def set_blocked(self, cx0, cy0, blocked):
+        """Replace the blocked cells with their top-left corner at (cx0, cy0), and update the distances
+        of the cells whose moves changed on the next search"""
+        window = self.blocked[cx0 + 2:cx0 + 2 + blocked.shape[0], cy0 + 2:cy0 + 2 + blocked.shape[1]]
+        changed_x, changed_y = np.nonzero(window != blocked)
+        if len(changed_x) == 0:
+            return
+        window[...] = blocked
+        changed_x += cx0
+        changed_y += cy0
+        # the moves of the cells next to a changed cell depend on it
+        self.update_costs(int(changed_x.min()) - 1, int(changed_y.min()) - 1, int(changed_x.max()) + 2, int(changed_y.max()) + 2)
+        affected = set()
+        for cx, cy in zip(changed_x.tolist(), changed_y.tolist()):
+            affected.update(self.get_index(cx + i, cy + j) for i in (-1, 0, 1) for j in (-1, 0, 1))
+        for index in affected:
+            self.update_vertex(index)
+
+    def get_distance(self, cell):
+        """Returns the distance in cells from (cx, cy) to the goal, as of the latest search"""
+        return self.g[self.get_index(*cell)]
+
+    def get_next_cell(self, cell):
+        """Returns the (cx, cy) of the cell to move to from `cell` on the way to the goal, or None if the
+        cell is the goal or the goal can't be reached from it"""
+        index = self.get_index(*cell)
+        if index == self.goal:
+            return None
+        distance, best = min(
+            (direction_costs[index] + self.g[index + offset], index + offset)
+            for direction_costs, offset in zip(self.costs, self.offsets)
+        )
+        if distance == INFINITY:
+            return None
+        return self.get_cell(best)
+
+
+def get_blocked_from_memory(memory_grid, shape, cell_size):
+    """Returns the cells of a grid of `shape` that the lidar memory thinks are more likely occupied than free"""
+    factor = max(cell_size // memory_grid.cell_size, 1)
+    occupied = memory_grid.log_odds > 0
+    padded = np.zeros((shape[0] * factor, shape[1] * factor), dtype=np.bool_)
+    width, height = min(occupied.shape[0], padded.shape[0]), min(occupied.shape[1], padded.shape[1])
+    padded[:width, :height] = occupied[:width, :height]
+    return padded.reshape(shape[0], factor, shape[1], factor).any(axis=(1, 3))
+
+
+class PathCache:
+    """The path planners to all the places bots are navigating to, shared by all the bots heading to the same place"""
+
+    def __init__(self):
+        self.planners = {}
+        """PathPlanners keyed by (place, source), for the map of `layers`"""
+        self.layers = None
+        """The layers of the world the planners were made for"""
+        self.terrain = None
+        """The OccupancyGrid of the ground that the planners use as their grid of blocked cells"""
+        self.memory_updates = {}
+        """The memory_grid.updates seen by each planner that uses the lidar memory, keyed like the planners"""
+
+    def get_planner(self, world, place, source="terrain"):
+        """Returns the planner for paths to a place of the world's map.
+
+        :param place: the name of the place in roller.places
+        :param source: "terrain" to plan with the ground of the map, or "memory" to plan with the lidar memory
+        """
+        if world.layers is not self.layers:
+            # the world changed to another map
+            self.planners.clear()
+            self.memory_updates.clear()
+            self.layers = world.layers
+            self.terrain = OccupancyGrid(world.layers, cell_size=g_config.path_cell_size)
+
+        key = (place, source)
+        planner = self.planners.get(key)
+        if planner is None:
+            if source == "terrain":
+                blocked = self.terrain.get_cells(0, 0, *self.terrain.cells.shape).copy()
+            else:
+                blocked = get_blocked_from_memory(world.memory_grid, self.terrain.cells.shape, g_config.path_cell_size)
+            planner = self.planners[key] = PathPlanner(blocked, self.get_goal(world.map_name, place), g_config.path_cell_size)
+        if source == "memory" and self.memory_updates.get(key) != world.memory_grid.updates:
+            # sync the planner with what the bots have seen since it was last used
+            self.memory_updates[key] = world.memory_grid.updates
+            planner.set_blocked(0, 0, get_blocked_from_memory(world.memory_grid, planner.shape, planner.cell_size))
+        return planner
+
+    def get_goal(self, map_name, place):
+        """Returns the (cx, cy) of the cell a place is in. Places in the air are moved down onto the ground below them"""
+        x, y = places[map_name][place]
+        width, height = self.terrain.cells.shape
+        cx = min(max(int(x) // g_config.path_cell_size, 0), width - 1)
+        cy = min(max(int(y) // g_config.path_cell_size, 0), height - 1)
+        column = self.terrain.get_cells(cx, 0, cx + 1, height)[0]
+        while cy + 1 < height and not column[cy + 1]:
+            cy += 1
+        return cx, cy
+
+    def update_region(self, rect):
+        """Update the planners that use the terrain, after the region of the rect was edited"""
+        size = g_config.path_cell_size
+        cx0, cy0 = max(rect.left // size, 0), max(rect.top // size, 0)
+        cx1, cy1 = -(-rect.right // size), -(-rect.bottom // size)
+        self.terrain.update_region(self.layers, rect.left, rect.top, rect.right, rect.bottom)
+        for (place, source), planner in self.planners.items():
+            if source == "terrain":
+                planner.set_blocked(cx0, cy0, self.terrain.get_cells(cx0, cy0, cx1, cy1))
+
+    def get_housekeeping(self):
+        return {
+            "planners": len(self.planners),
+            "expansions": sum(planner.expansions for planner in self.planners.values()),
+        }
+
+
+@terrain.register_derived_layer
+def update_paths(world, rect):
+    """Edited terrain can block paths or open up new ones"""
+    if world.layers is g_paths.layers:
+        g_paths.update_region(rect)
+
+
+g_paths = PathCache()
@@ -1,55 +1,135 @@
+import os
+import math
 import pygame
 import json
+import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+
+FONT_CACHE_FILE = "roller/assets/cache/fonts.json"
+"""Where the paths of the system fonts found by find_font are stored between runs"""
+
+
+def find_font(name, cache_file=FONT_CACHE_FILE):
+    """Returns the path of the system font with the given name, or None if it is not installed.
+
+    Finding a system font makes pygame list all the fonts of the system, which can take a large part of
+    the startup time. The path that was found is stored in `cache_file`, and used on the next runs as
+    long as the font file still exists. Delete the file to search for newly installed fonts."""
+    try:
+        with open(cache_file) as f:
+            paths = json.load(f)
+    except (OSError, ValueError):
+        paths = {}
+    if name in paths and (paths[name] is None or os.path.exists(paths[name])):
+        return paths[name]
+
+    paths[name] = pygame.font.match_font(name)
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, "w") as f:
+            json.dump(paths, f, indent=4)
+    except OSError:
+        pass  # the font is searched again on the next run
+    return paths[name]
 
 
 class JsonOverlay:
-   
-    
+    """Renders a dict as indented json text on top of the screen.
+
+    Rendered lines of text are kept in a LRU cache keyed by the text, and the overlay surface
+    is kept between frames. Only the lines whose text changed since the previous update are redrawn,
+    unless the number of lines changed, which redraws them all.
+
+    :param max_cached_lines: How many rendered lines of text to keep in the cache
+    :param refresh_hz: How many times per second the text is updated from the data. 0 updates the text every frame.
+    """
     
-    def __init__(self, screen:pygame.Surface, font_size=14, font_color=(255, 255, 255), bg_alpha=0):
+    def __init__(self, screen:pygame.Surface, font_size=14, font_color=(255, 255, 255), bg_alpha=0, max_cached_lines=256, refresh_hz=0):
         self.screen = screen
         self.font_size = font_size
         self.font_color = font_color
         self.bg_alpha = bg_alpha
+        self.max_cached_lines = max_cached_lines
+        self.refresh_hz = refresh_hz
         # self.position = position
 
+        self.line_cache = OrderedDict()
+        """Rendered text surfaces of lines, keyed by the line text. Least recently used lines are first"""
+        self.lines = []
+        """The lines of text that are currently drawn on self.text_overlay"""
+        self.text_overlay = None
+        """The surface lines are drawn on. It's re-used between frames as long as the number of lines and the
+        screen width stay the same"""
+        self.last_refresh_ms = None
+
         # Set up font (can be customized)
 
         pygame.font.init()
 
         PressStart2P = "roller/assets/fonts/PressStart2P/PressStart2P-Regular.ttf"
         # self.font = pygame.font.SysFont('monospace', self.font_size)
-        self.font = pygame.font.SysFont('ubuntu mono', self.font_size)
+        # the default font of pygame is used if the font is not installed, like SysFont does
+        self.font = pygame.font.Font(find_font('ubuntu mono'), self.font_size)
         # self.font = pygame.font.SysFont(PressStart2P, self.font_size)
 
-    def render_housekeeping(self, data):
+    def render_line(self, line):
+        """Returns the rendered text surface for a line of text, using the cache if possible"""
+        text_surface = self.line_cache.get(line)
+        if text_surface is not None:
+            self.line_cache.move_to_end(line)
+            return text_surface
+
+        text_surface = self.font.render(line, True, self.font_color)
+        self.line_cache[line] = text_surface
+        if len(self.line_cache) > self.max_cached_lines:
+            self.line_cache.popitem(last=False)
+        return text_surface
+
+    def is_refresh_due(self):
+        """Whether the overlay text should be updated from the data on this frame, as limited by self.refresh_hz"""
+        if self.refresh_hz == 0 or self.last_refresh_ms is None:
+            return True
+        return pygame.time.get_ticks() - self.last_refresh_ms >= 1000 / self.refresh_hz
+
+    def update_text_overlay(self, data):
+        """Redraws the lines that have changed since the previous update onto self.text_overlay"""
+        self.last_refresh_ms = pygame.time.get_ticks()
+
         # Convert JSON to formatted text string
         json_text = json.dumps(data, indent=4)
         
         # Split the text into lines
         lines = json_text.splitlines()
 
-        # Create a transparent surface for the overlay
-        text_overlay = pygame.Surface((self.screen.get_width(), len(lines) * self.font_size), pygame.SRCALPHA)
-
-        if self.bg_alpha != 0:
-            # Fill the surface with (semi)-transparent background
-            text_overlay.fill((0, 0, 0, self.bg_alpha))
+        # The surface is allocated again, and all lines redrawn, when the number of lines or the screen width changed.
+        size = (self.screen.get_width(), len(lines) * self.font_size)
+        if self.text_overlay is None or self.text_overlay.get_size() != size:
+            # Create a transparent surface for the overlay
+            self.text_overlay = pygame.Surface(size, pygame.SRCALPHA)
+            self.lines = []
 
-        # Render each line of text
+        # Render each line of text that differs from what was drawn on the previous update
         y_offset = 0
-        for line in lines:
-            text_surface = self.font.render(line, True, self.font_color)
-            text_overlay.blit(text_surface, (10, y_offset))
+        for i, line in enumerate(lines):
+            if i >= len(self.lines) or self.lines[i] != line:
+                # Fill the line with (semi)-transparent background, this also erases the previous text
+                row = pygame.Rect(0, y_offset, size[0], self.font_size)
+                self.text_overlay.fill((0, 0, 0, self.bg_alpha), row)
+                self.text_overlay.blit(self.render_line(line), (10, y_offset))
             y_offset += self.font_size
 
-        # y_offset is not the total pixel height of the text block
-        # we now offset the entire text_surface so that the block
+        self.lines = lines
+
+    def render_housekeeping(self, data):
+        if self.is_refresh_due():
+            self.update_text_overlay(data)
+
+        # we offset the entire text_surface so that the block
         # of json is middle-aligne verically
-        # this is maybe confusin re-usde of y_offset. 
-        y_offset = self.screen.get_height() / 2 - y_offset/2
+        y_offset = self.screen.get_height() / 2 - self.text_overlay.get_height()/2
         # Blit the overlay on top of the screen
-        self.screen.blit(text_overlay, (0, y_offset))
+        self.screen.blit(self.text_overlay, (0, y_offset))
 
     @staticmethod
     def get_middle_alignment_offset(text_surface, screen_surface):
@@ -58,66 +138,102 @@ class JsonOverlay:
 
 
 
+@lru_cache(maxsize=16)
+def get_plot_background(size, background_color, border_color):
+    """Returns a background surface for plots of the given size. The surface is cached,
+    so all LinePlots with the same size and colors share the same background surface"""
+    background = pygame.Surface(size)
+    background.fill(background_color)
+    pygame.draw.rect(background, border_color, background.get_rect(), 1)
+    return background
+
+
 class LinePlot:
-    def __init__(self, surface, data, rect, line_color=(255, 165, 0), background_color=(0, 0, 0)):
+    def __init__(self, surface, rect, capacity=300, line_color=(255, 165, 0), background_color=(0, 0, 0), border_color=(60, 60, 60)):
         """
-        Initialize the LinePlot class.
+        A real-time line plot of the latest `capacity` values added to it.
+        The values are stored in a preallocated ring buffer, and the oldest value is
+        plotted at the left edge of the plot.
 
         Args:
             surface: The Pygame surface to draw the plot on.
-            data: List of (x, y) tuples representing the data points.
             rect: A pygame.Rect defining the area of the plot on the surface.
+            capacity: How many of the latest values the plot shows.
             line_color: The color of the line plot (default is orange).
             background_color: The background color of the plot (default is black).
+            border_color: The color of the frame drawn around the plot.
         """
         self.surface = surface
-        self.data = data
-        self.rect = rect
+        self.rect = pygame.Rect(rect)
         self.line_color = line_color
         self.background_color = background_color
-        self.idx = 0
+        self.border_color = border_color
 
-    def add_data(self, point):
-        """Uses a round-robin data buffer to add a new datapoint, replacing the oldest one."""
-        self.idx = (self.idx + 1) % len(data)
-        assert(self.idx < len(data))  
+        self.data = np.zeros(capacity)
+        """Round-robin data buffer. self.idx is the index of the oldest value once the buffer is full"""
+        self.idx = 0
+        self.count = 0
+        """How many values the buffer has in it. This is equal to the capacity once the buffer has been filled"""
+        self.y_min = math.inf
+        self.y_max = -math.inf
+        self.limits_are_stale = False
+        """Set when the value at the current minimum or maximum has been overwritten"""
+
+        # the x coordinates of the plotted samples never change, so they are only calculated once
+        # 1 pixel is left as margin so the line does not draw over the frame
+        self.x_scaled = np.linspace(self.rect.left + 1, self.rect.right - 2, capacity)
+
+    def add_data(self, value):
+        """Uses a round-robin data buffer to add a new value, replacing the oldest one."""
+        if self.count == len(self.data):
+            overwritten = self.data[self.idx]
+            if overwritten <= self.y_min or overwritten >= self.y_max:
+                self.limits_are_stale = True
+        else:
+            self.count += 1
+
+        self.data[self.idx] = value
+        self.idx = (self.idx + 1) % len(self.data)
 
         # Update the minimum and maximum limits of the data, used to scale plotted values
-        x_min = point.x if point.x < x_min else x_min
-        x_max = point.x if point.x > x_max else x_max
-        y_min = point.y if point.y < y_min else y_min
-        y_max = point.y if point.y > y_max else y_max
-
-        data[self.idx] = point
-
-    def update_plot():
-
-        pygame.draw.line(self.surface, self.line_color, scale(self.data[i]), scale(self.data[i+1]), 1)
-
-
-    def scale(self, point, x_min, x_max, y_min, y_max):
-        """Scale the (x, y) data point to fit within the plot rect."""
-        x, y = point
-        x_scaled = self.rect.left + (x - x_min) / (x_max - x_min) * self.rect.width
-        y_scaled = self.rect.bottom - (y - y_min) / (y_max - y_min) * self.rect.height
-        return (x_scaled, y_scaled)
+        self.y_min = value if value < self.y_min else self.y_min
+        self.y_max = value if value > self.y_max else self.y_max
+
+    def get_limits(self):
+        """Returns the (minimum, maximum) of the values in the buffer.
+        The limits are tracked when values are added, and only searched from the whole
+        buffer when the previous minimum or maximum value has been overwritten"""
+        if self.limits_are_stale:
+            values = self.data[:self.count]
+            self.y_min = float(values.min())
+            self.y_max = float(values.max())
+            self.limits_are_stale = False
+        return self.y_min, self.y_max
+
+    def get_ordered_data(self):
+        """Returns the values in the buffer from oldest to newest"""
+        if self.count < len(self.data):
+            return self.data[:self.count]
+        return np.roll(self.data, -self.idx)
+
+    def scale(self, values, y_min, y_max):
+        """Scale the values to pixel coordinates within the plot rect. Returns a (N,2) array of points."""
+        y_range = y_max - y_min if y_max > y_min else 1
+        y_scaled = (self.rect.bottom - 2) - (values - y_min) / y_range * (self.rect.height - 3)
+        return np.column_stack((self.x_scaled[:len(values)], y_scaled))
 
     def draw(self):
         """Draw the line plot on the given surface."""
-        # Fill the background of the plot
-        pygame.draw.rect(self.surface, self.background_color, self.rect)
+        # Draw the background of the plot
+        background = get_plot_background(self.rect.size, self.background_color, self.border_color)
+        self.surface.blit(background, self.rect)
 
-        if len(self.data) < 2:
+        if self.count < 2:
             return  # Not enough data to draw a line
 
         # Scale the data points to fit within the plot area
-        x_vals = [point[0] for point in self.data]
-        y_vals = [point[1] for point in self.data]
-
-        x_min, x_max = min(x_vals), max(x_vals)
-        y_min, y_max = min(y_vals), max(y_vals)
+        y_min, y_max = self.get_limits()
+        points = self.scale(self.get_ordered_data(), y_min, y_max)
 
-        x_vals = self.scale(x)
         # Draw the lines connecting the scaled data points
-        for i in range(len(self.data) - 1):
-            pygame.draw.line(self.surface, self.line_color, scale(self.data[i]), scale(self.data[i+1]), 1)
+        pygame.draw.lines(self.surface, self.line_color, False, points.tolist(), 1)
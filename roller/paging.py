@@ -0,0 +1,326 @@
+"""
+The paging module provides a world map backend that keeps only part of the map in memory.
+
+The layers of a compiled map (see roller.mapcache) are split into square chunks that are
+stored in one file on disk, so that each chunk can be read with a single seek and read.
+Chunks are loaded when they are first accessed, or ahead of time by a background thread
+that prefetches chunks around the camera and along the direction each bot is moving.
+A bounded LRU evicts the chunks that haven't been used for the longest time.
+
+A PagedMap has the same layer attributes as a CompiledMap (`channels`, `ground`, `scatter`, `temperature`),
+and the layers can be indexed the same way: `layer[x, y]` for single pixels, `layer[x0:x1, y0:y1]` for
+rectangular windows, and `layer[xs, ys]` with integer arrays for scattered pixels.
+"""
+
+import os
+import json
+import queue
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from roller import mapcache
+from roller.config import g_config
+
+MAGIC = b"ROLLPGS\0"
+
+
+def get_chunk_path(source, cache_dir=mapcache.CACHE_DIR):
+    return mapcache.get_cache_path(source, cache_dir).replace(".rollmap", ".rollpages")
+
+def compile_chunks(compiled_map, chunk_path, chunk_size):
+    """Write the layers of a CompiledMap into a chunk file. The chunks at the right and bottom edges
+    of the map are padded to the full chunk size, so that all chunks occupy the same number of bytes"""
+    width, height = compiled_map.get_size()
+    chunks_x = -(-width // chunk_size)
+    chunks_y = -(-height // chunk_size)
+
+    # layout of the layers within one chunk
+    layers = {}
+    chunk_bytes = 0
+    for name, layer in compiled_map.layers.items():
+        shape = (chunk_size, chunk_size) + layer.shape[2:]
+        layers[name] = dict(dtype=layer.dtype.str, shape=list(shape), offset=chunk_bytes)
+        chunk_bytes = mapcache._align(chunk_bytes + int(np.prod(shape)) * layer.dtype.itemsize)
+
+    header = dict(
+        source=os.path.basename(compiled_map.source),
+        size=[width, height],
+        chunk_size=chunk_size,
+        chunk_count=[chunks_x, chunks_y],
+        chunk_bytes=chunk_bytes,
+        layers=layers,
+    )
+    header_bytes = json.dumps(header).encode()
+    data_start = mapcache._align(len(MAGIC) + 8 + len(header_bytes))
+
+    os.makedirs(os.path.dirname(chunk_path) or ".", exist_ok=True)
+    temporary_path = chunk_path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(len(header_bytes).to_bytes(8, "little"))
+        file.write(header_bytes)
+        for cy in range(chunks_y):
+            for cx in range(chunks_x):
+                chunk_start = data_start + (cy * chunks_x + cx) * chunk_bytes
+                for name, layer in compiled_map.layers.items():
+                    window = layer[cx*chunk_size:(cx+1)*chunk_size, cy*chunk_size:(cy+1)*chunk_size]
+                    padded = np.zeros(layers[name]["shape"], dtype=layer.dtype)
+                    padded[:window.shape[0], :window.shape[1]] = window
+                    file.seek(chunk_start + layers[name]["offset"])
+                    file.write(padded.tobytes())
+        # make sure the file size covers the padding of the last chunk
+        file.truncate(data_start + chunks_x * chunks_y * chunk_bytes)
+    os.replace(temporary_path, chunk_path)
+
+
+class PagedLayer:
+    """One layer of a PagedMap. Supports the same indexing as a numpy layer of a CompiledMap"""
+
+    def __init__(self, paged_map, name, dtype, shape):
+        self.paged_map = paged_map
+        self.name = name
+        self.dtype = dtype
+        self.shape = shape
+
+    def __getitem__(self, key):
+        x, y = key
+        if isinstance(x, slice):
+            return self.get_window(x, y)
+        if isinstance(x, np.ndarray):
+            return self.gather(x, y)
+        size = self.paged_map.chunk_size
+        chunk = self.paged_map.get_chunk(int(x) // size, int(y) // size)
+        return chunk[self.name][int(x) % size, int(y) % size]
+
+    def __setitem__(self, key, values):
+        """Write a rectangular window of the layer, e.g. when the terrain is edited (see roller.terrain).
+        Only window (slice) keys are supported"""
+        xs, ys = key
+        x_start, x_end, _ = xs.indices(self.shape[0])
+        y_start, y_end, _ = ys.indices(self.shape[1])
+        size = self.paged_map.chunk_size
+        for cx in range(x_start // size, (x_end - 1) // size + 1):
+            for cy in range(y_start // size, (y_end - 1) // size + 1):
+                chunk = self.paged_map.get_edited_chunk(cx, cy)[self.name]
+                x0, x1 = max(x_start, cx * size), min(x_end, (cx + 1) * size)
+                y0, y1 = max(y_start, cy * size), min(y_end, (cy + 1) * size)
+                chunk[x0-cx*size:x1-cx*size, y0-cy*size:y1-cy*size] = values[x0-x_start:x1-x_start, y0-y_start:y1-y_start]
+
+    def get_window(self, xs: slice, ys: slice):
+        """Returns a copy of the rectangular window of the layer. Parts of the window outside the map are left zero"""
+        x_start, x_end, _ = xs.indices(self.shape[0])
+        y_start, y_end, _ = ys.indices(self.shape[1])
+        window = np.zeros((max(x_end - x_start, 0), max(y_end - y_start, 0)) + self.shape[2:], dtype=self.dtype)
+        size = self.paged_map.chunk_size
+        for cx in range(x_start // size, (x_end - 1) // size + 1):
+            for cy in range(y_start // size, (y_end - 1) // size + 1):
+                chunk = self.paged_map.get_chunk(cx, cy)[self.name]
+                # intersection of the window with the chunk, in world coordinates
+                x0, x1 = max(x_start, cx * size), min(x_end, (cx + 1) * size)
+                y0, y1 = max(y_start, cy * size), min(y_end, (cy + 1) * size)
+                window[x0-x_start:x1-x_start, y0-y_start:y1-y_start] = chunk[x0-cx*size:x1-cx*size, y0-cy*size:y1-cy*size]
+        return window
+
+    def gather(self, xs, ys):
+        """Returns the layer values at the pixels (xs[i], ys[i]). Pixels outside the map are zero, like the
+        chunks outside the map"""
+        size = self.paged_map.chunk_size
+        values = np.zeros(xs.shape + self.shape[2:], dtype=self.dtype)
+        # pixels outside the map would wrap around onto the chunks of other rows, so they are left out
+        inside = (xs >= 0) & (xs < self.shape[0]) & (ys >= 0) & (ys < self.shape[1])
+        xs, ys = xs[inside], ys[inside]
+        inside_values = np.zeros(xs.shape + self.shape[2:], dtype=self.dtype)
+        keys = (ys // size) * self.paged_map.chunk_count[0] + xs // size
+        for key in np.unique(keys):
+            selected = keys == key
+            cx, cy = int(key) % self.paged_map.chunk_count[0], int(key) // self.paged_map.chunk_count[0]
+            chunk = self.paged_map.get_chunk(cx, cy)[self.name]
+            inside_values[selected] = chunk[xs[selected] % size, ys[selected] % size]
+        values[inside] = inside_values
+        return values
+
+
+class PagedMap:
+    """A compiled map that is loaded from disk one chunk at a time.
+
+    :param chunk_path: path to a chunk file written by `compile_chunks`
+    :param max_chunks: how many chunks are kept in memory at the same time
+    :param source: path to the image the map was compiled from
+    """
+
+    def __init__(self, chunk_path, max_chunks, source=None):
+        self.chunk_path = chunk_path
+        self.max_chunks = max_chunks
+        with open(chunk_path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{chunk_path} is not a paged map")
+            header_length = int.from_bytes(file.read(8), "little")
+            header = json.loads(file.read(header_length))
+        self.data_start = mapcache._align(len(MAGIC) + 8 + header_length)
+        self.source = source or header["source"]
+        self.size = tuple(header["size"])
+        self.chunk_size = header["chunk_size"]
+        self.chunk_count = tuple(header["chunk_count"])
+        self.chunk_bytes = header["chunk_bytes"]
+        self.chunk_layout = header["layers"]
+
+        self.chunks = OrderedDict()
+        """Loaded chunks keyed by (cx, cy). Each chunk is a dict of layer name to array. Least recently used chunks are first"""
+        self.edited_chunks = {}
+        """Chunks that have been edited. These are never evicted, since the edits only exist in memory"""
+        self.lock = threading.Lock()
+        self.file_lock = threading.Lock()
+        self.file = open(chunk_path, "rb")
+
+        self.hits = 0
+        self.misses = 0
+        """Chunks that had to be loaded synchronously in the game loop, because they had not been prefetched"""
+        self.prefetched = 0
+        self.evictions = 0
+
+        self.prefetch_queue = queue.Queue()
+        self.pending = set()
+        """Chunk keys that are in the prefetch queue"""
+        self.prefetch_thread = threading.Thread(target=self.run_prefetching, daemon=True)
+        self.prefetch_thread.start()
+
+        for name, layout in self.chunk_layout.items():
+            shape = self.size + tuple(layout["shape"][2:])
+            setattr(self, name, PagedLayer(self, name, np.dtype(layout["dtype"]), shape))
+
+    def get_size(self):
+        """The (width, height) of the map in pixels"""
+        return self.size
+
+    def read_chunk(self, cx, cy):
+        """Read all layers of a chunk from the chunk file. Chunks outside the map are all zero"""
+        chunk = {}
+        if not (0 <= cx < self.chunk_count[0] and 0 <= cy < self.chunk_count[1]):
+            for name, layout in self.chunk_layout.items():
+                chunk[name] = np.zeros(layout["shape"], dtype=np.dtype(layout["dtype"]))
+            return chunk
+
+        with self.file_lock:
+            self.file.seek(self.data_start + (cy * self.chunk_count[0] + cx) * self.chunk_bytes)
+            data = self.file.read(self.chunk_bytes)
+        for name, layout in self.chunk_layout.items():
+            dtype = np.dtype(layout["dtype"])
+            count = int(np.prod(layout["shape"]))
+            # copy, so the chunk arrays are writable and don't keep the whole read buffer alive
+            chunk[name] = np.frombuffer(data, dtype=dtype, count=count, offset=layout["offset"]).reshape(layout["shape"]).copy()
+        return chunk
+
+    def insert_chunk(self, key, chunk):
+        with self.lock:
+            self.chunks[key] = chunk
+            self.chunks.move_to_end(key)
+            while len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+                self.evictions += 1
+
+    def get_chunk(self, cx, cy):
+        """Returns the chunk at chunk coordinates (cx, cy), loading it from disk if needed"""
+        key = (cx, cy)
+        with self.lock:
+            chunk = self.edited_chunks.get(key) or self.chunks.get(key)
+            if chunk is not None:
+                if key in self.chunks:
+                    self.chunks.move_to_end(key)
+                self.hits += 1
+                return chunk
+            self.misses += 1
+        chunk = self.read_chunk(cx, cy)
+        self.insert_chunk(key, chunk)
+        return chunk
+
+    def get_edited_chunk(self, cx, cy):
+        """Returns the chunk at chunk coordinates (cx, cy), and moves it out of the LRU so the edits made to it are kept"""
+        key = (cx, cy)
+        chunk = self.get_chunk(cx, cy)
+        with self.lock:
+            self.edited_chunks[key] = chunk
+            self.chunks.pop(key, None)
+        return chunk
+
+    def prefetch(self, cx, cy):
+        """Queue a chunk to be loaded by the background thread, unless it's already loaded or queued"""
+        key = (cx, cy)
+        if not (0 <= cx < self.chunk_count[0] and 0 <= cy < self.chunk_count[1]):
+            return
+        with self.lock:
+            if key in self.chunks or key in self.edited_chunks or key in self.pending:
+                return
+            self.pending.add(key)
+        self.prefetch_queue.put(key)
+
+    def run_prefetching(self):
+        """Loop of the background thread that loads the chunks in the prefetch queue"""
+        while True:
+            key = self.prefetch_queue.get()
+            if key is None:
+                # the map was closed
+                return
+            with self.lock:
+                is_loaded = key in self.chunks or key in self.edited_chunks
+            if not is_loaded:
+                self.insert_chunk(key, self.read_chunk(*key))
+                self.prefetched += 1
+            with self.lock:
+                self.pending.discard(key)
+
+    def close(self):
+        """Stop the prefetch thread and close the chunk file, e.g. when the map is evicted from the map
+        registry. Chunks that are not loaded can't be read after this"""
+        self.prefetch_queue.put(None)
+        self.prefetch_thread.join()
+        with self.file_lock:
+            self.file.close()
+
+    def prefetch_region(self, x0, y0, x1, y1):
+        """Prefetch all chunks that overlap the rectangle (x0, y0)...(x1, y1) in world coordinates"""
+        size = self.chunk_size
+        for cx in range(int(x0) // size, int(x1) // size + 1):
+            for cy in range(int(y0) // size, int(y1) // size + 1):
+                self.prefetch(cx, cy)
+
+    def prefetch_around(self, entities, camera_rect, lookahead=None):
+        """Prefetch the chunks in the camera view and around each entity, extended in the
+        direction the entity is moving. Intended to be called once per game tick.
+
+        :param entities: Bots with x, y and optionally vx, vy attributes
+        :param camera_rect: (x0, y0, x1, y1) of the visible part of the world in world coordinates
+        :param lookahead: How many ticks ahead of an entity's current velocity the prefetching reaches
+        """
+        lookahead = g_config.world_prefetch_lookahead if lookahead is None else lookahead
+        margin = self.chunk_size / 2
+        self.prefetch_region(*camera_rect)
+        for entity in entities:
+            x_ahead = entity.x + getattr(entity, "vx", 0) * lookahead
+            y_ahead = entity.y + getattr(entity, "vy", 0) * lookahead
+            self.prefetch_region(
+                min(entity.x, x_ahead) - margin, min(entity.y, y_ahead) - margin,
+                max(entity.x, x_ahead) + margin, max(entity.y, y_ahead) + margin,
+            )
+
+    def get_housekeeping(self):
+        return dict(
+            loaded_chunks = len(self.chunks),
+            edited_chunks = len(self.edited_chunks),
+            hits = self.hits,
+            misses = self.misses,
+            prefetched = self.prefetched,
+            evictions = self.evictions,
+        )
+
+
+def load_paged_map(source, cache_dir=mapcache.CACHE_DIR, chunk_size=None, max_chunks=None) -> PagedMap:
+    """Returns a PagedMap for the source image. The chunk file is compiled from the
+    map's compiled cache if there is no chunk file for the current contents of the image"""
+    chunk_size = g_config.world_chunk_size if chunk_size is None else chunk_size
+    max_chunks = g_config.world_max_chunks if max_chunks is None else max_chunks
+    chunk_path = get_chunk_path(source, cache_dir).replace(".rollpages", f"-{chunk_size}.rollpages")
+    if not os.path.exists(chunk_path):
+        compile_chunks(mapcache.load_map(source, cache_dir), chunk_path, chunk_size)
+    return PagedMap(chunk_path, max_chunks, source)
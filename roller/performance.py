@@ -1,7 +1,8 @@
+import time
 import pygame
 import json
-import psutil
 from roller.config import g_config
+from roller.raycache import g_ray_cache
 
 class Perfomance():
 
@@ -14,7 +15,16 @@ class Perfomance():
     current_tick_ms: float = 0
     previous_tick_ms: float = 0
 
-    cpu_percent: float = psutil.cpu_percent()
+    cpu_percent: float = 0
+    cpu_sample_ms: float = 0
+    """When the cpu usage was last measured"""
+
+    PHASES = ("physics", "behaviours", "sensors", "render")
+    """The phases of a tick that are timed separately (see mark_phase)"""
+    phase_ms: dict = {}
+    """How many milliseconds each phase took on the current tick"""
+    phase_start_s: float = 0
+    """time.perf_counter() of the previous mark_phase call, or the start of the tick"""
 
 
     def start_tick(self):
@@ -24,13 +34,27 @@ class Perfomance():
 
         # Update the measured performance of FPS
         self.tick_period_s = (self.current_tick_ms - self.previous_tick_ms) / 1000
+        self.phase_ms = dict.fromkeys(self.PHASES, 0)
+        self.phase_start_s = time.perf_counter()
         self.fps = 1/self.tick_period_s
 
         # Keep track of the minumum and maximum FPS performance
         self.fps_max = self.fps if self.fps > self.fps_max else self.fps_max
         self.fps_min = self.fps if self.fps < self.fps_min else self.fps_min
 
-        self.cpu_percent = psutil.cpu_percent()
+        # cpu usage is measured over the time since the previous measurement, so it's enough to
+        # measure it once a second. This also keeps psutil from being imported before the first frame
+        if self.current_tick_ms - self.cpu_sample_ms >= g_config.cpu_sample_period_ms:
+            import psutil
+            self.cpu_percent = psutil.cpu_percent()
+            self.cpu_sample_ms = self.current_tick_ms
+
+    def mark_phase(self, phase):
+        """Add the time since the previous mark, or the start of the tick, to the duration of `phase`.
+        Phases can be marked several times per tick, e.g. when their work is interleaved"""
+        now = time.perf_counter()
+        self.phase_ms[phase] = self.phase_ms.get(phase, 0) + (now - self.phase_start_s) * 1000
+        self.phase_start_s = now
 
     def __str__(self):
         """represents the data fields in the Performance object as a json string of the self.get_housekeeping() dict"""
@@ -42,6 +66,40 @@ class Perfomance():
             fps_max = int(self.fps_max),
             fps_min = int(self.fps_min),
             cpu_percent = int(self.cpu_percent),
+            phase_ms = {phase: round(ms, 1) for phase, ms in self.phase_ms.items()},
+            ray_cache = g_ray_cache.get_housekeeping(),
         )
 
-g_performance = Perfomance()
\ No newline at end of file
+g_performance = Perfomance()
+
+
+class StartupTimer:
+    """Measures how long each phase of starting the game takes, up to the first frame
+
+    :param start_s: time.perf_counter() when the game started, defaults to now
+    """
+
+    def __init__(self, start_s=None):
+        self.start_s = time.perf_counter() if start_s is None else start_s
+        self.phases = {}
+        """The duration of each phase in milliseconds, in the order they were marked"""
+        self.previous_s = self.start_s
+
+    def mark(self, phase):
+        """Record the time since the previous mark as the duration of `phase`"""
+        now = time.perf_counter()
+        self.phases[phase] = round((now - self.previous_s) * 1000, 1)
+        self.previous_s = now
+
+    def get_total_ms(self):
+        """The time from the start to the latest mark"""
+        return round((self.previous_s - self.start_s) * 1000, 1)
+
+    def __str__(self):
+        return json.dumps(self.get_housekeeping(), indent=4)
+
+    def get_housekeeping(self):
+        return dict(
+            phases_ms = self.phases,
+            total_ms = self.get_total_ms(),
+        )
@@ -0,0 +1,186 @@
+"""
+The raycache module caches the pixels that lidar rays pass through, for sensors that fire the same rays over and over.
+
+A resting bot fires its rays along the same lines every tick, and e.g. an elevator's rangefinders sweep over
+the same arc from nearly the same spot. Instead of walking and decoding every pixel of such rays on each
+tick, the `RayProfileCache` stores the pixel path of each ray and the scattering probability of its pixels
+(a ray profile), keyed by the ray's origin, angle and range rounded to `g_config.ray_cache_position_step`
+pixels and `g_config.ray_cache_angle_step` radians. A profile is traced from the exact origin and angle of
+the first ray of its key, and the rays of the same key that follow reuse it. A repeated ray is then only a
+random draw against the cached probabilities.
+
+Profiles that pass through a region of the world that is edited are evicted (see roller.terrain), except
+the profiles of a bot whose own platform is moved over air (see `RayProfileCache.moving_own_terrain`).
+"""
+
+import contextlib
+import math
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from roller import mapcache, terrain
+from roller.config import g_config
+from roller.datatypes import Point
+
+
+class RayProfileCache:
+    """:param capacity: the maximum number of ray profiles that are kept"""
+
+    def __init__(self, capacity=None):
+        self.capacity = g_config.ray_cache_capacity if capacity is None else capacity
+        self.profiles = OrderedDict()
+        """(xs, ys, distances, probabilities, tiles) of the cached rays, in least recently used order"""
+        self.tiles = defaultdict(set)
+        """The keys of the profiles that pass through each (tx, ty) tile of the world"""
+        self.layers = None
+        """The layers of the world the profiles were computed from"""
+        self.moving = None
+        """The (bot, sprite) of a bot that is moving the terrain it carries, see moving_own_terrain"""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        self.profiles.clear()
+        self.tiles.clear()
+
+    def get_key(self, origin, theta, max_range):
+        """Rays with the same key share a profile. The rays of a bot that carries terrain pass through it,
+        so they don't share profiles with other bots"""
+        position_step = g_config.ray_cache_position_step
+        angle_step = g_config.ray_cache_angle_step
+        return (
+            round(origin.x / position_step),
+            round(origin.y / position_step),
+            round((theta % (2 * math.pi)) / angle_step),
+            int(max_range),
+            None if getattr(origin, "own_terrain", None) is None else id(origin),
+        )
+
+    def compute_profile(self, origin, theta, max_range, layers):
+        """Walk the pixels of the ray from the origin up to its range, or until it leaves the world"""
+        max_range = int(max_range)
+        ux, uy = math.cos(theta), math.sin(theta)
+        # one pixel per step along the major axis of the ray, like Bresenham's algorithm
+        major = max(abs(ux), abs(uy))
+        distances = np.arange(math.ceil(max_range * major) + 1) / major
+        xs = np.floor(origin.x + ux * distances).astype(np.intp)
+        ys = np.floor(origin.y + uy * distances).astype(np.intp)
+
+        width, height = layers.get_size()
+        outside = (xs < 0) | (xs >= width) | (ys < 0) | (ys >= height)
+        if outside.any():
+            end = int(np.argmax(outside))
+            xs, ys, distances = xs[:end], ys[:end], distances[:end]
+        probabilities = np.array(layers.scatter[xs, ys], dtype=np.float32)
+        own_terrain = getattr(origin, "own_terrain", None)
+        if own_terrain is not None:
+            probabilities[get_inside(xs, ys, own_terrain)] = 0
+
+        tile_size = g_config.ray_cache_tile_size
+        tiles = set(zip((xs // tile_size).tolist(), (ys // tile_size).tolist()))
+        return xs, ys, distances, probabilities, tiles
+
+    def get_profile(self, origin, theta, max_range, layers):
+        """Returns the cached profile of a ray, computing it if needed"""
+        if layers is not self.layers:
+            # the world changed to another map
+            self.clear()
+            self.layers = layers
+        key = self.get_key(origin, theta, max_range)
+        profile = self.profiles.get(key)
+        if profile is not None:
+            self.hits += 1
+            self.profiles.move_to_end(key)
+            return profile
+
+        self.misses += 1
+        profile = self.profiles[key] = self.compute_profile(origin, theta, max_range, layers)
+        for tile in profile[4]:
+            self.tiles[tile].add(key)
+        while len(self.profiles) > self.capacity:
+            self.remove(next(iter(self.profiles)))
+            self.evictions += 1
+        return profile
+
+    def remove(self, key):
+        profile = self.profiles.pop(key)
+        for tile in profile[4]:
+            keys = self.tiles[tile]
+            keys.discard(key)
+            if not keys:
+                del self.tiles[tile]
+
+    def invalidate(self, rect):
+        """Evict the profiles of the rays that pass through the rect"""
+        kept_owner = None
+        if self.moving is not None:
+            bot, sprite = self.moving
+            # the bot's rays pass through its platform, and its profiles have no scattering pixels where the
+            # platform was, so they stay valid if the platform only moves over air
+            if sprite.background is not None and not mapcache.derive_scatter(sprite.background).any():
+                kept_owner = id(bot)
+        tile_size = g_config.ray_cache_tile_size
+        for tx in range(rect.left // tile_size, (rect.right - 1) // tile_size + 1):
+            for ty in range(rect.top // tile_size, (rect.bottom - 1) // tile_size + 1):
+                for key in list(self.tiles.get((tx, ty), ())):
+                    if key[4] is None or key[4] != kept_owner:
+                        self.remove(key)
+
+    @contextlib.contextmanager
+    def moving_own_terrain(self, bot, sprite):
+        """The edits of the world made within the context move the TerrainSprite that the bot carries
+        (see Bot.own_terrain)"""
+        self.moving = (bot, sprite)
+        try:
+            yield
+        finally:
+            self.moving = None
+
+    def get_lidar_return(self, origin, max_range, theta, world) -> Point:
+        """The same as calculations.get_lidar_return, but the pixels of the ray are read from the cache.
+        Rays fired by a bot pass through the terrain the bot carries (see Bot.own_terrain)"""
+        bot_hit = world.entity_index.raycast(origin, theta, max_range, exclude=origin)
+        xs, ys, distances, probabilities, _ = self.get_profile(origin, theta, max_range, world.layers)
+        own_terrain = getattr(origin, "own_terrain", None)
+        if own_terrain is not None:
+            # the terrain may have moved since the profile was computed
+            probabilities = np.where(get_inside(xs, ys, own_terrain), 0, probabilities)
+        # terrain behind a bot can't be seen
+        count = len(xs) if bot_hit is None else int(np.searchsorted(distances, bot_hit[0], side="right"))
+        # most rays scatter close to the origin, so random numbers are drawn in growing blocks of pixels
+        start, block = 0, 16
+        while start < count:
+            end = min(start + block, count)
+            scattered = np.random.random_sample(end - start) < probabilities[start:end]
+            if scattered.any():
+                first = start + int(np.argmax(scattered))
+                return Point(int(xs[first]), int(ys[first]))
+            start, block = end, block * 4
+        if bot_hit is not None:
+            return Point(int(origin.x + bot_hit[0] * math.cos(theta)), int(origin.y + bot_hit[0] * math.sin(theta)))
+        return None
+
+    def get_housekeeping(self):
+        lookups = self.hits + self.misses
+        return {
+            "profiles": len(self.profiles),
+            "hit_rate": round(self.hits / lookups, 2) if lookups else 0,
+            "evictions": self.evictions,
+        }
+
+
+def get_inside(xs, ys, rect):
+    """Returns which of the pixels (xs, ys) are inside the rect"""
+    return (xs >= rect.left) & (xs < rect.right) & (ys >= rect.top) & (ys < rect.bottom)
+
+
+@terrain.register_derived_layer
+def invalidate_ray_profiles(world, rect):
+    """The scattering probabilities of the pixels in the edited region changed"""
+    if world.layers is g_ray_cache.layers:
+        g_ray_cache.invalidate(rect)
+
+
+g_ray_cache = RayProfileCache()
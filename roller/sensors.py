@@ -7,6 +7,11 @@ from roller.datatypes import Point, Line
 from roller.places import places
 from roller.config import g_config
 from roller import colors
+from roller import sounds
+from roller.thermal import ThermalState, get_heat_flow
+from roller.visibility import get_lidar_returns
+from roller.raycache import g_ray_cache
+from roller.wavefront import Wavefront
 from roller.calculations import (
     get_line_pixels, 
     get_lidar_return,
@@ -18,6 +23,13 @@ from roller.calculations import (
 from enum import Enum, auto
 
 
+def mark_drawn(world, rect):
+    """Record the rect a pygame.draw call changed on world.interpretation, so that snapshots only have to
+    look at the tiles that were drawn to (see roller.snapshots)"""
+    if world.interpretation_dirty is not None:
+        world.interpretation_dirty.add(rect)
+
+
 class RetensionPolicy(Enum):
     ROUND_ROBIN = auto(),
     """This indexing strategy always overwrites the oldest data entry with the latest entry.
@@ -32,7 +44,7 @@ class RetensionPolicy(Enum):
 class Sensor:
 
     # Power and temperature attributes
-    temperature: float   = 20     # Current temperature of the sensor
+    temperature: float   = ThermalState(20)     # Current temperature of the sensor
     power_draw: float    = 1       # Watts
     mass: float          = 0.2           # m, Assumed mass in kg
     heat_capacity: float = 500  # Assumed specific heat capacity in J/(kg*K)
@@ -41,7 +53,7 @@ class Sensor:
     # Other attributes
     color: tuple[int,int,int] = colors.cyan
     """RGB color tuple used to render the sensor's data to screen. Each color channel is a uint8_t (0-255)"""
-    is_enabled:bool = True             # Whether the sensor is active
+    is_enabled:bool = ThermalState(True)             # Whether the sensor is active
     """An enabled sensor generates data, heat, and consumes power."""
     mount_angle: float = 0
 
@@ -50,6 +62,9 @@ class Sensor:
     data buffer that has been provided for them. It may store Point's, """
     data_index:int = 0
     """Used to index self.data within the sensor"""
+    data_capacity: int = 0
+    """The size of the data buffer of sensors that use next_data_index. The buffer is allocated
+    when the sensor first stores data, so sensors that never run don't take up memory"""
     retension_policy: RetensionPolicy = RetensionPolicy.ROUND_ROBIN
     """Determines how the sensor chooses what data do overwrite"""
     retension_period: float = 20
@@ -107,24 +122,20 @@ class Sensor:
         }
 
     def update_temperature(self, ambient_temperature:float, dt:float):
-        # Calculate heat generated
-        
-        heat_generated = self.power_draw * dt if self.is_enabled else 0
-        
-        # Calculate heat loss
-        heat_loss = self.heat_dissipation_rate * (self.temperature - ambient_temperature) * dt
-        
-        # Calculate net heat change
-        net_heat_change = heat_generated - heat_loss
-        
+        """Advance the temperature of this sensor alone. The game advances all sensors at once with
+        roller.thermal.g_thermal"""
+        heat_generated, heat_loss = get_heat_flow(self.temperature, ambient_temperature, self.power_draw,
+                                                  self.is_enabled, self.heat_dissipation_rate, dt)
         # Update sensor temperature
-        self.temperature += net_heat_change / (self.mass * self.heat_capacity)
+        self.temperature += (heat_generated - heat_loss) / (self.mass * self.heat_capacity)
 
     def next_data_index(self):
         """returns the next data index ot be written to using the configured data retension policy.
         Ensures that the index wraps correctly when reaching maximum.
         This indexing strategy always overwrites the oldest data entry, which can make the bot appear
         "snake like", as the data is deleted at the same pace that the bot is moving."""
+        if len(self.data) != self.data_capacity:
+            self.data = [None] * self.data_capacity
         if self.retension_policy == RetensionPolicy.ROUND_ROBIN:
             return (self.data_index + 1) % len(self.data)
         if self.retension_policy == RetensionPolicy.PICK_RANDOM:
@@ -151,6 +162,8 @@ class Lidar(Sensor):
     def overwrite_data(self, data: list[Line], world: pygame.Surface):
         """Draw the visual prepresentation of the data in the sensor's data buffer
         onto the world interpretation surface"""
+        if world.memory_grid is not None:
+            world.memory_grid.add_lines(data)
         for line in data:
 
             # Select the next index in the data buffer to be overwritten (selection method depends on aesthetic choices)
@@ -159,14 +172,14 @@ class Lidar(Sensor):
             # We erase the data visualization form the world Surface it's drawn on
             
             if self.data[self.data_index]:
-                pygame.draw.circle(world.interpretation, colors.black, self.data[self.data_index].end , 1)
+                mark_drawn(world, pygame.draw.circle(world.interpretation, colors.black, self.data[self.data_index].end , 1))
                 if self.shows_rays:
-                    pygame.draw.line(world.interpretation, colors.black, self.data[self.data_index].start, self.data[self.data_index].end, 1)
+                    mark_drawn(world, pygame.draw.line(world.interpretation, colors.black, self.data[self.data_index].start, self.data[self.data_index].end, 1))
             
             # We then store the new data element, and visualize it
             self.data[self.data_index] = line
-            pygame.draw.circle(world.interpretation, self.color, line.end, 1)
-            pygame.draw.line(world.interpretation, self.color + (30,), line.start, line.end, 1)
+            mark_drawn(world, pygame.draw.circle(world.interpretation, self.color, line.end, 1))
+            mark_drawn(world, pygame.draw.line(world.interpretation, self.color + (30,), line.start, line.end, 1))
 
     
 # Specific sensor classes inheriting from the base Sensor class
@@ -181,11 +194,11 @@ class SpectraScan_LX1(Lidar):
         # SpectraScan_SX30-specific attribute
         self.range = range
         self.model: str = self.__class__.__name__
-        self.data = [None] * int(g_config.fps * self.retension_period)
+        self.data_capacity = int(g_config.fps * self.retension_period)
 
 
     def run(self, bot, world):
-        point = get_lidar_return(bot, self.range, self.mount_angle+bot.phi, world)
+        point = g_ray_cache.get_lidar_return(bot, self.range, self.mount_angle+bot.phi, world)
         if point:
             self.overwrite_data([Line(Point(bot.x,bot.y), point)], world)
 
@@ -202,19 +215,20 @@ class SpectraScan_SX30(Lidar):
         self.laser_count = laser_count
         self.model: str = self.__class__.__name__
         self.is_stabilized = is_stabilized
-        self.data = [None] * int(g_config.fps * self.laser_count * self.retension_period)
+        self.data_capacity = int(g_config.fps * self.laser_count * self.retension_period)
 
         #move to base class
 
     def run(self, bot, world):
         data = []
-        for theta in np.linspace(0, 2*math.pi, num=self.laser_count):
-            # is the sensor does not have a stabilizer, it will
-            # be co-rotating with with the body of the bot
-            if not self.is_stabilized:
-                theta += bot.phi          
-
-            point = get_lidar_return(bot, self.range, theta, world)
+        thetas = np.linspace(0, 2*math.pi, num=self.laser_count)
+        # is the sensor does not have a stabilizer, it will
+        # be co-rotating with with the body of the bot
+        if not self.is_stabilized:
+            thetas += bot.phi
+
+        # sensors with many lasers share one visibility sweep between them (see roller.visibility)
+        for point in get_lidar_returns(bot, self.range, thetas, world):
             if point is None:
                 continue
             line = Line(Point(bot.x, bot.y), point)
@@ -233,13 +247,12 @@ class FOTIRS(Sensor):
 
     def render(self, bot, world, screen):
         if is_enabled:
-            pygame.draw.circle(world.interpretation, self.color, point, 3)
+            mark_drawn(world, pygame.draw.circle(world.interpretation, self.color, point, 3))
         
     def run(self, bot, world):
-        for theta in np.linspace(0, math.pi, num=self.laser_count):
-            point = get_lidar_return(bot, 200, theta, world)
+        for point in get_lidar_returns(bot, 200, np.linspace(0, math.pi, num=self.laser_count), world):
             if point != None:
-                pygame.draw.circle(world.interpretation, self.color, point, 1)
+                mark_drawn(world, pygame.draw.circle(world.interpretation, self.color, point, 1))
 
 class NAV1_InertiaCore(Sensor):
     """ NAV1_InertiaCore – Your Essential Navigation Companion. Need reliable motion tracking without the frills? The NAV1_InertiaCore is built for the everyday robotic explorer. Affordable, simple, and easy to integrate, this unit gives you what you need to get rolling."""
@@ -251,7 +264,7 @@ class NAV1_InertiaCore(Sensor):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.model = self.__class__.__name__
-        self.data = [None]* int(g_config.fps * self.retension_period)
+        self.data_capacity = int(g_config.fps * self.retension_period)
 
     def run(self, bot, world):
         """The Inertia Core measures the location it is mounted it, which co-rotates with the bot"""
@@ -259,13 +272,13 @@ class NAV1_InertiaCore(Sensor):
         # erase any existing data form the current index
         if self.data[self.data_index]:
             world.interpretation.set_at(self.data[self.data_index], colors.black) 
-            pygame.draw.circle(world.interpretation, colors.black, self.data[self.data_index], 2)   
+            mark_drawn(world, pygame.draw.circle(world.interpretation, colors.black, self.data[self.data_index], 2))
         sensor_location = get_line_endpoint(bot, bot.radius*4/5, bot.phi + self.mount_angle)
         self.data[self.data_index] = Point(int(sensor_location.x), int(sensor_location.y))
 
         # Visualize the data for the player
         # world.interpretation.set_at(self.data[self.data_index], self.color) 
-        pygame.draw.circle(world.interpretation, self.color, self.data[self.data_index], 2)   
+        mark_drawn(world, pygame.draw.circle(world.interpretation, self.color, self.data[self.data_index], 2))
 
     def render(self, bot, world, screen):
         if not self.is_enabled:
@@ -274,7 +287,7 @@ class NAV1_InertiaCore(Sensor):
         # we add the mount angle to bot.phi so the sensor spins with the spherebot
         sensor_xy = get_line_endpoint(bot, bot.radius*4/5, bot.phi + self.mount_angle)
         sensor_xy = world2screen(sensor_xy, world)
-        pygame.draw.circle(screen, self.color, sensor_xy, bot.radius/5)   
+        pygame.draw.circle(screen, self.color, sensor_xy, bot.radius/5 * world.scale)   
 
 class NAV1_GyroSphere(Sensor):
     """NAV1_GyroCore – Precision, Perfected. For those who demand pinpoint accuracy, the NAV1_GyroCore is the flagship of the NAV1 line. Designed with advanced calibration to track your robot's center of mass with unmatched precision, this high-end unit ensures smooth, stable motion data for even the most demanding applications. Whether you're navigating complex terrains or fine-tuning every movement. """
@@ -293,13 +306,97 @@ class NAV1_GyroSphere(Sensor):
             return
         
         sensor_xy = world2screen(bot, world)
-        pygame.draw.circle(screen, self.color, sensor_xy, bot.radius/5)
+        pygame.draw.circle(screen, self.color, sensor_xy, bot.radius/5 * world.scale)
 
         
 
 class Sonar(Sensor):
+    """The EchoPulse-S1 sonar. It goes "ping", listens, and tells you which way the walls are and how long
+    the echo took to come back, even around corners. Slower than light, but it doesn't care about the dark."""
+
+    power_draw = 3
+
+    def __init__(self, range = 300, ping_period = 1.0, **kwargs):
+        """:param range: how far the sound waves of the sonar travel (pixels)
+        :param ping_period: seconds between the pings of the sonar"""
+        super().__init__(**kwargs)
+        self.range = range
+        self.ping_period = ping_period
+        self.model = self.__class__.__name__
+        self.wavefront: Wavefront = None
+        """The sound wave of the latest ping (see roller.wavefront)"""
+        self.last_ping_ms = 0
+        self.echoes: list[tuple[float, float]] = []
+        """(echo time in seconds, direction in radians) of the echoes received from the latest ping"""
+        self.data: list[Point] = []
+        """The locations of the echoes of the latest ping, as drawn onto the world interpretation"""
+        self.in_flight: list[tuple[float, float, Point]] = []
+        """(echo time in seconds, direction in radians, location) of the echoes that were sent back by the
+        ground but haven't returned to the sonar yet"""
+        self.drawn_over: list[tuple[tuple, np.ndarray]] = []
+        """(x, y, width, height) of each echo drawn onto the world interpretation, and a copy of the pixels
+        that were there before, so the echoes can be erased without erasing what other sensors drew"""
+
     def run(self, bot, world):
-        if self.is_enabled:
-            print("Sonar is emitting sound waves to detect objects.")
-        else:
-            print("Sonar is disabled.")
+        """Send out a ping when all echoes of the previous one have returned and the ping period has passed,
+        propagate the sound wave by g_config.sonar_rings_per_tick rings, and receive the echoes whose time has come"""
+        now = pygame.time.get_ticks()
+        if self.wavefront is None or (self.wavefront.is_done and not self.in_flight and now - self.last_ping_ms >= self.ping_period * 1000):
+            self.ping(bot, world, now)
+        if not self.wavefront.is_done:
+            xs, ys, times, thetas = self.wavefront.advance(g_config.sonar_rings_per_tick)
+            points = [Point(x, y) for x, y in zip(xs.astype(int).tolist(), ys.astype(int).tolist())]
+            self.in_flight.extend(zip(times.tolist(), thetas.tolist(), points))
+
+        # the echoes are only heard, and drawn, once they have travelled back to the sonar
+        elapsed = (now - self.last_ping_ms) / 1000
+        returned = [echo for echo in self.in_flight if echo[0] <= elapsed]
+        if not returned:
+            return
+        self.in_flight = [echo for echo in self.in_flight if echo[0] > elapsed]
+        self.echoes.extend((time, theta) for time, theta, _ in returned)
+        bounds = world.interpretation.get_rect()
+        rects = [pygame.Rect(point.x - 1, point.y - 1, 3, 3).clip(bounds) for _, _, point in returned]
+        pixels = pygame.surfarray.pixels2d(world.interpretation)
+        self.drawn_over.extend((tuple(rect), pixels[rect.left:rect.right, rect.top:rect.bottom].copy()) for rect in rects)
+        del pixels
+        for _, _, point in returned:
+            self.data.append(point)
+            mark_drawn(world, pygame.draw.circle(world.interpretation, self.color, point, 1))
+
+    def ping(self, bot, world, now):
+        """Erase the echoes of the previous ping, and send out a new sound wave. Only the pixels that
+        still have the color of the echoes are erased, the returns other sensors drew on top are kept"""
+        if self.drawn_over:
+            pixels = pygame.surfarray.pixels2d(world.interpretation)
+            # map_rgb returns a signed int, the pixels are unsigned
+            color = np.uint32(world.interpretation.map_rgb(self.color) & 0xffffffff)
+            # latest first, so where echoes overlap the pixels from before the first one are put back
+            for (x, y, width, height), before in reversed(self.drawn_over):
+                area = pixels[x:x + width, y:y + height]
+                echo = area == color
+                area[echo] = before[echo]
+                mark_drawn(world, pygame.Rect(x, y, width, height))
+            del pixels
+        self.drawn_over = []
+        self.data = []
+        self.echoes = []
+        self.in_flight = []
+        self.last_ping_ms = now
+        self.wavefront = Wavefront(bot.x, bot.y, self.range, world.occupancy)
+        sounds.g_sounds.play(sounds.generate_modulated_sine_wave, 2400, 1800, 0.08, amplitude=6000,
+                             priority=sounds.SONAR_PING_PRIORITY)
+
+    def render(self, bot, world, screen):
+        """Draw the sound wave while it travels"""
+        if not self.is_enabled or self.wavefront is None or self.wavefront.is_done:
+            return
+        origin = world2screen(Point(self.wavefront.x, self.wavefront.y), world)
+        pygame.draw.circle(screen, self.color, origin, self.wavefront.get_radius() * world.scale, 1)
+
+    def get_housekeeping(self):
+        housekeeping = super().get_housekeeping()
+        housekeeping["echoes"] = len(self.echoes)
+        if self.echoes:
+            housekeeping["first_echo_ms"] = round(self.echoes[0][0] * 1000, 1)
+        return housekeeping
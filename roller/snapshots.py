@@ -0,0 +1,442 @@
+"""
+The snapshots module records the state of the game every few ticks, so the game can be rewound to any of
+the recorded moments, for debugging and for gameplay.
+
+A snapshot holds the state of the bots, their sensors and behaviours, the camera, and the sensor data drawn
+onto the world: the `world.interpretation` surface and the occupancy grid memory (see roller.memory). The
+`world.memory_grid_surface` is drawn from the grid, so it is not recorded, but redrawn where the grid is
+restored.
+Bots, sensors, behaviours and the camera are recorded as the plain values among their attributes
+(see `get_state`). The surface, the grid and the sensors' data buffers are too big to copy on every
+snapshot, so they are recorded as deltas: a snapshot only holds the tiles of the surface or grid, or the
+items of a data buffer, that changed since the previous snapshot. The memory used grows with how much
+changes in the game, not with the size of the map. The sensors report the rects they draw onto the
+surface, and the grid the cells it changes (see roller.dirtytiles), so only the tiles that were drawn to
+are compared when a snapshot is captured or restored.
+
+The snapshots are kept in a ring buffer of g_config.snapshot_capacity snapshots. When the oldest snapshot
+is dropped, its deltas are merged into the base that the deltas of the later snapshots apply to. Restoring
+a snapshot only rewrites the tiles and items that changed after it, so it takes a few milliseconds however
+big the map is. Recording can be turned off with g_config.snapshot_enabled.
+
+Attributes that are not plain values keep their current state when a snapshot is restored, e.g. the sound
+wave of a sonar and the planned paths. The heat field and the water simulation are not recorded either.
+"""
+
+import time
+import itertools
+import operator
+
+import numpy as np
+import pygame
+
+from roller.config import g_config
+from roller.sensors import Sensor
+
+PLAIN_TYPES = (bool, int, float, str, tuple, type(None))
+"""Types of the attributes that are recorded in a snapshot. They are immutable, so they don't need to be copied"""
+
+THERMAL_ATTRIBUTES = ("temperature", "is_enabled")
+"""Sensor attributes that are stored in the arrays of roller.thermal, and not in the sensor itself"""
+
+SURFACES = ("interpretation",)
+"""The surfaces of the world that are recorded"""
+
+
+def get_state(obj):
+    """Returns the plain values among the attributes of an object"""
+    return {name: value for name, value in vars(obj).items() if isinstance(value, PLAIN_TYPES)}
+
+
+def set_state(obj, state):
+    """Sets the attributes of an object back to a state returned by `get_state`. Plain attributes that
+    were set after the state was recorded are removed, so they fall back to the class defaults"""
+    for name in [name for name, value in vars(obj).items() if isinstance(value, PLAIN_TYPES) and name not in state]:
+        delattr(obj, name)
+    for name, value in state.items():
+        setattr(obj, name, value)
+
+
+class ArrayHistory:
+    """The history of a 2d array, e.g. the pixels of a surface, as the tiles that changed from snapshot to snapshot
+
+    :param array: the array as of when recording starts
+    :param tile_size: width and height of the tiles in array elements
+    """
+
+    def __init__(self, array, tile_size):
+        self.tile_size = tile_size
+        self.is_transposed = array.strides[0] < array.strides[1]
+        """Whether the array is stored by columns, like the pixel arrays of surfaces. Such arrays are
+        transposed, so they are always compared in the order of their memory"""
+        array = self.get_rows(array)
+        self.reference = array.copy()
+        """The array as of the latest snapshot. Changed tiles are found by comparing against it"""
+        self.base = {}
+        """The tiles of the array as of before the oldest retained snapshot. Tiles that are not in here are 0"""
+        for tile in self.get_nonzero_tiles(array):
+            self.base[tile] = array[self.get_slices(tile)].copy()
+
+    def get_rows(self, array):
+        """Returns the array as a view whose rows are contiguous in memory"""
+        return array.T if self.is_transposed else array
+
+    def get_row_tiles(self, tiles):
+        """Returns the (row, column) tiles of the array's rows for (tx, ty) tiles of the array indexed [x, y]"""
+        return {(ty, tx) for tx, ty in tiles} if self.is_transposed else set(tiles)
+
+    def get_slices(self, tile):
+        row, column = tile
+        size = self.tile_size
+        return slice(row * size, (row + 1) * size), slice(column * size, (column + 1) * size)
+
+    def get_nonzero_tiles(self, array):
+        """Returns the tiles where the array is not 0. The array is scanned in bands of tile_size rows, and
+        only the bands that are not 0 are split into tiles"""
+        size = self.tile_size
+        tiles = []
+        for start in range(0, array.shape[0], size):
+            nonzero = array[start:start + size] != 0
+            if not nonzero.any():
+                continue
+            columns = np.flatnonzero(nonzero.any(axis=0))
+            tiles.extend((start // size, column) for column in np.unique(columns // size).tolist())
+        return tiles
+
+    def get_changed_tiles(self, array, dirty):
+        """Returns the tiles among the dirty (tx, ty) tiles where the array differs from the reference.
+        The dirty tiles of each band of tile_size rows are compared at once"""
+        size = self.tile_size
+        bands = {}
+        for row, column in self.get_row_tiles(dirty):
+            bands.setdefault(row, []).append(column)
+        tiles = []
+        for row, columns in bands.items():
+            start, stop = min(columns) * size, (max(columns) + 1) * size
+            rows = slice(row * size, (row + 1) * size)
+            changed = (array[rows, start:stop] != self.reference[rows, start:stop]).any(axis=0)
+            if not changed.any():
+                continue
+            changed = np.flatnonzero(changed) // size + min(columns)
+            tiles.extend((row, column) for column in set(changed.tolist()).intersection(columns))
+        return tiles
+
+    def capture(self, array, dirty):
+        """Returns the delta since the previous capture: a dict of copies of the changed tiles, keyed by their
+        (row, column) in the tile grid of the array's rows
+
+        :param dirty: the (tx, ty) tiles of the array that were written to since the previous capture.
+            Only these are compared, the rest of the array must not have changed
+        """
+        array = self.get_rows(array)
+        delta = {}
+        for tile in self.get_changed_tiles(array, dirty):
+            slices = self.get_slices(tile)
+            delta[tile] = array[slices].copy()
+            self.reference[slices] = delta[tile]
+        return delta
+
+    def merge(self, delta):
+        """Merge the delta of the oldest snapshot into the base, when the snapshot is dropped"""
+        self.base.update(delta)
+
+    def get_tile(self, tile, deltas):
+        """Returns the content of a tile after the deltas have been applied, or None if it's 0"""
+        for delta in reversed(deltas):
+            if tile in delta:
+                return delta[tile]
+        return self.base.get(tile)
+
+    def restore(self, array, deltas, index, dirty):
+        """Set the array back to how it was when the snapshot `index` was captured
+
+        :param deltas: the deltas captured for each retained snapshot, oldest first
+        :param dirty: the (tx, ty) tiles of the array that were written to since the latest capture
+        :returns: (row slice, column slice) of the parts of the array that were rewritten
+        """
+        array = self.get_rows(array)
+        # only the tiles that changed after the snapshot differ from it
+        tiles = self.get_row_tiles(dirty)
+        for delta in deltas[index + 1:]:
+            tiles.update(delta)
+        for tile in tiles:
+            slices = self.get_slices(tile)
+            content = self.get_tile(tile, deltas[:index + 1])
+            if content is None:
+                content = 0
+            array[slices] = content
+            self.reference[slices] = content
+        return [self.get_slices(tile)[::-1] if self.is_transposed else self.get_slices(tile) for tile in tiles]
+
+    def get_nbytes(self, delta):
+        return sum(tile.nbytes for tile in delta.values())
+
+
+class ListHistory:
+    """The history of a list of immutable items, e.g. the data buffer of a sensor, as the items that changed
+    from snapshot to snapshot. When the length of the list changes, the whole list is recorded
+
+    :param items: the list as of when recording starts
+    """
+
+    def __init__(self, items):
+        self.reference = list(items)
+        """The list as of the latest snapshot"""
+        self.base = list(items)
+        """The list as of before the oldest retained snapshot"""
+
+    def get_changed_indices(self, items):
+        """Returns the indices of the items that are not the same objects as in the reference. The items are
+        only compared by identity, since some of them, e.g. arrays, can't be compared with =="""
+        return list(itertools.compress(range(len(items)), map(operator.is_not, items, self.reference)))
+
+    def capture(self, items):
+        """Returns the delta since the previous capture: a dict of the changed items keyed by their index,
+        or a copy of the whole list if its length changed"""
+        if len(items) != len(self.reference):
+            self.reference = list(items)
+            return list(items)
+        delta = {index: items[index] for index in self.get_changed_indices(items)}
+        for index, item in delta.items():
+            self.reference[index] = item
+        return delta
+
+    def merge(self, delta):
+        """Merge the delta of the oldest snapshot into the base, when the snapshot is dropped"""
+        if isinstance(delta, list):
+            self.base = list(delta)
+            return
+        for index, item in delta.items():
+            self.base[index] = item
+
+    def get_items(self, indices, deltas):
+        """Returns a dict of the items at the indices after the deltas have been applied. The deltas are searched
+        from the latest, and each delta only for the items that were not found in the later ones"""
+        items = {}
+        remaining = set(indices)
+        for delta in reversed(deltas):
+            if not remaining:
+                break
+            if isinstance(delta, list):
+                found = remaining
+            else:
+                found = remaining & delta.keys()
+            items.update((index, delta[index]) for index in found)
+            remaining = remaining - found
+        items.update((index, self.base[index]) for index in remaining)
+        return items
+
+    def restore(self, items, deltas, index):
+        """Returns the list as it was when the snapshot `index` was captured. The list is changed in place
+        if its length has not changed since, otherwise a new list is returned
+
+        :param deltas: the deltas captured for each retained snapshot, oldest first
+        """
+        kept = deltas[:index + 1]
+        if len(items) == len(self.reference) and not any(isinstance(delta, list) for delta in deltas[index + 1:]):
+            # only the items that changed after the snapshot differ from it
+            indices = set(self.get_changed_indices(items))
+            for delta in deltas[index + 1:]:
+                indices.update(delta)
+            for i, item in self.get_items(indices, kept).items():
+                items[i] = self.reference[i] = item
+            return items
+
+        # the length changed, so the list is rebuilt from the latest full copy before the snapshot
+        full = [i for i, delta in enumerate(kept) if isinstance(delta, list)]
+        start = full[-1] if full else -1
+        items = list(kept[start]) if full else list(self.base)
+        for delta in kept[start + 1:]:
+            for i, item in delta.items():
+                items[i] = item
+        self.reference = list(items)
+        return items
+
+    def get_nbytes(self, delta):
+        # the items are shared with the list, only the references to them are stored
+        return 8 * len(delta)
+
+
+class Snapshot:
+    """The state of the game on one tick
+
+    :param tick: the tick the snapshot was captured on, counted by the SnapshotRing
+    :param states: the state of each recorded object (see get_state), in the order of SnapshotRing.objects
+    :param deltas: the delta of each history of the SnapshotRing, keyed like SnapshotRing.histories
+    """
+
+    def __init__(self, tick, states, deltas, nbytes):
+        self.tick = tick
+        self.states = states
+        self.deltas = deltas
+        self.nbytes = nbytes
+        """The memory used by the deltas"""
+
+
+class SnapshotRing:
+    """Captures a snapshot of the game every g_config.snapshot_period_ticks ticks, keeping the latest
+    g_config.snapshot_capacity snapshots.
+
+    Recording starts over when the entities or their sensors change, or the world enters another map,
+    since snapshots can only be restored onto the same objects they were captured from.
+    """
+
+    def __init__(self):
+        self.snapshots = []
+        """The retained snapshots, oldest first"""
+        self.objects = []
+        """The camera, entities, sensors and behaviours whose state is recorded"""
+        self.surfaces = ()
+        """The recorded surfaces of the world, to tell when the world has entered another map"""
+        self.histories = {}
+        """The ArrayHistory or ListHistory of each recorded surface, grid and data buffer"""
+        self.tick = 0
+        self.capture_ms = 0
+        self.restore_ms = 0
+
+    def get_objects(self, entities, camera):
+        """Returns the objects whose state is recorded"""
+        objects = [camera]
+        for entity in entities:
+            objects.append(entity)
+            objects.extend(entity.sensors)
+            objects.extend(entity.behaviours)
+        return objects
+
+    def get_arrays(self, world):
+        """Returns the arrays of the recorded surfaces and grid, keyed like self.histories. The surfaces
+        are locked until the returned arrays are deleted"""
+        arrays = {name: pygame.surfarray.pixels2d(getattr(world, name)) for name in SURFACES}
+        arrays["memory_grid"] = world.memory_grid.log_odds
+        return arrays
+
+    def get_dirty(self, world):
+        """Returns the DirtyTiles of the recorded surfaces and grid, keyed like self.histories"""
+        dirty = {name: getattr(world, name + "_dirty") for name in SURFACES}
+        dirty["memory_grid"] = world.memory_grid.changed_tiles
+        return dirty
+
+    def get_lists(self):
+        """Returns the recorded lists of the sensors, keyed like self.histories"""
+        return {
+            (index, name): value
+            for index, obj in enumerate(self.objects) if isinstance(obj, Sensor)
+            for name, value in vars(obj).items() if isinstance(value, list)
+        }
+
+    def is_recording(self, entities, camera, world):
+        """Whether the snapshots were captured from the current entities, camera and world"""
+        objects = self.get_objects(entities, camera)
+        return (
+            len(objects) == len(self.objects)
+            and all(a is b for a, b in zip(objects, self.objects))
+            and all(getattr(world, name) is surface for name, surface in zip(SURFACES, self.surfaces))
+            and self.get_lists().keys() <= self.histories.keys()
+        )
+
+    def reset(self, entities, camera, world):
+        """Forget the snapshots, and start recording the current entities, camera and world"""
+        self.snapshots = []
+        self.objects = self.get_objects(entities, camera)
+        self.surfaces = tuple(getattr(world, name) for name in SURFACES)
+        arrays = self.get_arrays(world)
+        self.histories = {name: ArrayHistory(array, g_config.snapshot_tile_size) for name, array in arrays.items()}
+        del arrays
+        # the histories start from the whole arrays
+        for dirty in self.get_dirty(world).values():
+            dirty.pop()
+        self.histories.update({key: ListHistory(items) for key, items in self.get_lists().items()})
+
+    def update(self, entities, camera, world):
+        """Call once per tick. Captures a snapshot every g_config.snapshot_period_ticks ticks"""
+        if not g_config.snapshot_enabled:
+            return
+        self.tick += 1
+        if self.tick % g_config.snapshot_period_ticks == 0:
+            self.capture(entities, camera, world)
+
+    def capture(self, entities, camera, world):
+        """Capture a snapshot of the current state, dropping the oldest snapshot if the ring is full"""
+        start = time.perf_counter()
+        if not self.is_recording(entities, camera, world):
+            self.reset(entities, camera, world)
+
+        states = [get_state(obj) for obj in self.objects]
+        for obj, state in zip(self.objects, states):
+            if isinstance(obj, Sensor):
+                state.update((name, getattr(obj, name)) for name in THERMAL_ATTRIBUTES)
+
+        deltas = {}
+        arrays = self.get_arrays(world)
+        dirty = self.get_dirty(world)
+        for name, array in arrays.items():
+            deltas[name] = self.histories[name].capture(array, dirty[name].pop())
+        del arrays
+        for key, items in self.get_lists().items():
+            deltas[key] = self.histories[key].capture(items)
+
+        nbytes = sum(self.histories[key].get_nbytes(delta) for key, delta in deltas.items())
+        self.snapshots.append(Snapshot(self.tick, states, deltas, nbytes))
+        while len(self.snapshots) > g_config.snapshot_capacity:
+            dropped = self.snapshots.pop(0)
+            for key, delta in dropped.deltas.items():
+                self.histories[key].merge(delta)
+
+        self.capture_ms = (time.perf_counter() - start) * 1000
+
+    def restore(self, index, entities, camera, world):
+        """Set the game back to the snapshot `index` of self.snapshots. The snapshots after it are dropped.
+
+        :returns: whether the snapshot was restored. Snapshots of other entities or maps can't be restored
+        """
+        if not self.snapshots or not self.is_recording(entities, camera, world):
+            return False
+        start = time.perf_counter()
+        index = index % len(self.snapshots)
+        snapshot = self.snapshots[index]
+
+        for obj, state in zip(self.objects, snapshot.states):
+            set_state(obj, state)
+
+        arrays = self.get_arrays(world)
+        dirty = self.get_dirty(world)
+        rewritten = {}
+        for name, array in arrays.items():
+            deltas = [s.deltas[name] for s in self.snapshots]
+            rewritten[name] = self.histories[name].restore(array, deltas, index, dirty[name].pop())
+        del arrays
+        # lidar returns of the current tick don't belong to the restored grid
+        world.memory_grid.pending = []
+        # paths planned with the memory are planned again
+        world.memory_grid.updates += 1
+        for cells_x, cells_y in rewritten["memory_grid"]:
+            world.memory_grid.invalidate(cells_x.start, cells_y.start, cells_x.stop, cells_y.stop)
+        for (object_index, name), items in self.get_lists().items():
+            history = self.histories[(object_index, name)]
+            setattr(self.objects[object_index], name, history.restore(items, [s.deltas[(object_index, name)] for s in self.snapshots], index))
+
+        del self.snapshots[index + 1:]
+        self.tick = snapshot.tick
+        self.restore_ms = (time.perf_counter() - start) * 1000
+        return True
+
+    def rewind(self, entities, camera, world):
+        """Go back to the latest snapshot that is at least half a snapshot period old, so rewinding
+        repeatedly goes further back"""
+        if not self.snapshots:
+            return False
+        index = len(self.snapshots) - 1
+        if self.tick - self.snapshots[index].tick < g_config.snapshot_period_ticks / 2:
+            index -= 1
+        return self.restore(max(index, 0), entities, camera, world)
+
+    def get_housekeeping(self):
+        return {
+            "snapshots": len(self.snapshots),
+            "kb": round(sum(snapshot.nbytes for snapshot in self.snapshots) / 1024),
+            "capture_ms": round(self.capture_ms, 1),
+            "restore_ms": round(self.restore_ms, 1),
+        }
+
+
+g_snapshots = SnapshotRing()
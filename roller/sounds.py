@@ -1,14 +1,42 @@
+"""
+The sounds module generates waveforms, and plays them as sound effects.
+
+Sound effects are played through the `SoundManager` `g_sounds`, which caches the Sounds of generated
+waveforms by the generator and its parameters, and plays them on a fixed pool of mixer channels
+(voices). When all voices are busy, a new sound takes over the voice playing the least important sound,
+or is dropped if all playing sounds are more important. The pings of sonars and bots hitting each other
+are played this way.
+"""
+
+from collections import OrderedDict
+
 import numpy as np
 import pygame
 
 from roller.config import g_config
+from roller import effects
 
 sample_rate = g_config.mixer_sample_frequency
 
-def play_sound(waveform, sample_rate=sample_rate):
-    """Plays a sound from a NumPy array using Pygame"""
-    sound = pygame.sndarray.make_sound(waveform)
-    sound.play()
+SONAR_PING_PRIORITY = 1
+"""Priority of the pings of sonars (see SoundManager.play)"""
+COLLISION_PRIORITY = 2
+"""Priority of the sounds of bots hitting each other. They are louder and rarer than sonar pings"""
+
+def play_sound(waveform, sample_rate=sample_rate, priority=0):
+    """Plays a sound from a NumPy array using Pygame. Sounds that are played repeatedly should be
+    played with `g_sounds.play`, so their Sound is only made once"""
+    return g_sounds.play_sound(make_sound(waveform), priority)
+
+
+def make_sound(waveform):
+    """Returns a pygame Sound of a mono waveform, for the number of channels the mixer was initialized with"""
+    channels = pygame.mixer.get_init()[2]
+    if channels > 1:
+        waveform = np.repeat(np.asarray(waveform)[:, np.newaxis], channels, axis=1)
+    return pygame.sndarray.make_sound(waveform)
+
+
 
 
 
@@ -37,12 +65,18 @@ def combine_waves_normalized(*waves):
 
 
 def low_pass_filter(wave, cutoff_freq, sample_rate):
-    rc = 1 / (2 * np.pi * cutoff_freq)
-    alpha = sample_rate * rc / (sample_rate * rc + 1)
-    filtered_wave = np.zeros_like(wave)
-    for i in range(1, len(wave)):
-        filtered_wave[i] = alpha * wave[i] + (1 - alpha) * filtered_wave[i - 1]
-    return filtered_wave
+    """First order low pass filter of a whole waveform (see effects.LowPassFilter)"""
+    return effects.LowPassFilter(cutoff_freq, sample_rate).process(wave).astype(wave.dtype)
+
+
+def apply_echo(wave, delay, decay, sample_rate):
+    """Adds one echo of the waveform after `delay` seconds (see effects.Echo)"""
+    return effects.Echo(delay, decay, sample_rate).process(wave)
+
+
+def apply_tremolo(wave, mod_freq, sample_rate):
+    """Modulates the amplitude of the waveform (see effects.Tremolo)"""
+    return effects.Tremolo(mod_freq, sample_rate).process(wave)
 
 
 def generate_sine_wave(frequency, duration, sample_rate=sample_rate, amplitude=32767):
@@ -87,42 +121,127 @@ def generate_layered_tone(base_freq,duration, detune=1, wave_count=5, sample_rat
 
 
 def apply_amplitude_envelope(wave, attack_time, decay_time, sample_rate=44100):
-    num_samples = len(wave)
-    envelope = np.ones(num_samples)
-
-    # Attack phase (fade in)
-    attack_samples = int(attack_time * sample_rate)
-    envelope[:attack_samples] = np.linspace(0, 1, attack_samples)
-
-    # Decay phase (fade out)
-    decay_samples = int(decay_time * sample_rate)
-    envelope[-decay_samples:] = np.linspace(1, 0, decay_samples)
-
-    return (wave * envelope).astype(np.int16)
+    envelope = effects.fade_envelope(len(wave), attack_time, decay_time, sample_rate)
+    return envelope.process(wave).astype(np.int16)
 
 
 
 def apply_adsr(wave, sample_rate, attack=0.3, decay=0.5, sustain_level=0.3, release=0.5):
-    length = len(wave)
-    adsr = np.ones(length)
-    attack_samples = int(attack * sample_rate)
-    decay_samples = int(decay * sample_rate)
-    release_samples = int(release * sample_rate)
-    
-    # Attack phase (fade in)
-    adsr[:attack_samples] = np.linspace(0, 1, attack_samples)
-    
-    # Decay phase
-    adsr[attack_samples:attack_samples+decay_samples] = np.linspace(1, sustain_level, decay_samples)
-    
-    # Release phase (fade out)
-    adsr[-release_samples:] = np.linspace(sustain_level, 0, release_samples)
-    
-    # Apply envelope to the wave
-    return wave * adsr
+    envelope = effects.adsr_envelope(len(wave), attack, decay, sustain_level, release, sample_rate)
+    return envelope.process(wave)
 
 
 def generate_white_noise(duration, sample_rate=44100, amplitude=32767):
     num_samples = int(sample_rate * duration)
     wave = np.random.uniform(-amplitude, amplitude, num_samples)
-    return wave.astype(np.int16)
\ No newline at end of file
+    return wave.astype(np.int16)
+
+
+class SoundManager:
+    """Plays sound effects on a pool of mixer channels, and caches the Sounds of generated waveforms.
+
+    :param voice_count: the number of mixer channels in the pool
+    :param cache_capacity: the maximum number of Sounds that are kept
+    :param first_channel: the index of the first mixer channel of the pool. The channels before it are
+        left for other uses, e.g. the music (see roller.music)
+    """
+
+    def __init__(self, voice_count=None, cache_capacity=None, first_channel=1):
+        self.voice_count = g_config.mixer_voice_count if voice_count is None else voice_count
+        self.cache_capacity = g_config.sound_cache_capacity if cache_capacity is None else cache_capacity
+        self.first_channel = first_channel
+        self.cache = OrderedDict()
+        """(waveform, Sound) keyed by (generator, args, kwargs), in least recently used order"""
+        self.voices = []
+        """The mixer channels of the pool"""
+        self.priorities = []
+        """The priority of the sound last played on each voice"""
+        self.started = []
+        """The number of the sound last played on each voice, counting all sounds played, to find the oldest"""
+        self.play_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.steals = 0
+        self.dropped = 0
+
+    def init(self):
+        """Set up the voice pool. Has to be called after the mixer has been initialized"""
+        if pygame.mixer.get_init() is None or self.voices:
+            return
+        channel_count = self.first_channel + self.voice_count
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), channel_count))
+        # only the pool plays on its channels
+        pygame.mixer.set_reserved(channel_count)
+        self.voices = [pygame.mixer.Channel(index) for index in range(self.first_channel, channel_count)]
+        self.priorities = [0] * self.voice_count
+        self.started = [0] * self.voice_count
+
+    def get_sound(self, generator, *args, **kwargs):
+        """Returns the Sound of the waveform `generator(*args, **kwargs)`, generating it only if it is not cached.
+        The arguments have to be hashable"""
+        key = (generator, args, tuple(sorted(kwargs.items())))
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return entry[1]
+
+        self.misses += 1
+        waveform = generator(*args, **kwargs)
+        # the Sound shares the cached waveform, which must not change
+        waveform.setflags(write=False)
+        self.cache[key] = (waveform, make_sound(waveform))
+        while len(self.cache) > self.cache_capacity:
+            self.cache.popitem(last=False)
+        return self.cache[key][1]
+
+    def play(self, generator, *args, priority=0, **kwargs):
+        """Play the waveform `generator(*args, **kwargs)` (see get_sound).
+
+        :param priority: sounds with higher priorities take over the voices of lower priority sounds
+        :returns: the channel the sound is played on, or None if it was dropped
+        """
+        if not self.voices:
+            # there is no mixer to play on, e.g. in the tests
+            return None
+        return self.play_sound(self.get_sound(generator, *args, **kwargs), priority)
+
+    def play_sound(self, sound, priority=0):
+        """Play a Sound on an idle voice, or on the voice of the lowest priority sound if all voices are busy.
+
+        :returns: the channel the sound is played on, or None if it was dropped
+        """
+        if not self.voices:
+            return None
+        steal = None
+        for index, voice in enumerate(self.voices):
+            if not voice.get_busy():
+                break
+            if steal is None or (self.priorities[index], self.started[index]) < (self.priorities[steal], self.started[steal]):
+                steal = index
+        else:
+            # all voices are busy, so the least important sound is stopped. Of equally important
+            # sounds the oldest one is stopped
+            if self.priorities[steal] > priority:
+                self.dropped += 1
+                return None
+            self.steals += 1
+            index = steal
+        self.voices[index].play(sound)
+        self.priorities[index] = priority
+        self.play_count += 1
+        self.started[index] = self.play_count
+        return self.voices[index]
+
+    def get_housekeeping(self):
+        lookups = self.hits + self.misses
+        return {
+            "cached": len(self.cache),
+            "hit_rate": round(self.hits / lookups, 2) if lookups else 0,
+            "voices_busy": sum(voice.get_busy() for voice in self.voices),
+            "steals": self.steals,
+            "dropped": self.dropped,
+        }
+
+
+g_sounds = SoundManager()
@@ -0,0 +1,143 @@
+"""
+The spatial module implements a uniform-grid spatial hash over the moving entities of the game (bots).
+Entities are inserted into every grid cell their bounding circle overlaps, so queries only need to
+test the entities in the cells near the query, instead of every entity in the game.
+
+The hash is intended to be rebuilt once per game tick, after which it can be used e.g. to
+find which bots a lidar ray hits (`raycast`), or which bots collide with each other (`get_overlapping_pairs`).
+"""
+
+import math
+from collections import defaultdict
+
+from roller.config import g_config
+
+
+def ray_circle_intersection(x0, y0, ux, uy, cx, cy, radius):
+    """Returns the distance along the ray from (x0, y0) in the direction of the unit vector (ux, uy)
+    to the first intersection with the circle, or None if the ray misses the circle.
+    Returns 0 if the ray starts inside the circle."""
+    fx = x0 - cx
+    fy = y0 - cy
+    b = fx*ux + fy*uy
+    c = fx*fx + fy*fy - radius*radius
+    discriminant = b*b - c
+    if discriminant < 0:
+        return None
+    root = math.sqrt(discriminant)
+    if -b + root < 0:
+        # the circle is behind the ray
+        return None
+    return max(-b - root, 0)
+
+
+class SpatialHash:
+    """:param cell_size: width and height of the grid cells in pixels"""
+
+    def __init__(self, cell_size=None):
+        self.cell_size = g_config.spatial_hash_cell_size if cell_size is None else cell_size
+        self.cells = defaultdict(list)
+        """Entities keyed by the (cx, cy) grid coordinates of the cells they overlap"""
+
+    def clear(self):
+        self.cells.clear()
+
+    def insert(self, entity):
+        """Insert an entity with x, y and radius attributes into the cells its bounding box overlaps"""
+        size = self.cell_size
+        for cx in range(math.floor((entity.x - entity.radius) / size), math.floor((entity.x + entity.radius) / size) + 1):
+            for cy in range(math.floor((entity.y - entity.radius) / size), math.floor((entity.y + entity.radius) / size) + 1):
+                self.cells[(cx, cy)].append(entity)
+
+    def rebuild(self, entities):
+        """Empty the hash and insert all the entities at their current positions"""
+        self.clear()
+        for entity in entities:
+            self.insert(entity)
+
+    def query_rect(self, x0, y0, x1, y1, margin=2):
+        """Returns the entities whose circles are within `margin` pixels of the rectangle (x0, y0)...(x1, y1)"""
+        size = self.cell_size
+        found = {}
+        for cx in range(math.floor((x0 - margin) / size), math.floor((x1 + margin) / size) + 1):
+            for cy in range(math.floor((y0 - margin) / size), math.floor((y1 + margin) / size) + 1):
+                for entity in self.cells.get((cx, cy), ()):
+                    if (x0 - margin - entity.radius < entity.x < x1 + margin + entity.radius and
+                        y0 - margin - entity.radius < entity.y < y1 + margin + entity.radius):
+                        found[id(entity)] = entity
+        return list(found.values())
+
+    def traverse_ray(self, x0, y0, ux, uy, length):
+        """Yields (cx, cy, t_exit) for the grid cells the ray passes through in order,
+        where t_exit is the distance along the ray at which it leaves the cell.
+        (Amanatides & Woo grid traversal)"""
+        size = self.cell_size
+        cx = math.floor(x0 / size)
+        cy = math.floor(y0 / size)
+        step_x = 1 if ux > 0 else -1
+        step_y = 1 if uy > 0 else -1
+        # distance along the ray to the next vertical and horizontal cell boundaries
+        t_max_x = ((cx + (step_x > 0)) * size - x0) / ux if ux != 0 else math.inf
+        t_max_y = ((cy + (step_y > 0)) * size - y0) / uy if uy != 0 else math.inf
+        t_delta_x = size / abs(ux) if ux != 0 else math.inf
+        t_delta_y = size / abs(uy) if uy != 0 else math.inf
+
+        while True:
+            t_exit = min(t_max_x, t_max_y)
+            yield cx, cy, t_exit
+            if t_exit >= length:
+                return
+            if t_max_x < t_max_y:
+                t_max_x += t_delta_x
+                cx += step_x
+            else:
+                t_max_y += t_delta_y
+                cy += step_y
+
+    def raycast(self, origin, theta, max_range, exclude=None):
+        """Find the closest entity hit by a ray.
+
+        :param origin: start of the ray, an object with x and y attributes
+        :param theta: direction of the ray in radians
+        :param max_range: length of the ray
+        :param exclude: an entity that is ignored, usually the one the ray is cast from
+        :returns: (distance, entity) of the closest hit, or None if the ray doesn't hit any entity
+        """
+        if not self.cells:
+            return None
+        ux = math.cos(theta)
+        uy = math.sin(theta)
+        closest = None
+        tested = set()
+        for cx, cy, t_exit in self.traverse_ray(origin.x, origin.y, ux, uy, max_range):
+            for entity in self.cells.get((cx, cy), ()):
+                if entity is exclude or id(entity) in tested:
+                    continue
+                tested.add(id(entity))
+                t = ray_circle_intersection(origin.x, origin.y, ux, uy, entity.x, entity.y, entity.radius)
+                if t is not None and t <= max_range and (closest is None or t < closest[0]):
+                    closest = (t, entity)
+            # hits in cells further along the ray can't be closer than a hit within this cell
+            if closest is not None and closest[0] <= t_exit:
+                break
+        return closest
+
+    def get_overlapping_pairs(self):
+        """Returns a list of (a, b) pairs of entities whose circles overlap. Only entities that share
+        a grid cell are tested, so the cost grows with the number of entities, not the number of pairs"""
+        pairs = []
+        tested = set()
+        for entities in self.cells.values():
+            for i in range(len(entities)):
+                a = entities[i]
+                for j in range(i + 1, len(entities)):
+                    b = entities[j]
+                    # entities that overlap several cells would otherwise be tested more than once
+                    key = (id(a), id(b)) if id(a) < id(b) else (id(b), id(a))
+                    if key in tested:
+                        continue
+                    tested.add(key)
+                    distance_limit = a.radius + b.radius
+                    if (a.x - b.x)**2 + (a.y - b.y)**2 < distance_limit * distance_limit:
+                        pairs.append((a, b))
+        return pairs
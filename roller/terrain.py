@@ -0,0 +1,141 @@
+"""
+The terrain module implements editing the world raster during the game, e.g. digging, destroying
+ground, or moving platforms. Edits are written to the color channels of the world's layers, and only the
+edited region of the derived layers (see `roller.mapcache.LAYERS`) and of `world.surface` is recomputed.
+
+Other subsystems that keep their own data derived from the world raster (e.g acceleration
+structures) can register a callback with `register_derived_layer` to be told which region changed.
+"""
+
+import numpy as np
+import pygame
+
+from roller import mapcache
+from roller.config import g_config
+
+AIR = (int(g_config.ambient_temperature), 255, 0)
+"""The color erased terrain is replaced with. Ambient temperature in the HEATMAP channel, never scatters light"""
+
+g_derived_layers = []
+"""Callbacks `callback(world, rect)` that are called after a region of the world raster has been edited"""
+
+
+def register_derived_layer(callback):
+    """Register a callback that is called with (world, rect) whenever a rectangular region of the world raster is edited"""
+    g_derived_layers.append(callback)
+    return callback
+
+def clip_rect(world, rect):
+    """Returns the part of the rect that is inside the world, or None if there is no such part"""
+    rect = pygame.Rect(rect).clip(pygame.Rect((0, 0), world.layers.get_size()))
+    return rect if rect.width > 0 and rect.height > 0 else None
+
+def update_region(world, rect):
+    """Recompute the derived layers and the world surface in the rect, after its channels have been edited"""
+    rect = clip_rect(world, rect)
+    if rect is None:
+        return
+    window = (slice(rect.left, rect.right), slice(rect.top, rect.bottom))
+    channels = world.layers.channels[window]
+    for name, (dtype, derive) in mapcache.LAYERS.items():
+        getattr(world.layers, name)[window] = derive(channels).astype(dtype)
+
+    # paged worlds don't have a surface of the whole map
+    if world.surface is not None:
+        pygame.surfarray.blit_array(world.surface.subsurface(rect), np.asarray(channels))
+
+    for callback in g_derived_layers:
+        callback(world, rect)
+
+def stamp(world, x, y, channels, mask=None):
+    """Draw an array of colors onto the world raster with its top-left corner at (x, y).
+
+    :param channels: array of shape (width, height, 3) with the colors to draw
+    :param mask: optional boolean array of shape (width, height). Only pixels where the mask is True are drawn
+    """
+    rect = clip_rect(world, (x, y, channels.shape[0], channels.shape[1]))
+    if rect is None:
+        return
+    # the part of the stamped array that is inside the world
+    source = (slice(rect.left - x, rect.right - x), slice(rect.top - y, rect.bottom - y))
+    window = (slice(rect.left, rect.right), slice(rect.top, rect.bottom))
+    if mask is None:
+        world.layers.channels[window] = channels[source]
+    else:
+        edited = world.layers.channels[window]
+        edited[mask[source]] = channels[source][mask[source]]
+        world.layers.channels[window] = edited
+    update_region(world, rect)
+
+def fill(world, rect, color):
+    """Fill a rectangular region of the world raster with a color"""
+    rect = pygame.Rect(rect)
+    channels = np.empty((rect.width, rect.height, 3), dtype=np.uint8)
+    channels[:, :] = color
+    stamp(world, rect.x, rect.y, channels)
+
+def erase(world, rect):
+    """Replace a rectangular region of the world raster with air"""
+    fill(world, rect, AIR)
+
+def erase_circle(world, x, y, radius):
+    """Replace the pixels within radius from (x, y) with air, e.g. to dig a hole"""
+    r = int(radius)
+    dx, dy = np.meshgrid(np.arange(-r, r + 1), np.arange(-r, r + 1), indexing="ij")
+    channels = np.empty(dx.shape + (3,), dtype=np.uint8)
+    channels[:, :] = AIR
+    stamp(world, int(x) - r, int(y) - r, channels, mask=dx**2 + dy**2 <= radius**2)
+
+
+class TerrainSprite:
+    """A rectangular piece of terrain that can be moved around in the world raster, e.g. a moving platform.
+    The terrain that the sprite covers is restored when the sprite moves away. Pixels of the sprite that
+    were edited while it was placed (e.g. dug away) keep the edit.
+
+    :param channels: array of shape (width, height, 3) with the colors of the sprite
+    """
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.position = None
+        """The (x, y) the sprite was last placed at, or None if it's not placed"""
+        self.rect = None
+        """The part of the world the sprite currently occupies"""
+        self.background = None
+        """The channels of the world that the sprite covers"""
+
+    @classmethod
+    def filled(cls, width, height, color=(0, 0, 0)):
+        """Create a sprite of a single color. The default color is ground"""
+        channels = np.empty((int(width), int(height), 3), dtype=np.uint8)
+        channels[:, :] = color
+        return cls(channels)
+
+    def remove(self, world):
+        """Restore the terrain the sprite was covering, where the sprite is still drawn"""
+        if self.rect is not None:
+            window = (slice(self.rect.left, self.rect.right), slice(self.rect.top, self.rect.bottom))
+            x, y = self.position
+            source = self.channels[self.rect.left - x:self.rect.right - x, self.rect.top - y:self.rect.bottom - y]
+            footprint = (world.layers.channels[window] == source).all(axis=2)
+            stamp(world, self.rect.x, self.rect.y, self.background, mask=footprint)
+        self.position = None
+        self.rect = None
+
+    def place(self, world, x, y):
+        """Move the sprite so that its top-left corner is at (x, y). Only the regions the sprite
+        moved from and to are updated, and nothing is done if the sprite didn't move a whole pixel"""
+        position = (int(x), int(y))
+        if position == self.position:
+            return
+        self.remove(world)
+        self.position = position
+        rect = pygame.Rect(position, self.channels.shape[:2])
+        clipped = clip_rect(world, rect)
+        if clipped is None:
+            return
+        # only the part of the sprite inside the world is placed
+        self.background = np.array(world.layers.channels[clipped.left:clipped.right, clipped.top:clipped.bottom])
+        self.rect = clipped
+        source = self.channels[clipped.left - rect.left:clipped.right - rect.left, clipped.top - rect.top:clipped.bottom - rect.top]
+        stamp(world, clipped.x, clipped.y, source)
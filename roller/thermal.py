@@ -0,0 +1,129 @@
+"""
+The thermal module simulates the temperature of all sensors in the game at once.
+
+Once sensors are registered with a `ThermalModel`, their thermal state is stored in arrays shared by all
+sensors, and `ThermalModel.step` advances every sensor with one vectorized calculation per tick. The heat a
+sensor gains and loses is calculated by `get_heat_flow` for the model and for `Sensor.update_temperature`
+alike. The ambient temperatures for all bots are read from the
+world's temperature layer and heat field with one indexed read, and the heat the sensors lose is
+deposited back into the heat field (see roller.heat).
+
+Sensor attributes that are stored in the arrays (`temperature`, `is_enabled`) are `ThermalState`
+descriptors, so they can be read and written like normal attributes.
+"""
+
+import numpy as np
+
+
+def get_heat_flow(temperature, ambient_temperature, power_draw, is_enabled, heat_dissipation_rate, dt):
+    """Returns (heat_generated, heat_loss) of sensors during dt seconds. The arguments can be the values of one
+    sensor or arrays of the values of many sensors"""
+    heat_generated = power_draw * dt * is_enabled
+    heat_loss = heat_dissipation_rate * (temperature - ambient_temperature) * dt
+    return heat_generated, heat_loss
+
+
+class ThermalState:
+    """Descriptor for a Sensor attribute that is stored in the arrays of a ThermalModel once the
+    sensor has been registered with one. Before that, the value is stored in the sensor itself.
+
+    :param default: the default value of the attribute
+    """
+
+    def __init__(self, default):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, sensor, owner=None):
+        if sensor is None:
+            # dataclasses read the default value of the field from the class
+            return self.default
+        model = sensor.__dict__.get("thermal_model")
+        if model is None:
+            return sensor.__dict__.get(self.name, self.default)
+        return model.state[self.name][sensor.__dict__["thermal_index"]].item()
+
+    def __set__(self, sensor, value):
+        model = sensor.__dict__.get("thermal_model")
+        if model is None:
+            sensor.__dict__[self.name] = value
+        else:
+            model.state[self.name][sensor.__dict__["thermal_index"]] = value
+
+
+class ThermalModel:
+
+    def __init__(self):
+        self.sensors = []
+        self.owners = np.zeros(0, dtype=np.intp)
+        """Index of the bot (in the list given to `register`) each sensor is mounted on"""
+        self.state = {}
+        """Arrays of the thermal state, keyed by the Sensor attribute name. Element i belongs to self.sensors[i]"""
+
+    def register(self, entities):
+        """Move the thermal state of all the sensors of the entities into arrays.
+        The order of the entities must be the same when calling `step`. Sensors added to the
+        entities afterwards are not simulated until `register` is called again."""
+        self.sensors = []
+        owners = []
+        for entity_index, entity in enumerate(entities):
+            for sensor in entity.sensors:
+                # release sensors registered with an other model, so their current values are read below
+                sensor.__dict__.pop("thermal_model", None)
+                self.sensors.append(sensor)
+                owners.append(entity_index)
+        self.owners = np.array(owners, dtype=np.intp)
+
+        self.state = dict(
+            temperature = np.array([sensor.temperature for sensor in self.sensors], dtype=np.float64),
+            is_enabled = np.array([sensor.is_enabled for sensor in self.sensors], dtype=np.bool_),
+        )
+        # these are constant for each sensor, so they are not descriptors
+        self.power_draw = np.array([sensor.power_draw for sensor in self.sensors], dtype=np.float64)
+        self.heat_dissipation_rate = np.array([sensor.heat_dissipation_rate for sensor in self.sensors], dtype=np.float64)
+        self.thermal_mass = np.array([sensor.mass * sensor.heat_capacity for sensor in self.sensors], dtype=np.float64)
+
+        for index, sensor in enumerate(self.sensors):
+            sensor.__dict__["thermal_index"] = index
+            sensor.__dict__["thermal_model"] = self
+
+    def get_positions(self, entities, world):
+        """Returns the integer pixel positions (xs, ys) of the entities, clipped to the world"""
+        width, height = world.layers.get_size()
+        xs = np.fromiter((entity.x for entity in entities), dtype=np.float64, count=len(entities)).astype(np.intp)
+        ys = np.fromiter((entity.y for entity in entities), dtype=np.float64, count=len(entities)).astype(np.intp)
+        return np.clip(xs, 0, width - 1), np.clip(ys, 0, height - 1)
+
+    def get_ambient_temperatures(self, world, xs, ys):
+        """Returns the ambient temperature at the positions, read from the world in one go"""
+        temperature = world.layers.temperature[xs, ys].astype(np.float64)
+        if world.heat is not None:
+            temperature += world.heat.get_excess(xs, ys)
+        return temperature
+
+    def step(self, entities, world, dt):
+        """Advance the temperature of all registered sensors by one tick.
+
+        :param entities: the same list of entities that was registered
+        :param dt: the length of the tick in seconds. Each entity's tick is multiplied by its `lod_steps`
+        """
+        if len(self.sensors) == 0:
+            return
+        xs, ys = self.get_positions(entities, world)
+        ambient_temperature = self.get_ambient_temperatures(world, xs, ys)[self.owners]
+        steps = np.fromiter((entity.lod_steps for entity in entities), dtype=np.float64, count=len(entities))
+        sensor_dt = steps[self.owners] * dt
+
+        temperature = self.state["temperature"]
+        heat_generated, heat_loss = get_heat_flow(temperature, ambient_temperature, self.power_draw,
+                                                  self.state["is_enabled"], self.heat_dissipation_rate, sensor_dt)
+        temperature += (heat_generated - heat_loss) / self.thermal_mass
+
+        # the heat lost by the sensors warms up the environment around their bots
+        if world.heat is not None:
+            world.heat.deposit(xs, ys, np.bincount(self.owners, weights=heat_loss, minlength=len(entities)))
+
+
+g_thermal = ThermalModel()
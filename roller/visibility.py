@@ -0,0 +1,143 @@
+"""
+The visibility module lets wide-field sensors find the returns of many laser rays from one origin at once.
+
+Tracing every ray of a sensor pixel by pixel rescans the pixels near the origin that its neighbouring rays
+already covered. A `VisibilityPolygon` instead sweeps once over the cells of a coarse opacity grid around
+the origin, and records for each direction (in `g_config.visibility_angular_bins` angular bins) the
+distance to the closest cell that contains any pixel that can scatter light. The returns of any number
+of rays are then sampled from it: each ray walks the same pixels as calculations.get_lidar_return, but
+only the pixels from that distance on are read, and only those that can scatter light are drawn against.
+The returns are as likely as those of tracing each ray.
+"""
+
+import math
+import numpy as np
+
+from roller import material
+from roller import terrain
+from roller.calculations import get_line_endpoint, get_line_pixel_batches
+from roller.collision import OccupancyGrid
+from roller.config import g_config
+from roller.datatypes import Point, Line
+from roller.raycache import g_ray_cache
+
+
+RAY_MARGIN = 2
+"""How many pixels the pixels a ray walks can be off from its exact direction"""
+
+
+def create_opacity_grid(layers):
+    """Returns a coarse grid of the cells that contain pixels that can scatter light"""
+    return OccupancyGrid(layers, layer="scatter")
+
+
+class VisibilityPolygon:
+    """The distance to the first opaque cell in every direction around an origin, up to a maximum range.
+
+    :param origin: an object with x and y attributes, e.g. a bot
+    :param max_range: the range of the sensor, cells further away are ignored
+    :param grid: the opacity grid, see `create_opacity_grid`
+    :param bins: the number of angular bins, g_config.visibility_angular_bins by default
+    """
+
+    def __init__(self, origin, max_range, grid, bins=None):
+        self.origin = origin
+        self.max_range = max_range
+        self.bins = g_config.visibility_angular_bins if bins is None else bins
+        self.bin_width = 2 * math.pi / self.bins
+        self.depth = np.full(self.bins, np.inf)
+        """Lower bound of the distance to a pixel that can scatter light along the rays in each angular bin"""
+
+        size = grid.cell_size
+        ox, oy = origin.x, origin.y
+        width, height = grid.cells.shape
+        # the opaque cells in the bounding box of the sensor's range
+        cx0, cy0 = max(math.floor((ox - max_range) / size), 0), max(math.floor((oy - max_range) / size), 0)
+        cx1, cy1 = min(math.floor((ox + max_range) / size) + 1, width), min(math.floor((oy + max_range) / size) + 1, height)
+        if cx0 >= cx1 or cy0 >= cy1:
+            return
+        cxs, cys = np.nonzero(grid.get_cells(cx0, cy0, cx1, cy1))
+
+        # the edges of the cells relative to the origin. They are widened by the margin, so that the cells
+        # of the pixels a ray walks are counted in the ray's direction, even where it passes a cell's corner
+        left = (cxs + cx0) * size - ox - RAY_MARGIN
+        top = (cys + cy0) * size - oy - RAY_MARGIN
+        size += 2 * RAY_MARGIN
+        right = left + size
+        bottom = top + size
+        # distance from the origin to the closest point of each cell
+        near = np.hypot(np.maximum(np.maximum(left, -right), 0), np.maximum(np.maximum(top, -bottom), 0))
+        in_range = near < max_range
+        left, top, right, bottom, near = left[in_range], top[in_range], right[in_range], bottom[in_range], near[in_range]
+        if len(near) == 0:
+            return
+        if near.min() == 0:
+            # the origin is inside an opaque cell
+            self.depth[:] = 0
+            return
+
+        # the angular extent of each cell is spanned by its corners. The angles are taken relative to
+        # the direction of the cell's center, so cells in the direction of the angle wrap-around work
+        center = np.arctan2(top + size / 2, left + size / 2)
+        corners = np.arctan2(np.stack([top, top, bottom, bottom]), np.stack([left, right, left, right]))
+        delta = (corners - center + math.pi) % (2 * math.pi) - math.pi
+        first_bin = np.floor((center + delta.min(axis=0)) / self.bin_width).astype(np.intp)
+        last_bin = np.floor((center + delta.max(axis=0)) / self.bin_width).astype(np.intp)
+
+        # every bin each cell covers gets the cell's distance, if it's the closest cell in that bin so far
+        counts = last_bin - first_bin + 1
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        np.minimum.at(self.depth, (np.repeat(first_bin, counts) + offsets) % self.bins, np.repeat(near, counts))
+
+    def get_distance(self, theta):
+        """Returns the distance in direction theta before which no pixel can scatter light (inf if there is none in range)"""
+        return self.depth[int((theta % (2 * math.pi)) / self.bin_width) % self.bins]
+
+    def get_lidar_return(self, theta, world) -> Point:
+        """The same as calculations.get_lidar_return from the polygon's origin, but only the pixels of the ray
+        from the first opaque cell in its direction on are read. Rays fired by a bot pass through the terrain
+        the bot carries (see Bot.own_terrain), like those of the ray cache"""
+        origin = self.origin
+        max_range = self.max_range
+        bot_hit = world.entity_index.raycast(origin, theta, max_range, exclude=origin)
+        if bot_hit is not None:
+            max_range = bot_hit[0]
+        end_point = get_line_endpoint(origin, max_range, theta)
+        start_distance = self.get_distance(theta)
+        if start_distance < max_range:
+            layer = world.layers.scatter
+            width, height = layer.shape[:2]
+            own_terrain = getattr(origin, "own_terrain", None)
+            for xs, ys in get_line_pixel_batches(Line(origin, end_point), width, height):
+                xs, ys = np.array(xs), np.array(ys)
+                # the pixels before the first opaque cell don't scatter light
+                read = np.hypot(xs - origin.x, ys - origin.y) >= start_distance
+                if own_terrain is not None:
+                    read &= (xs < own_terrain.left) | (xs >= own_terrain.right) | (ys < own_terrain.top) | (ys >= own_terrain.bottom)
+                if not read.any():
+                    continue
+                xs, ys = xs[read], ys[read]
+                probabilities = layer[xs, ys]
+                for index in np.flatnonzero(probabilities):
+                    if material.is_scattering(probabilities[index]):
+                        return Point(int(xs[index]), int(ys[index]))
+        if bot_hit is not None:
+            return Point(int(end_point.x), int(end_point.y))
+        return None
+
+
+def get_lidar_returns(origin, max_range, thetas, world):
+    """Returns the lidar return (a Point or None) of a ray in each direction of `thetas`.
+    Sensors with at least g_config.visibility_min_rays rays use a VisibilityPolygon, others trace each ray
+    using the ray cache"""
+    if len(thetas) < g_config.visibility_min_rays or world.opacity is None:
+        return [g_ray_cache.get_lidar_return(origin, max_range, theta, world) for theta in thetas]
+    polygon = VisibilityPolygon(origin, max_range, world.opacity)
+    return [polygon.get_lidar_return(theta, world) for theta in thetas]
+
+
+@terrain.register_derived_layer
+def update_opacity(world, rect):
+    """Keeps world.opacity up to date when the terrain is edited"""
+    if world.opacity is not None:
+        world.opacity.update_region(world.layers, rect.left, rect.top, rect.right, rect.bottom)
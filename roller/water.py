@@ -0,0 +1,318 @@
+"""
+The water module simulates water flowing through the world as a cellular automaton.
+
+The water is initialised from the water pixels of the map (`colors.is_water_color`, precompiled into the
+`water` layer by roller.mapcache). Each tick water pixels fall into empty pixels below them, slide
+diagonally down off edges, and flow sideways on top of what they rest on. Ground (and the outside of the map) is solid.
+Water flowing sideways keeps its direction until it is blocked by ground or by water flowing towards it.
+Water queued up behind water flowing in the same direction waits, so piles of water flow off in streams
+and level out into pools.
+
+Water that moved is drawn into the world raster (see roller.terrain), so the sensors see where the water
+is now, and not where it was in the map.
+
+The water is stored in square chunks, and only chunks where water flowed recently (or next to them)
+are simulated. Settled water costs nothing, and chunks without water are not stored at all.
+"""
+
+import numpy as np
+
+from roller import terrain
+from roller.config import g_config
+
+DRY = 0
+FLOWING_LEFT = 1
+FLOWING_RIGHT = 2
+"""The values of the pixels of the water chunks"""
+
+WATER = (0, 0, 255)
+"""The color water that flowed into a pixel is drawn into the world raster with (see `colors.is_water_color`).
+Pixels the water flowed out of are replaced with terrain.AIR"""
+
+
+class WaterSimulation:
+    """:param layers: the layers of the world (a CompiledMap or PagedMap)
+    :param chunk_size: width and height in pixels of the chunks the water is stored and simulated in"""
+
+    def __init__(self, layers, chunk_size=None):
+        self.layers = layers
+        self.chunk_size = g_config.water_chunk_size if chunk_size is None else chunk_size
+        self.size = layers.get_size()
+        self.chunks = {}
+        """Arrays of DRY, FLOWING_LEFT or FLOWING_RIGHT pixels, keyed by the (cx, cy) of the chunk. Chunks without water are not stored"""
+        self.active = {}
+        """(fall speed in pixels per tick, ticks without flowing) of the active chunks, keyed by the (cx, cy) of the chunk"""
+        self.tick = 0
+        self.is_drawing = False
+        """True while the simulation draws its water into the world raster, which is not an edit it has to react to"""
+
+        size = self.chunk_size
+        width, height = self.size
+        # every other column of the initial water flows to the right
+        directions = np.where(np.arange(size) % 2, FLOWING_RIGHT, FLOWING_LEFT).astype(np.uint8)[:, np.newaxis]
+        # the water layer is read in vertical strips, so a paged world is not read into memory all at once
+        for x0 in range(0, width, size):
+            strip = layers.water[x0:min(x0 + size, width), :]
+            for y0 in range(0, height, size):
+                water = strip[:, y0:y0 + size]
+                if water.any():
+                    chunk = np.zeros((size, size), dtype=np.uint8)
+                    chunk[:water.shape[0], :water.shape[1]] = np.where(water, directions[:water.shape[0]], DRY)
+                    self.chunks[(x0 // size, y0 // size)] = chunk
+                    self.active[(x0 // size, y0 // size)] = (1.0, 0)
+
+    def read_water(self, x0, y0, x1, y1):
+        """Returns an array of the water pixels (DRY, FLOWING_LEFT or FLOWING_RIGHT) in (x0, y0)...(x1, y1)
+        (end exclusive). The region may extend outside the map, where there is never water"""
+        size = self.chunk_size
+        water = np.zeros((x1 - x0, y1 - y0), dtype=np.uint8)
+        for cx in range(x0 // size, (x1 - 1) // size + 1):
+            for cy in range(y0 // size, (y1 - 1) // size + 1):
+                chunk = self.chunks.get((cx, cy))
+                if chunk is None:
+                    continue
+                # the overlap of the chunk and the window, in world coordinates
+                ox0, oy0 = max(cx * size, x0), max(cy * size, y0)
+                ox1, oy1 = min((cx + 1) * size, x1), min((cy + 1) * size, y1)
+                water[ox0 - x0:ox1 - x0, oy0 - y0:oy1 - y0] = chunk[ox0 - cx*size:ox1 - cx*size, oy0 - cy*size:oy1 - cy*size]
+        return water
+
+    def write_water(self, x0, y0, water):
+        """Write an array of water pixels with its top-left corner at (x0, y0).
+
+        :returns: the (cx, cy) of the chunks where water appeared or disappeared
+        """
+        size = self.chunk_size
+        x1, y1 = x0 + water.shape[0], y0 + water.shape[1]
+        changed = []
+        for cx in range(x0 // size, (x1 - 1) // size + 1):
+            for cy in range(y0 // size, (y1 - 1) // size + 1):
+                ox0, oy0 = max(cx * size, x0), max(cy * size, y0)
+                ox1, oy1 = min((cx + 1) * size, x1), min((cy + 1) * size, y1)
+                values = water[ox0 - x0:ox1 - x0, oy0 - y0:oy1 - y0]
+                chunk = self.chunks.get((cx, cy))
+                window = (slice(ox0 - cx*size, ox1 - cx*size), slice(oy0 - cy*size, oy1 - cy*size))
+                if chunk is None:
+                    if not values.any():
+                        continue
+                    chunk = self.chunks[(cx, cy)] = np.zeros((size, size), dtype=np.uint8)
+                # changes of only the direction of the water don't count as changes
+                if not np.array_equal(chunk[window] != DRY, values != DRY):
+                    changed.append((cx, cy))
+                chunk[window] = values
+                if not chunk.any():
+                    del self.chunks[(cx, cy)]
+        return changed
+
+    def read_solid(self, x0, y0, x1, y1):
+        """Returns a boolean array of the pixels water can't flow into in (x0, y0)...(x1, y1).
+        Pixels outside the map are solid"""
+        width, height = self.size
+        solid = np.ones((x1 - x0, y1 - y0), dtype=np.bool_)
+        cx0, cy0 = max(x0, 0), max(y0, 0)
+        cx1, cy1 = min(x1, width), min(y1, height)
+        if cx0 < cx1 and cy0 < cy1:
+            solid[cx0 - x0:cx1 - x0, cy0 - y0:cy1 - y0] = self.layers.ground[cx0:cx1, cy0:cy1]
+        return solid
+
+    def step_chunk(self, cx, cy, fall_passes):
+        """Move the water of one chunk. Water can move one pixel out of the chunk into the neighbouring chunks.
+
+        :returns: the number of water pixels that fell or slid down, and the chunks where water appeared or disappeared
+        """
+        size = self.chunk_size
+        # the chunk with a border of one pixel, so water can flow out of it
+        x0, y0 = cx * size - 1, cy * size - 1
+        x1, y1 = x0 + size + 2, y0 + size + 2
+        pixels = self.read_water(x0, y0, x1, y1)
+        water = pixels != DRY
+        rightward = pixels == FLOWING_RIGHT
+        solid = self.read_solid(x0, y0, x1, y1)
+
+        # views of the chunk's pixels, and of their neighbours in each direction
+        inner = (slice(1, -1), slice(1, -1))
+        below = (slice(1, -1), slice(2, None))
+        left, down_left = (slice(0, -2), slice(1, -1)), (slice(0, -2), slice(2, None))
+        right, down_right = (slice(2, None), slice(1, -1)), (slice(2, None), slice(2, None))
+
+        def move(moving, destination):
+            """Move the water pixels of the chunk where `moving` is True to the neighbour in `destination`"""
+            rightward[destination] = np.where(moving, rightward[inner], rightward[destination])
+            water[inner] &= ~moving
+            water[destination] |= moving
+            return int(np.count_nonzero(moving))
+
+        flowing = 0
+        for _ in range(fall_passes):
+            falling = water[inner] & ~(water[below] | solid[below])
+            if not falling.any():
+                break
+            flowing += move(falling, below)
+
+        # slide diagonally down off edges, without squeezing through corners.
+        # Pixels try the direction they are flowing in first, and then the other direction
+        for own_direction_only in (True, False):
+            for to_right, side, diagonal in ((False, left, down_left), (True, right, down_right)):
+                empty = ~(water | solid)
+                sliding = water[inner] & ~empty[below] & empty[side] & empty[diagonal]
+                if own_direction_only:
+                    sliding &= rightward[inner] == to_right
+                flowing += move(sliding, diagonal)
+
+        # water resting on something flows sideways in its direction. Flowing sideways doesn't count as
+        # flowing for settling the chunk, since water on the surface of a pool could go back and forth forever
+        spread = 0
+        for _ in range(g_config.water_spread_passes):
+            moved = 0
+            for to_right, side in ((False, left), (True, right)):
+                empty = ~(water | solid)
+                spreading = water[inner] & ~empty[below] & empty[side] & (rightward[inner] == to_right)
+                moved += move(spreading, side)
+            if moved == 0:
+                break
+            spread += moved
+        # water that is blocked by ground, or by water flowing towards it, turns around. Water queued behind
+        # water flowing in the same direction keeps its direction, so a pile flows off in one stream
+        empty = ~(water | solid)
+        leftward = water & ~rightward
+        blocked = water[inner] & ~empty[below] & np.where(
+            rightward[inner], solid[right] | leftward[right], solid[left] | (water[left] & rightward[left]))
+        rightward[inner] ^= blocked
+
+        if flowing == 0 and spread == 0 and not blocked.any():
+            return 0, []
+        self.wake_unsettled_neighbours(x0, y0, water, solid)
+        pixels = np.where(water, np.where(rightward, FLOWING_RIGHT, FLOWING_LEFT), DRY).astype(np.uint8)
+        return flowing, self.write_water(x0, y0, pixels)
+
+    def get_unsettled(self, water, solid):
+        """Returns a boolean array of the water pixels of a window that can fall or slide down. The bottom row
+        of the window can't tell if it can fall, and is left out of the array"""
+        empty = ~(water | solid)
+        resting = ~empty[:, 1:]
+        unsettled = empty[:, 1:].copy()
+        unsettled[1:] |= resting[1:] & empty[:-1, :-1] & empty[:-1, 1:]
+        unsettled[:-1] |= resting[:-1] & empty[1:, :-1] & empty[1:, 1:]
+        return unsettled & water[:, :-1]
+
+    def is_settled(self, cx, cy):
+        """True if none of the water of the chunk can fall or slide down"""
+        size = self.chunk_size
+        x0, y0 = cx * size - 1, cy * size - 1
+        x1, y1 = x0 + size + 2, y0 + size + 2
+        water = self.read_water(x0, y0, x1, y1) != DRY
+        return not self.get_unsettled(water, self.read_solid(x0, y0, x1, y1))[1:-1, 1:].any()
+
+    def wake_unsettled_neighbours(self, x0, y0, water, solid):
+        """Activate the settled neighbouring chunks that have water on the border of a chunk's window
+        (with its top-left corner at (x0, y0)) that can now fall or slide down, e.g. into the room left by the
+        water of a pool next to them that drained away"""
+        unsettled = self.get_unsettled(water, solid)
+        unsettled[1:-1, 1:] = False
+        size = self.chunk_size
+        xs, ys = np.nonzero(unsettled)
+        for key in set(zip(((xs + x0) // size).tolist(), ((ys + y0) // size).tolist())):
+            if key in self.chunks:
+                self.active.setdefault(key, (1.0, 0))
+
+    def step(self):
+        """Advance the water by one tick.
+
+        :returns: the (cx, cy) of the chunks where water appeared or disappeared
+        """
+        self.tick += 1
+        changed = set()
+        # chunks are stepped one after the other, so water moved by one chunk into its neighbours is seen by them
+        for key, (fall_speed, idle_ticks) in list(self.active.items()):
+            if key not in self.active:
+                continue
+            # falling water accelerates, the fall speed is shared by all the water in a chunk
+            fall_speed = min(fall_speed + g_config.gravity_acceleration, g_config.water_max_fall_speed)
+            flowing, chunks = self.step_chunk(*key, int(fall_speed))
+            changed.update(chunks)
+            # water that flowed into a settled chunk may have to flow on in it. Water moving sideways on the
+            # surface of a pool can go back and forth between settled chunks, and doesn't wake them
+            for neighbour in chunks:
+                if neighbour in self.chunks and neighbour not in self.active and not self.is_settled(*neighbour):
+                    self.active[neighbour] = (1.0, 0)
+            if flowing == 0:
+                # the chunk is settled once its water has only moved sideways for a while
+                if idle_ticks >= g_config.water_settle_ticks:
+                    del self.active[key]
+                else:
+                    self.active[key] = (1.0, idle_ticks + 1)
+                continue
+            self.active[key] = (fall_speed, 0)
+            # flowing water can make room for, or flow into, the water in the neighbouring chunks
+            cx, cy = key
+            for neighbour in [(cx + i, cy + j) for i in (-1, 0, 1) for j in (-1, 0, 1)]:
+                if neighbour in self.chunks and neighbour not in self.active:
+                    self.active[neighbour] = (fall_speed if neighbour[1] > cy else 1.0, 0)
+        return changed
+
+    def update(self, world):
+        """Advance the water by one tick, and draw the chunks where water appeared or disappeared into the
+        world raster. The bots near the redrawn water are woken up by the terrain edit"""
+        if not self.active:
+            return
+        self.draw(world, self.step())
+
+    def draw(self, world, chunks):
+        """Draw the water of the chunks into the world raster"""
+        size = self.chunk_size
+        self.is_drawing = True
+        try:
+            for cx, cy in chunks:
+                rect = terrain.clip_rect(world, (cx * size, cy * size, size, size))
+                if rect is None:
+                    continue
+                window = (slice(rect.left, rect.right), slice(rect.top, rect.bottom))
+                water = self.read_water(rect.left, rect.top, rect.right, rect.bottom) != DRY
+                was_water = world.layers.water[window]
+                if np.array_equal(water, was_water):
+                    continue
+                channels = np.array(world.layers.channels[window])
+                channels[water & ~was_water] = WATER
+                channels[was_water & ~water] = terrain.AIR
+                terrain.stamp(world, rect.left, rect.top, channels)
+        finally:
+            self.is_drawing = False
+
+    def remove_solid(self, rect):
+        """Remove water from pixels that have become ground in the rect, and activate the chunks around it,
+        since the water may be able to flow now"""
+        size = self.chunk_size
+        x0, y0 = max(rect.left - 1, 0), max(rect.top - 1, 0)
+        x1, y1 = min(rect.right + 1, self.size[0]), min(rect.bottom + 1, self.size[1])
+        water = self.read_water(x0, y0, x1, y1)
+        if water.any():
+            water[self.read_solid(x0, y0, x1, y1)] = DRY
+            self.write_water(x0, y0, water)
+        for cx in range(x0 // size, (x1 - 1) // size + 1):
+            for cy in range(y0 // size, (y1 - 1) // size + 1):
+                if (cx, cy) in self.chunks:
+                    self.active.setdefault((cx, cy), (1.0, 0))
+
+    def get_submerged_fraction(self, x0, y0, mask):
+        """Returns the fraction of the True pixels of `mask` that are under water, when the mask's top-left
+        corner is at (x0, y0)"""
+        x1, y1 = x0 + mask.shape[0], y0 + mask.shape[1]
+        size = self.chunk_size
+        if all((cx, cy) not in self.chunks
+               for cx in range(x0 // size, (x1 - 1) // size + 1)
+               for cy in range(y0 // size, (y1 - 1) // size + 1)):
+            return 0.0
+        return np.count_nonzero((self.read_water(x0, y0, x1, y1) != DRY) & mask) / np.count_nonzero(mask)
+
+    def get_housekeeping(self):
+        return {
+            "chunks": len(self.chunks),
+            "active": len(self.active),
+        }
+
+
+@terrain.register_derived_layer
+def update_water(world, rect):
+    """Terrain edits can cover water with ground, or open up new paths for the water"""
+    if world.water is not None and not world.water.is_drawing:
+        world.water.remove_solid(rect)
@@ -0,0 +1,123 @@
+"""
+The wavefront module propagates a sound wave from a point through the air of the world, for the Sonar sensor.
+
+The wave spreads over the cells of the coarse ground occupancy grid (see roller.collision) around its
+origin, one ring of cells at a time, like a breadth first search. Rings alternately grow into the 4 and
+the 8 neighbours of the front, so the front is an octagon that approximates a circle. The wave goes
+around corners, but not through ground. Whenever the front reaches ground cells they send back an echo,
+which takes as long to return as the wave took to get there.
+
+Only the cells within the range of the sonar are simulated, and a `Wavefront` is advanced a few rings at
+a time, so the cost per tick is bounded by the range, not the size of the map.
+"""
+
+import math
+
+import numpy as np
+
+from roller.config import g_config
+
+
+class Wavefront:
+    """The arrival times of a sound wave sent out from (x, y), up to a maximum range.
+
+    :param x: x of the origin of the wave in world coordinates
+    :param y: y of the origin of the wave in world coordinates
+    :param max_range: the wave is not propagated further than this from the origin (pixels)
+    :param grid: the ground OccupancyGrid of the world (world.occupancy)
+    """
+
+    def __init__(self, x, y, max_range, grid):
+        self.x = x
+        self.y = y
+        self.cell_size = size = grid.cell_size
+        width, height = grid.cells.shape
+        # the window of the grid within range of the origin
+        cx0, cy0 = max(math.floor((x - max_range) / size), 0), max(math.floor((y - max_range) / size), 0)
+        cx1, cy1 = min(math.floor((x + max_range) / size) + 1, width), min(math.floor((y + max_range) / size) + 1, height)
+        self.cx0, self.cy0 = cx0, cy0
+        shape = (max(cx1 - cx0, 0) + 2, max(cy1 - cy0, 0) + 2)
+
+        # the window is stored with a border of one cell, that the wave never enters
+        self.ground = np.zeros(shape, dtype=np.bool_)
+        self.ground[1:-1, 1:-1] = grid.get_cells(cx0, cy0, cx1, cy1)
+        cxs = np.arange(cx0 - 1, cx0 + shape[0] - 1)[:, np.newaxis]
+        cys = np.arange(cy0 - 1, cy0 + shape[1] - 1)[np.newaxis, :]
+        in_range = np.hypot((cxs + 0.5) * size - x, (cys + 0.5) * size - y) <= max_range
+        in_range[[0, -1], :] = False
+        in_range[:, [0, -1]] = False
+        self.ground &= in_range
+        self.air = in_range & ~self.ground
+        self.arrival = np.full(shape, -1, dtype=np.int32)
+        """The ring in which the wave reached each cell of the window, -1 if it hasn't (yet)"""
+        self.echoed = np.zeros(shape, dtype=np.bool_)
+        """Ground cells that have already sent back an echo"""
+        self.front = np.zeros(shape, dtype=np.bool_)
+        self.ring = 0
+        self.is_done = False
+        """Whether the wave has died out, i.e. it reached all the air within range it can reach"""
+
+        origin = (int(x // size) - cx0 + 1, int(y // size) - cy0 + 1)
+        if 0 < origin[0] < shape[0] - 1 and 0 < origin[1] < shape[1] - 1:
+            # the wave starts from the origin even if it is inside a cell with ground in it
+            self.front[origin] = True
+            self.arrival[origin] = 0
+            self.air[origin] = True
+            self.ground[origin] = False
+        else:
+            self.is_done = True
+
+    def grow(self):
+        """Returns the cells next to the front, including the front"""
+        front = self.front
+        grown = front.copy()
+        grown[1:, :] |= front[:-1, :]
+        grown[:-1, :] |= front[1:, :]
+        grown[:, 1:] |= front[:, :-1]
+        grown[:, :-1] |= front[:, 1:]
+        if self.ring % 2 == 0:
+            # every other ring also grows diagonally
+            grown[1:, 1:] |= front[:-1, :-1]
+            grown[:-1, :-1] |= front[1:, 1:]
+            grown[1:, :-1] |= front[:-1, 1:]
+            grown[:-1, 1:] |= front[1:, :-1]
+        return grown
+
+    def advance(self, rings):
+        """Propagate the wave by a number of rings.
+
+        :returns: arrays (xs, ys, times, thetas) of the echoes from the ground cells the wave reached: the
+            world position of the cell's center, the time in seconds from the sending of the wave until the
+            echo returns, and the direction of the cell from the origin
+        """
+        hit_x, hit_y, hit_ring = [], [], []
+        for _ in range(rings):
+            if self.is_done:
+                break
+            self.ring += 1
+            grown = self.grow()
+            hits = grown & self.ground & ~self.echoed
+            if hits.any():
+                self.echoed |= hits
+                xs, ys = np.nonzero(hits)
+                hit_x.append(xs)
+                hit_y.append(ys)
+                hit_ring.append(np.full(len(xs), self.ring))
+            self.front = grown & self.air & (self.arrival < 0)
+            self.arrival[self.front] = self.ring
+            self.is_done = not self.front.any()
+
+        if not hit_x:
+            empty = np.zeros(0)
+            return empty, empty, empty, empty
+        size = self.cell_size
+        xs = (np.concatenate(hit_x) + self.cx0 - 1 + 0.5) * size
+        ys = (np.concatenate(hit_y) + self.cy0 - 1 + 0.5) * size
+        # the echo travels back as far as the wave travelled
+        times = 2 * np.concatenate(hit_ring) * size / g_config.sonar_speed_of_sound
+        thetas = np.arctan2(ys - self.y, xs - self.x)
+        return xs, ys, times, thetas
+
+    def get_radius(self):
+        """Returns the distance the wave has travelled, in pixels"""
+        return self.ring * self.cell_size
@@ -0,0 +1,44 @@
+"""Shared helpers for the tests. The tests run headless, on small worlds built from numpy arrays
+instead of map files"""
+
+import os
+import types
+
+import numpy as np
+import pygame
+import pytest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from roller import collision, mapcache
+
+
+@pytest.fixture(scope="session", autouse=True)
+def display():
+    """The bots read the keyboard state, which needs pygame and a (dummy) display"""
+    pygame.init()
+    yield pygame.display.set_mode((16, 16))
+    pygame.quit()
+
+
+def make_world(channels):
+    """Build a minimal world from an RGB array indexed [x, y], the way roller.maps derives its layers
+
+    :param channels: map colors, see roller.mapcache for how they are interpreted
+    """
+    layers = {"channels": channels}
+    for name, (dtype, derive) in mapcache.LAYERS.items():
+        layers[name] = derive(channels).astype(dtype)
+    compiled = mapcache.CompiledMap("test", layers)
+    world = types.SimpleNamespace(layers=compiled, water=None, heat=None, surface=None, opacity=None, entity_index=None,
+                                  interpretation_dirty=None)
+    world.occupancy = collision.OccupancyGrid(compiled)
+    return world
+
+
+def make_flat_world(width=2000, height=200, floor=150):
+    """A world of open air above flat ground starting at row `floor`"""
+    channels = np.full((width, height, 3), 255, np.uint8)
+    channels[:, floor:] = 0
+    return make_world(channels)
@@ -0,0 +1,28 @@
+import numpy as np
+
+from roller.behaviours import get_table_ms, get_waveform_tables, sine_wave, square_wave
+
+PERIODS = [2, 0.5, 1.5, 0.3, 1 / 3, 0.0125, 0.0004, 0.123456789]
+
+
+def get_ticks():
+    return np.random.default_rng(0).integers(0, 10**7, 2000).tolist() + list(range(3000))
+
+
+def test_period_tables_repeat_exactly():
+    assert [get_table_ms(period) for period in PERIODS] == [2000, 500, 1500, 300, 1000, 25, 2, None]
+
+
+def test_sine_tables_match_the_sine_wave():
+    tables = get_waveform_tables(sine_wave, [(period,) for period in PERIODS])
+    for ticks in get_ticks():
+        expected = [sine_wave(ticks / 1000, period) for period in PERIODS]
+        assert np.allclose(tables.lookup(ticks), expected, atol=1e-6), ticks
+
+
+def test_square_tables_match_the_square_wave():
+    parameters = [(period, duty_cycle) for period in PERIODS for duty_cycle in (0.1, 0.5, 0.75)]
+    tables = get_waveform_tables(square_wave, parameters)
+    for ticks in get_ticks():
+        expected = [square_wave(ticks / 1000, *p) for p in parameters]
+        assert tables.lookup(ticks).tolist() == expected, ticks
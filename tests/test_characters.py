@@ -0,0 +1,36 @@
+import pytest
+
+from roller import characters
+from roller.bots import Spherebot
+
+
+@pytest.fixture(autouse=True)
+def spawned(monkeypatch):
+    """Each test starts with no characters spawned"""
+    monkeypatch.setattr(characters, "spawned", {})
+    return characters.spawned
+
+
+def test_characters_are_built_once_when_first_spawned(monkeypatch, spawned):
+    built = []
+    monkeypatch.setitem(characters.definitions, "dummy", lambda: built.append(object()) or built[-1])
+    assert built == [] and "dummy" not in spawned
+    dummy = characters.spawn("dummy")
+    assert characters.spawn("dummy") is dummy
+    assert characters.dummy is dummy
+    assert built == [dummy] and spawned == {"dummy": dummy}
+
+
+def test_characters_are_spawned_as_module_attributes(spawned):
+    aros = characters.Aros
+    assert isinstance(aros, Spherebot)
+    assert characters.spawn("Aros") is aros
+    assert list(spawned) == ["Aros"]
+
+
+def test_unknown_attributes_are_not_spawned(spawned):
+    with pytest.raises(AttributeError):
+        characters.nobody
+    with pytest.raises(KeyError):
+        characters.spawn("nobody")
+    assert spawned == {}
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from roller import collision
+from roller.bots import Elevator, Spherebot, collide_bots
+from roller.spatial import SpatialHash
+
+from conftest import make_flat_world, make_world
+
+
+def settle(world, bot, ticks=30):
+    for _ in range(ticks):
+        bot.run_physics(world)
+
+
+@pytest.mark.parametrize("vx", [12, 20])
+def test_fast_bot_rolls_along_flat_floor(vx):
+    """Ground pixels grazed while rolling along the floor don't stop the bot"""
+    world = make_flat_world()
+    bot = Spherebot(x=100, y=130, radius=20)
+    settle(world, bot)
+    start = bot.x
+    for _ in range(20):
+        bot.vx = vx
+        bot.run_physics(world)
+    assert bot.x - start > 0.8 * 20 * vx
+    assert 120 < bot.y < 135
+
+
+def test_fast_bot_does_not_pass_through_thin_wall():
+    channels = np.full((400, 200, 3), 255, np.uint8)
+    channels[200:202, :] = 0
+    world = make_world(channels)
+    bot = Spherebot(x=150, y=100, radius=10)
+    bot.vx = 60
+    for _ in range(5):
+        bot.run_physics(world)
+        assert bot.x < 200
+
+
+def test_time_of_impact_slides_along_the_surface():
+    world = make_flat_world()
+    # moving diagonally into the floor from 10 pixels above it
+    fraction, normal_x, normal_y = collision.get_time_of_impact(world, 100, 120, 20, 20, 20)
+    assert fraction == pytest.approx(0.5, abs=0.06)
+    assert normal_y < -0.9
+    # rolling along the floor only grazes it
+    assert collision.get_time_of_impact(world, 100, 130, 20, 20, 0) == (1.0, 0.0, 0.0)
+
+    bot = Spherebot(x=100, y=120, radius=20)
+    bot.vx, bot.vy = 20, 20
+    dx, dy = bot.get_free_motion(world)
+    assert dx > 15
+    assert dy == pytest.approx(10, abs=1.5)
+
+
+def collide(*bots):
+    index = SpatialHash()
+    index.rebuild(bots)
+    return collide_bots(index)
+
+
+def test_colliding_bots_are_pushed_apart_and_bounce():
+    small = Spherebot(x=100, y=100, radius=10, vx=4, vy=1)
+    big = Spherebot(x=125, y=100, radius=20, vx=-2, vy=0)
+    momentum = (small.vx * 10**2 + big.vx * 20**2, small.vy * 10**2 + big.vy * 20**2)
+    assert collide(small, big) == 1
+    # the bots only touch, and the lighter one moved more
+    assert np.hypot(big.x - small.x, big.y - small.y) == pytest.approx(30)
+    assert 100 - small.x == pytest.approx(4 * (big.x - 125))
+    # they move apart, and the bounce along the line between them keeps their momentum
+    assert small.vx < big.vx
+    assert small.vx * 10**2 + big.vx * 20**2 == pytest.approx(momentum[0])
+    assert small.vy * 10**2 + big.vy * 20**2 == pytest.approx(momentum[1])
+    assert (small.vy, big.vy) == (1, 0)
+
+
+def test_bots_moving_apart_are_not_bounced():
+    a = Spherebot(x=100, y=100, radius=10, vx=-1)
+    b = Spherebot(x=115, y=100, radius=10, vx=1)
+    collide(a, b)
+    assert (a.vx, b.vx) == (-1, 1)
+    assert b.x - a.x == pytest.approx(20)
+
+
+def test_elevators_are_not_pushed_around():
+    bot = Spherebot(x=100, y=100, radius=10, vx=3)
+    elevator = Elevator(x=115, y=100)
+    assert collide(bot, elevator) == 0
+    assert (bot.x, bot.vx, elevator.x) == (100, 3, 115)
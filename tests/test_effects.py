@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from roller import effects
+from roller.effects import scan_one_pole
+
+
+def scan_loop(inputs, pole, state):
+    outputs = []
+    for x in inputs:
+        state = x + pole * state
+        outputs.append(state)
+    return np.array(outputs)
+
+
+@pytest.mark.parametrize("pole", [0.0, 0.3, -0.7, 0.99, 0.999999])
+def test_scan_matches_the_recurrence(pole):
+    inputs = np.random.default_rng(0).uniform(-1, 1, 5000)
+    expected = scan_loop(inputs, pole, 0.5)
+    assert np.allclose(scan_one_pole(inputs, pole, 0.5), expected, rtol=1e-9, atol=1e-9)
+
+
+def test_scan_of_nothing():
+    assert len(scan_one_pole([], 0.5, 1.0)) == 0
+    assert scan_one_pole([1.0], 0.5, 2.0).tolist() == [2.0]
+
+
+def test_low_pass_filter_in_blocks_matches_one_block():
+    wave = np.sin(np.linspace(0, 200, 3000)) + np.random.default_rng(1).uniform(-0.2, 0.2, 3000)
+    whole = effects.LowPassFilter(cutoff_freq=500).process(wave)
+    lowpass = effects.LowPassFilter(cutoff_freq=500)
+    blocks = np.concatenate([lowpass.process(block) for block in np.array_split(wave, [1, 700, 701, 2048])])
+    assert np.allclose(blocks, whole)
+
+
+def adsr_loop(wave, sample_rate, attack, decay, sustain_level, release):
+    """The envelope that roller.sounds.apply_adsr applied before it used roller.effects"""
+    length = len(wave)
+    adsr = np.ones(length)
+    attack_samples = int(attack * sample_rate)
+    decay_samples = int(decay * sample_rate)
+    release_samples = int(release * sample_rate)
+    adsr[:attack_samples] = np.linspace(0, 1, attack_samples)
+    adsr[attack_samples:attack_samples+decay_samples] = np.linspace(1, sustain_level, decay_samples)
+    adsr[-release_samples:] = np.linspace(sustain_level, 0, release_samples)
+    return wave * adsr
+
+
+@pytest.mark.parametrize("length", [3000, 1300, 1000, 800])
+def test_adsr_envelope_matches_the_old_curve(length):
+    wave = np.random.default_rng(2).uniform(-1, 1, length)
+    expected = adsr_loop(wave, 1000, 0.3, 0.5, 0.3, 0.5)
+    envelope = effects.adsr_envelope(length, 0.3, 0.5, 0.3, 0.5, sample_rate=1000)
+    assert np.allclose(envelope.process(wave), expected)
+    envelope.reset()
+    blocks = [envelope.process(block) for block in np.array_split(wave, 7)]
+    assert np.allclose(np.concatenate(blocks), expected)
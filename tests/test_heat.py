@@ -0,0 +1,65 @@
+import types
+
+import numpy as np
+import pytest
+
+from conftest import make_world
+from roller import material
+from roller.config import g_config
+from roller.heat import HeatField
+
+
+def make_layers(width=640, height=480):
+    return types.SimpleNamespace(get_size=lambda: (width, height))
+
+
+def step_everywhere(excess, dt):
+    """One step of the diffusion over the whole grid, the way HeatField steps each active block"""
+    diffusion = min(g_config.heat_diffusion_rate * dt, 0.25)
+    relaxation = min(g_config.heat_relaxation_rate * dt, 1.0)
+    window = np.pad(excess, 1, mode="edge")
+    laplacian = window[:-2, 1:-1] + window[2:, 1:-1] + window[1:-1, :-2] + window[1:-1, 2:] - 4 * excess
+    return excess + diffusion * laplacian - relaxation * excess
+
+
+def test_active_blocks_step_like_the_whole_grid():
+    field = HeatField(make_layers())
+    field.deposit([100, 5, 630], [100, 470, 240], [5000, 2000, 3000])
+    expected = field.excess.copy()
+    for _ in range(60):
+        field.step(0.1)
+        expected = step_everywhere(expected, 0.1)
+    # heat below the threshold is not passed on to resting blocks, which adds up over the steps
+    assert np.abs(field.excess - expected).max() < 5 * g_config.heat_active_threshold
+    assert 0 < len(field.active_blocks) < field.excess.size / g_config.heat_block_size**2
+
+
+def test_heat_spreads_without_leaving_the_map(monkeypatch):
+    monkeypatch.setattr(g_config, "heat_relaxation_rate", 0)
+    field = HeatField(make_layers())
+    # a corner of the map, where the heat would flow out if the edges leaked
+    field.deposit([0], [0], [4000])
+    total = field.excess.sum()
+    for _ in range(30):
+        field.step(0.1)
+    assert field.excess.sum() == pytest.approx(total)
+    assert field.excess[0, 0] < total / 10 and field.excess[3, 3] > 0
+
+
+def test_heat_relaxes_to_the_map_temperature():
+    field = HeatField(make_layers())
+    field.deposit([300], [200], [1000])
+    field.update(1000)
+    assert not field.active_blocks
+    assert not field.excess.any()
+    assert field.step_count == pytest.approx(1000 * g_config.heat_update_hz, abs=1)
+
+
+def test_ambient_temperature_includes_the_heat_field():
+    channels = np.zeros((64, 64, 3), np.uint8)
+    channels[:, :, material.HEATMAP] = 20
+    world = make_world(channels)
+    world.heat = HeatField(world.layers)
+    world.heat.deposit([10], [10], [g_config.heat_cell_capacity * 5])
+    assert material.get_temperature_at(types.SimpleNamespace(x=10, y=10), world) == pytest.approx(25)
+    assert material.get_temperature_at(types.SimpleNamespace(x=60, y=60), world) == pytest.approx(20)
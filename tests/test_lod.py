@@ -0,0 +1,28 @@
+import pytest
+
+from roller.bots import Spherebot
+
+from conftest import make_flat_world
+
+
+@pytest.mark.parametrize("vx", [4, 8, 12])
+def test_multi_tick_steps_roll_along_flat_floor(vx):
+    """A bot far from the camera is advanced by several ticks at once, and still rolls along the ground"""
+    world = make_flat_world()
+    bot = Spherebot(x=100, y=130, radius=20)
+    for _ in range(30):
+        bot.run_physics(world)
+    start = bot.x
+    for _ in range(10):
+        bot.vx = vx
+        bot.run_physics(world, steps=4)
+    assert bot.x - start > 0.6 * 40 * vx
+    assert 120 < bot.y < 135
+
+
+def test_multi_tick_steps_do_not_fall_through_floor():
+    world = make_flat_world()
+    bot = Spherebot(x=100, y=20, radius=10)
+    for _ in range(50):
+        bot.run_physics(world, steps=4)
+        assert bot.y < 150
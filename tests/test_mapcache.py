@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pygame
+import pytest
+
+from roller import mapcache
+
+
+@pytest.fixture
+def source(tmp_path):
+    """A small map image with random colors"""
+    channels = np.random.default_rng(0).integers(0, 256, (40, 30, 3), dtype=np.uint8)
+    path = str(tmp_path / "tiny.png")
+    pygame.image.save(pygame.surfarray.make_surface(channels), path)
+    return path
+
+
+def test_compiled_layers_match_the_image(source, tmp_path):
+    compiled = mapcache.load_map(source, str(tmp_path / "cache"))
+    channels = pygame.surfarray.array3d(pygame.image.load(source))
+    assert compiled.get_size() == (40, 30)
+    assert np.array_equal(compiled.channels, channels)
+    for name, (dtype, derive) in mapcache.LAYERS.items():
+        layer = getattr(compiled, name)
+        assert layer.dtype == dtype
+        assert np.array_equal(layer, derive(channels).astype(dtype)), name
+
+
+def test_cache_is_loaded_without_compiling(source, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    mapcache.load_map(source, cache_dir)
+
+    def compile_map(*args):
+        raise AssertionError("the map was compiled again")
+    monkeypatch.setattr(mapcache, "compile_map", compile_map)
+    assert mapcache.load_map(source, cache_dir).get_size() == (40, 30)
+
+
+def test_edits_are_not_written_to_the_cache(source, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    compiled = mapcache.load_map(source, cache_dir)
+    original = compiled.ground.copy()
+    compiled.ground[:] = ~original
+    assert np.array_equal(mapcache.load_map(source, cache_dir).ground, original)
+
+
+def test_changed_image_replaces_the_old_cache(source, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    mapcache.load_map(source, cache_dir)
+    old_files = os.listdir(cache_dir)
+
+    pygame.image.save(pygame.Surface((20, 10)), source)
+    assert mapcache.load_map(source, cache_dir).get_size() == (20, 10)
+    new_files = os.listdir(cache_dir)
+    assert len(new_files) == 1 and new_files != old_files
+
+
+def test_other_files_are_not_read_as_maps(tmp_path):
+    path = tmp_path / "not-a-map.rollmap"
+    path.write_bytes(b"hello world, this is not a map")
+    with pytest.raises(ValueError):
+        mapcache.read_map(str(path))
@@ -0,0 +1,28 @@
+import numpy as np
+
+from conftest import make_world
+from roller import paging
+from roller.maps import LoadedMap, MapRegistry
+
+
+def make_paged_map(tmp_path, name):
+    world = make_world(np.zeros((64, 64, 3), np.uint8))
+    chunk_path = str(tmp_path / f"{name}.rollpages")
+    paging.compile_chunks(world.layers, chunk_path, 32)
+    return LoadedMap(name, paging.PagedMap(chunk_path, max_chunks=4), None)
+
+
+def test_evicted_paged_maps_are_closed(tmp_path):
+    registry = MapRegistry(asset_dir=str(tmp_path), max_maps=1)
+    first = make_paged_map(tmp_path, "first")
+    first.layers.prefetch(0, 0)
+    registry.insert(first)
+    assert first.layers.prefetch_thread.is_alive()
+
+    second = make_paged_map(tmp_path, "second")
+    registry.insert(second)
+    assert list(registry.maps) == ["second"] and registry.evictions == 1
+    assert first.layers.file.closed
+    assert not first.layers.prefetch_thread.is_alive()
+    assert not second.layers.file.closed and second.layers.prefetch_thread.is_alive()
+    second.close()
@@ -0,0 +1,60 @@
+import numpy as np
+import pygame
+import pytest
+
+from roller.config import g_config
+from roller.datatypes import Line, Point
+from roller.memory import OccupancyMemory
+
+
+def test_rays_free_the_cells_they_pass_and_occupy_their_end():
+    memory = OccupancyMemory((200, 100), cell_size=4)
+    memory.add_lines([Line(Point(2, 2), Point(50, 2)), Line(Point(2, 2), Point(50, 2))])
+    memory.add_lines([Line(Point(10, 90), Point(10, 60))])
+    memory.update()
+    assert memory.ray_count == 3
+    free, hit = g_config.memory_log_odds_free, g_config.memory_log_odds_hit
+    # each ray counts once per cell, however many times it's sampled in the cell
+    assert memory.log_odds[0:12, 0] == pytest.approx(2 * free)
+    assert memory.log_odds[12, 0] == pytest.approx(2 * hit)
+    assert memory.log_odds[2, 16:23] == pytest.approx(free)
+    assert memory.log_odds[2, 15] == pytest.approx(hit)
+    assert np.count_nonzero(memory.log_odds) == 13 + 8
+
+    assert memory.get_probability(50, 2) > 0.5 > memory.get_probability(20, 2)
+    assert memory.get_probability(150, 50) == 0.5
+
+
+def test_log_odds_are_clamped():
+    memory = OccupancyMemory((100, 100), cell_size=4)
+    for _ in range(20):
+        memory.add_lines([Line(Point(2, 2), Point(30, 2))])
+        memory.update()
+    assert memory.log_odds[7, 0] == g_config.memory_log_odds_limit
+    assert memory.log_odds[0, 0] == -g_config.memory_log_odds_limit
+
+
+def test_only_changed_cells_are_redrawn():
+    memory = OccupancyMemory((200, 200), cell_size=4)
+    surface = pygame.Surface((200, 200), pygame.SRCALPHA)
+    memory.add_lines([Line(Point(2, 2), Point(50, 2))])
+    memory.update()
+    memory.render(surface)
+    alpha = pygame.surfarray.array_alpha(surface)
+    hit_alpha = int(g_config.memory_log_odds_hit / g_config.memory_log_odds_limit * 255)
+    assert (alpha[48:52, 0:4] == hit_alpha).all()
+    assert np.count_nonzero(alpha) == 16
+
+    # something else drawn on the surface is kept, until the cells under it change
+    surface.fill((255, 0, 0, 255), (100, 100, 8, 8))
+    memory.add_lines([Line(Point(2, 10), Point(50, 10))])
+    memory.update()
+    memory.render(surface)
+    alpha = pygame.surfarray.array_alpha(surface)
+    assert (alpha[100:108, 100:108] == 255).all()
+    assert np.count_nonzero(alpha) == 32 + 64
+
+    memory.invalidate(25, 25, 27, 27)
+    memory.render(surface)
+    assert not pygame.surfarray.array_alpha(surface)[100:108, 100:108].any()
+    assert not memory.dirty.any() and not memory.dirty_tiles
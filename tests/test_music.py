@@ -0,0 +1,93 @@
+import itertools
+import random
+
+import numpy as np
+import pygame
+import pytest
+
+from roller.music import AmbientMusic, generate_ambient_music
+
+
+def get_music(block_size, block_count, seed=1):
+    random.seed(seed)
+    np.random.seed(seed)
+    blocks = generate_ambient_music([440, 550], block_size, 8000, detune=0, wave_count=1)
+    return np.concatenate(list(itertools.islice(blocks, block_count)))
+
+
+def test_notes_continue_across_blocks():
+    # the same notes come out however the music is cut into blocks
+    music = get_music(1000, 40)
+    assert np.allclose(get_music(300, 134)[:len(music)], music)
+    # a note lasts at least a second, so the first 8 blocks are one unbroken sine wave
+    t = np.arange(8000) / 8000
+    assert any(np.allclose(music[:8000], np.sin(2 * np.pi * frequency * t)) for frequency in [440, 550])
+
+
+class FakeChannel:
+    """A channel that plays a block in one poll, so the test can tell when blocks run late"""
+
+    def __init__(self, late_blocks=()):
+        self.late_blocks = set(late_blocks)
+        self.playing = None
+        self.queued = None
+        self.played = []
+
+    def get_queue(self):
+        # the queued block starts playing once it's polled
+        if self.queued is not None:
+            self.playing, self.queued = self.queued, None
+            self.played.append(self.playing)
+            return self.playing
+        return None
+
+    def get_busy(self):
+        return self.playing is not None and len(self.played) not in self.late_blocks
+
+    def queue(self, sound):
+        self.queued = sound
+
+    def play(self, sound):
+        self.playing = sound
+        self.played.append(sound)
+
+
+def test_blocks_are_queued_and_underruns_counted(monkeypatch):
+    made = []
+    blocks = [np.full(8, i / 10) for i in range(6)]
+    music = AmbientMusic(iter(blocks))
+    monkeypatch.setattr(music, "make_sound", lambda block, channels: made.append(block) or block[0])
+    music.channel = FakeChannel(late_blocks={3})
+    music.run(8000, 2)
+
+    assert music.blocks_played == 6
+    assert music.channel.played[:5] == pytest.approx([0, 0.1, 0.2, 0.3, 0.4])
+    assert music.channel.queued == pytest.approx(0.5)
+    # the fourth block found the channel idle, and had to be restarted
+    assert music.underruns == 1
+    assert len(made) == 6
+
+
+def test_blocks_become_sounds_for_the_mixer():
+    if pygame.mixer.get_init() is None:
+        pygame.mixer.init()
+    frequency, _, channels = pygame.mixer.get_init()
+    sound = AmbientMusic().make_sound(np.array([0, 0.5, 2, -2]), channels)
+    samples = pygame.sndarray.array(sound)
+    expected = [0, 16383, 32767, -32767]
+    if channels > 1:
+        assert (samples == np.array(expected)[:, np.newaxis]).all()
+    else:
+        assert list(samples) == expected
+
+
+def test_stop_ends_the_thread():
+    if pygame.mixer.get_init() is None:
+        pygame.mixer.init()
+    music = AmbientMusic()
+    music.start()
+    thread = music.thread
+    assert thread.is_alive()
+    music.stop()
+    assert not thread.is_alive() and music.channel is None
+    assert music.get_housekeeping()["underruns"] == 0
@@ -0,0 +1,94 @@
+import heapq
+import math
+import random
+
+import numpy as np
+
+from roller.config import g_config
+from roller.navigation import DIRECTIONS, PathPlanner, get_move_costs
+
+
+def get_distances(blocked, goal):
+    """Distances to the goal from all cells, by Dijkstra's algorithm over the reversed moves"""
+    padded = np.ones((blocked.shape[0] + 2, blocked.shape[1] + 2), dtype=np.bool_)
+    padded[1:-1, 1:-1] = blocked
+    costs = get_move_costs(padded, g_config.path_climb_cost)
+    distances = np.full(blocked.shape, math.inf)
+    distances[goal] = 0
+    queue = [(0, goal)]
+    while queue:
+        distance, (cx, cy) = heapq.heappop(queue)
+        if distance > distances[cx, cy]:
+            continue
+        for direction, (dx, dy) in enumerate(DIRECTIONS):
+            # the cells that can move to (cx, cy)
+            x, y = cx - dx, cy - dy
+            if 0 <= x < blocked.shape[0] and 0 <= y < blocked.shape[1]:
+                candidate = distance + costs[direction, x, y]
+                if candidate < distances[x, y]:
+                    distances[x, y] = candidate
+                    heapq.heappush(queue, (candidate, (x, y)))
+    return distances
+
+
+def make_blocked(rng, shape):
+    blocked = rng.random(shape) < 0.15
+    blocked[:, -1] = True
+    return blocked
+
+
+def check_distances(planner, blocked, goal):
+    expected = get_distances(blocked, goal)
+    assert np.isfinite(expected).sum() > 10
+    for cell in np.ndindex(blocked.shape):
+        planner.compute(cell)
+        assert planner.get_distance(cell) == expected[cell] or math.isclose(planner.get_distance(cell), expected[cell])
+
+
+def test_distances_match_a_full_search():
+    blocked = make_blocked(np.random.default_rng(0), (30, 20))
+    goal = (15, 10)
+    blocked[goal] = False
+    planner = PathPlanner(blocked, goal, 16)
+    check_distances(planner, blocked, goal)
+
+
+def test_distances_are_repaired_when_cells_change():
+    rng = random.Random(1)
+    generator = np.random.default_rng(1)
+    blocked = make_blocked(generator, (30, 20))
+    goal = (5, 15)
+    blocked[goal] = False
+    planner = PathPlanner(blocked, goal, 16)
+    check_distances(planner, blocked, goal)
+    for _ in range(10):
+        # block or free a random window, but never the goal
+        cx, cy = rng.randrange(28), rng.randrange(18)
+        window = generator.random((3, 3)) < 0.5
+        blocked[cx:cx + 3, cy:cy + 3] = window
+        blocked[goal] = False
+        planner.set_blocked(cx, cy, blocked[cx:cx + 3, cy:cy + 3])
+        check_distances(planner, blocked, goal)
+
+
+def test_next_cells_lead_to_the_goal():
+    blocked = np.zeros((20, 10), dtype=np.bool_)
+    blocked[:, 9] = True
+    # a wall with a step on each side to climb it
+    blocked[10, 7:9] = True
+    blocked[9, 8] = True
+    blocked[11, 8] = True
+    goal = (18, 8)
+    planner = PathPlanner(blocked, goal, 16)
+    cell = (1, 8)
+    planner.compute(cell)
+    assert planner.get_distance(cell) == get_distances(blocked, goal)[cell] < math.inf
+    steps = 0
+    while cell != goal:
+        next_cell = planner.get_next_cell(cell)
+        assert next_cell is not None and not blocked[next_cell]
+        assert planner.get_distance(next_cell) < planner.get_distance(cell)
+        cell = next_cell
+        steps += 1
+        assert steps < 100
+    assert planner.get_next_cell(goal) is None
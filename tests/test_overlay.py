@@ -0,0 +1,165 @@
+import json
+import types
+
+import pygame
+import pytest
+
+from roller import overlay
+from roller.overlay import find_font
+
+
+@pytest.fixture
+def searches(monkeypatch, tmp_path):
+    """The names pygame is asked to search for. Only "present" is installed"""
+    font_path = tmp_path / "present.ttf"
+    font_path.write_bytes(b"")
+    names = []
+
+    def match_font(name):
+        names.append(name)
+        return str(font_path) if name == "present" else None
+
+    monkeypatch.setattr(pygame.font, "match_font", match_font)
+    return names
+
+
+def test_found_fonts_are_cached(searches, tmp_path):
+    cache_file = str(tmp_path / "cache" / "fonts.json")
+    path = find_font("present", cache_file)
+    assert path == str(tmp_path / "present.ttf")
+    assert find_font("present", cache_file) == path
+    assert searches == ["present"]
+    with open(cache_file) as f:
+        assert json.load(f) == {"present": path}
+
+
+def test_missing_fonts_are_cached_as_none(searches, tmp_path):
+    cache_file = str(tmp_path / "fonts.json")
+    assert find_font("missing", cache_file) is None
+    assert find_font("missing", cache_file) is None
+    assert searches == ["missing"]
+
+
+def test_stale_paths_are_searched_again(searches, tmp_path):
+    cache_file = tmp_path / "fonts.json"
+    cache_file.write_text(json.dumps({"present": str(tmp_path / "uninstalled.ttf")}))
+    assert find_font("present", str(cache_file)) == str(tmp_path / "present.ttf")
+    assert searches == ["present"]
+
+
+def test_unreadable_and_unwritable_caches_are_ignored(searches, tmp_path):
+    cache_file = tmp_path / "fonts.json"
+    cache_file.write_text("not json")
+    assert find_font("present", str(cache_file)) == str(tmp_path / "present.ttf")
+    # a file where the cache directory should be
+    assert find_font("present", str(cache_file / "fonts.json")) == str(tmp_path / "present.ttf")
+    assert searches == ["present", "present"]
+
+
+def test_overlay_uses_the_cached_font(searches, tmp_path, monkeypatch):
+    monkeypatch.setattr(overlay.find_font, "__defaults__", (str(tmp_path / "fonts.json"),))
+    overlay.JsonOverlay(pygame.Surface((100, 100)))
+    overlay.JsonOverlay(pygame.Surface((100, 100)))
+    assert searches == ["ubuntu mono"]
+
+
+@pytest.fixture
+def make_overlay(searches, tmp_path, monkeypatch):
+    """Makes overlays that count the lines they render. The fonts are searched with a cache file of the test"""
+    monkeypatch.setattr(overlay.find_font, "__defaults__", (str(tmp_path / "fonts.json"),))
+
+    def make_overlay(**kwargs):
+        json_overlay = overlay.JsonOverlay(pygame.Surface((300, 400)), **kwargs)
+        json_overlay.rendered = []
+        render = json_overlay.font.render
+        json_overlay.font = types.SimpleNamespace(render=lambda text, *args: json_overlay.rendered.append(text) or render(text, *args))
+        return json_overlay
+    return make_overlay
+
+
+def draw(json_overlay, data):
+    json_overlay.update_text_overlay(data)
+    return pygame.image.tobytes(json_overlay.text_overlay, "RGBA")
+
+
+def test_only_changed_lines_are_redrawn(make_overlay):
+    json_overlay = make_overlay()
+    draw(json_overlay, {"fps": 60, "bots": 4, "name": "x"})
+    assert json_overlay.rendered == ['{', '    "fps": 60,', '    "bots": 4,', '    "name": "x"', '}']
+    json_overlay.rendered.clear()
+
+    pixels = draw(json_overlay, {"fps": 59, "bots": 4, "name": "x"})
+    assert json_overlay.rendered == ['    "fps": 59,']
+    # the lines that were kept and redrawn look the same as lines drawn on a new overlay
+    assert pixels == draw(make_overlay(), {"fps": 59, "bots": 4, "name": "x"})
+
+    # lines that were rendered before come from the cache
+    json_overlay.rendered.clear()
+    draw(json_overlay, {"fps": 60, "bots": 4, "name": "x"})
+    assert json_overlay.rendered == []
+
+
+def test_all_lines_are_redrawn_when_their_number_changes(make_overlay):
+    json_overlay = make_overlay()
+    draw(json_overlay, {"fps": 60})
+    pixels = draw(json_overlay, {"fps": 60, "bots": 4})
+    assert json_overlay.text_overlay.get_height() == 4 * json_overlay.font_size
+    assert pixels == draw(make_overlay(), {"fps": 60, "bots": 4})
+
+
+def test_least_recently_used_lines_are_dropped(make_overlay):
+    json_overlay = make_overlay(max_cached_lines=3)
+    for text in ["a", "b", "a", "c", "d"]:
+        json_overlay.render_line(text)
+    assert list(json_overlay.line_cache) == ["a", "c", "d"]
+    assert json_overlay.rendered == ["a", "b", "c", "d"]
+
+
+def test_text_is_refreshed_at_refresh_hz(make_overlay, monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(pygame.time, "get_ticks", lambda: now[0])
+    json_overlay = make_overlay(refresh_hz=10)
+    json_overlay.render_housekeeping({"fps": 60})
+    now[0] += 50
+    json_overlay.render_housekeeping({"fps": 59})
+    assert json_overlay.lines[1] == '    "fps": 60'
+    now[0] += 50
+    json_overlay.render_housekeeping({"fps": 59})
+    assert json_overlay.lines[1] == '    "fps": 59'
+
+
+def test_plot_keeps_the_latest_values_in_order():
+    plot = overlay.LinePlot(pygame.Surface((100, 50)), (0, 0, 100, 50), capacity=5)
+    for value in range(3):
+        plot.add_data(value)
+    assert plot.get_ordered_data().tolist() == [0, 1, 2]
+    for value in range(3, 12):
+        plot.add_data(value)
+    assert plot.get_ordered_data().tolist() == [7, 8, 9, 10, 11]
+    assert plot.count == 5
+
+
+def test_plot_limits_follow_the_values_in_the_buffer():
+    plot = overlay.LinePlot(pygame.Surface((100, 50)), (0, 0, 100, 50), capacity=4)
+    for value in [5, -3, 2, 1]:
+        plot.add_data(value)
+    assert plot.get_limits() == (-3, 5)
+    # the maximum is overwritten
+    plot.add_data(0)
+    assert plot.get_limits() == (-3, 2)
+    plot.add_data(0)
+    plot.add_data(0)
+    assert plot.get_limits() == (0, 1)
+
+
+def test_plot_is_drawn_within_its_rect():
+    surface = pygame.Surface((120, 70))
+    plot = overlay.LinePlot(surface, (10, 10, 100, 50), capacity=50, line_color=(255, 0, 0))
+    for value in range(80):
+        plot.add_data(value % 7)
+    plot.draw()
+    red = (pygame.surfarray.pixels_red(surface) == 255) & (pygame.surfarray.pixels_green(surface) == 0)
+    xs, ys = red.nonzero()
+    # one pixel is left between the line and the frame
+    assert xs.min() == 11 and xs.max() == 108
+    assert ys.min() == 11 and ys.max() == 58
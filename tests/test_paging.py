@@ -0,0 +1,102 @@
+import random
+
+import numpy as np
+import pytest
+
+from conftest import make_world
+from roller import collision, paging
+from roller.calculations import get_first_matching_line_pixel
+from roller.datatypes import Line, Point
+
+
+@pytest.fixture
+def random_map(tmp_path):
+    """A 100x70 map of random ground and air, and the same map paged in 32 px chunks. The map doesn't
+    end on a chunk edge, so the chunks at the right and bottom are padded"""
+    rng = np.random.default_rng(0)
+    channels = np.where(rng.random((100, 70, 1)) < 0.3, 0, 255).astype(np.uint8).repeat(3, axis=2)
+    world = make_world(channels)
+    chunk_path = str(tmp_path / "test.rollpages")
+    paging.compile_chunks(world.layers, chunk_path, 32)
+    return world.layers, paging.PagedMap(chunk_path, max_chunks=4)
+
+
+def test_gather_outside_the_map_is_zero(tmp_path):
+    # a map of 2x2 chunks, ground everywhere
+    channels = np.zeros((64, 64, 3), np.uint8)
+    world = make_world(channels)
+    chunk_path = str(tmp_path / "test.rollpages")
+    paging.compile_chunks(world.layers, chunk_path, 32)
+    paged = paging.PagedMap(chunk_path, max_chunks=4)
+
+    xs = np.array([10, -1, 64, 10, 10, 40])
+    ys = np.array([10, 10, 10, -1, 64, 40])
+    expected = [world.layers.ground[10, 10], 0, 0, 0, 0, world.layers.ground[40, 40]]
+    assert paged.ground[xs, ys].tolist() == expected
+    assert expected[0] != 0
+    assert [paged.ground[int(x), int(y)] for x, y in zip(xs, ys)] == expected
+
+
+def test_reads_across_chunk_edges(random_map):
+    compiled, paged = random_map
+    # windows that cross the edges between chunks, and the padded edge of the map
+    for xs, ys in [(slice(30, 34), slice(0, 70)), (slice(0, 100), slice(31, 33)), (slice(60, 100), slice(60, 70)), (slice(95, 110), slice(65, 80))]:
+        expected = np.zeros_like(paged.channels[xs, ys])
+        part = compiled.channels[xs, ys]
+        expected[:part.shape[0], :part.shape[1]] = part
+        assert np.array_equal(paged.channels[xs, ys], expected)
+    xs = np.array([31, 32, 63, 64, 99, 0])
+    ys = np.array([31, 32, 63, 64, 69, 0])
+    assert np.array_equal(paged.ground[xs, ys], compiled.ground[xs, ys])
+    assert [paged.ground[int(x), int(y)] for x, y in zip(xs, ys)] == compiled.ground[xs, ys].tolist()
+
+
+def test_least_recently_used_chunks_are_evicted(random_map):
+    compiled, paged = random_map
+    # 4 x 3 chunks, of which 4 are kept
+    for cx in range(4):
+        for cy in range(3):
+            paged.get_chunk(cx, cy)
+    assert len(paged.chunks) == 4
+    assert paged.evictions == 8
+    assert list(paged.chunks) == [(2, 2), (3, 0), (3, 1), (3, 2)]
+    # evicted chunks are read again from the file
+    assert np.array_equal(paged.ground[0:32, 0:32], compiled.ground[0:32, 0:32])
+    assert (0, 0) in paged.chunks and len(paged.chunks) == 4
+
+
+def test_writes_are_kept_when_chunks_are_evicted(random_map):
+    compiled, paged = random_map
+    # a write across 4 chunks
+    edit = np.full((20, 20, 3), 7, dtype=np.uint8)
+    paged.channels[20:40, 20:40] = edit
+    for cx in range(4):
+        for cy in range(3):
+            paged.get_chunk(cx, cy)
+    assert len(paged.edited_chunks) == 4
+    assert np.array_equal(paged.channels[20:40, 20:40], edit)
+    assert np.array_equal(paged.channels[10:20, 10:20], compiled.channels[10:20, 10:20])
+    assert paged.channels[19, 20].tolist() == compiled.channels[19, 20].tolist()
+
+
+def test_occupancy_is_filled_in_when_queried(random_map):
+    compiled, paged = random_map
+    expected = collision.OccupancyGrid(compiled, cell_size=8)
+    grid = collision.OccupancyGrid(paged, cell_size=8)
+    assert not grid.filled.any() and paged.misses == 0
+    assert np.array_equal(grid.get_cells(1, 1, 3, 3), expected.cells[1:3, 1:3])
+    # only the chunk that was queried has been read
+    assert grid.filled.sum() == 1 and paged.misses == 1
+    assert grid.has_ground(0, 0, 100, 70) == expected.has_ground(0, 0, 100, 70)
+    assert np.array_equal(grid.get_cells(0, 0, 100, 100), expected.cells)
+
+
+def test_lines_are_traced_the_same_on_paged_layers(random_map):
+    compiled, paged = random_map
+    for seed in range(20):
+        rng = random.Random(seed)
+        line = Line(Point(rng.uniform(0, 100), rng.uniform(0, 70)), Point(rng.uniform(-20, 120), rng.uniform(-20, 90)))
+        random.seed(seed)
+        expected = get_first_matching_line_pixel(line, lambda value: value > 0 and random.random() < 0.2, compiled.ground)
+        random.seed(seed)
+        assert get_first_matching_line_pixel(line, lambda value: value > 0 and random.random() < 0.2, paged.ground) == expected
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from roller import performance
+from roller.performance import Perfomance, StartupTimer
+
+
+def test_startup_phases_are_timed_from_mark_to_mark(monkeypatch):
+    now = [10.0]
+    monkeypatch.setattr(performance.time, "perf_counter", lambda: now[0])
+    timer = StartupTimer(start_s=9.5)
+    now[0] = 10.25
+    timer.mark("imports")
+    now[0] = 11.0
+    timer.mark("map")
+    now[0] = 11.0005
+    timer.mark("first frame")
+    assert timer.phases == {"imports": 750.0, "map": 750.0, "first frame": 0.5}
+    assert list(timer.phases) == ["imports", "map", "first frame"]
+    assert timer.get_total_ms() == 1500.5
+    assert json.loads(str(timer)) == {"phases_ms": timer.phases, "total_ms": 1500.5}
+
+
+def test_startup_starts_when_the_timer_is_made(monkeypatch):
+    monkeypatch.setattr(performance.time, "perf_counter", lambda: 3.0)
+    timer = StartupTimer()
+    assert timer.get_total_ms() == 0
+    timer.mark("nothing")
+    assert timer.phases == {"nothing": 0.0}
+
+
+def test_phases_add_up_the_time_between_marks(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(performance.time, "perf_counter", lambda: now[0])
+    ticks = iter([1000, 1016])
+    monkeypatch.setattr(performance.pygame.time, "get_ticks", lambda: next(ticks))
+    timing = Perfomance()
+    # cpu usage is not measured on these ticks
+    timing.cpu_sample_ms = 1000
+    timing.start_tick()
+    for phase, seconds in [("physics", 0.002), ("sensors", 0.004), ("physics", 0.001), ("other", 0.0005), ("render", 0.003)]:
+        now[0] += seconds
+        timing.mark_phase(phase)
+    assert timing.phase_ms == pytest.approx({"physics": 3, "behaviours": 0, "sensors": 4, "render": 3, "other": 0.5})
+    assert timing.get_housekeeping()["phase_ms"]["physics"] == 3
+
+    # every tick starts from zero
+    timing.start_tick()
+    now[0] += 0.001
+    timing.mark_phase("render")
+    assert timing.phase_ms == pytest.approx({"physics": 0, "behaviours": 0, "sensors": 0, "render": 1})
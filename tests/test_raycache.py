@@ -0,0 +1,78 @@
+import math
+import types
+
+import pytest
+
+from conftest import make_flat_world
+from roller import spatial, terrain
+from roller.bots import Elevator
+from roller.raycache import RayProfileCache, g_ray_cache
+
+
+@pytest.fixture
+def world():
+    world = make_flat_world(width=300, height=200, floor=150)
+    world.entity_index = spatial.SpatialHash()
+    g_ray_cache.clear()
+    g_ray_cache.layers = world.layers
+    yield world
+    g_ray_cache.clear()
+    g_ray_cache.layers = None
+
+
+def test_profiles_are_traced_from_the_real_origin(world):
+    cache = RayProfileCache()
+    origin = types.SimpleNamespace(x=13.6, y=20.3)
+    xs, ys, distances, _, _ = cache.get_profile(origin, 0.3, 100, world.layers)
+    assert (xs[0], ys[0]) == (13, 20)
+    assert (xs[-1], ys[-1]) == (math.floor(13.6 + 100 * math.cos(0.3)), math.floor(20.3 + 100 * math.sin(0.3)))
+
+
+def test_repeated_rays_hit_the_cache(world):
+    cache = RayProfileCache()
+    origin = types.SimpleNamespace(x=100, y=50)
+    first = cache.get_lidar_return(origin, 200, math.pi / 2, world)
+    second = cache.get_lidar_return(types.SimpleNamespace(x=100.4, y=50.2), 200, math.pi / 2 + 0.0002, world)
+    assert first == second == (100, 150)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_profiles_are_evicted(world):
+    cache = RayProfileCache(capacity=2)
+    origin = types.SimpleNamespace(x=100, y=50)
+    for theta in [0.5, 1.0, 0.5, 1.5]:
+        cache.get_profile(origin, theta, 100, world.layers)
+    assert [key[2] for key in cache.profiles] == [250, 750]
+    assert cache.evictions == 1
+    # the evicted profile is not found through the tiles it passed through either
+    assert all(key in cache.profiles for keys in cache.tiles.values() for key in keys)
+
+
+def test_edits_evict_the_rays_that_pass_through_them(world):
+    origin = types.SimpleNamespace(x=100, y=50)
+    assert g_ray_cache.get_lidar_return(origin, 200, math.pi / 2, world) == (100, 150)
+    g_ray_cache.get_lidar_return(types.SimpleNamespace(x=250, y=20), 200, 0, world)
+    terrain.fill(world, (90, 100, 20, 5), (0, 0, 0))
+    assert len(g_ray_cache.profiles) == 1
+    assert g_ray_cache.get_lidar_return(origin, 200, math.pi / 2, world) == (100, 100)
+
+
+def test_moving_platform_keeps_its_own_rays(world):
+    elevator = Elevator(x=100, y=60, platform_size=(80, 6))
+    elevator.run_physics(world)
+    other = types.SimpleNamespace(x=70, y=20)
+    world.entity_index.rebuild([elevator])
+    assert g_ray_cache.get_lidar_return(elevator, 200, math.pi / 2, world) == (100, 150)
+    assert g_ray_cache.get_lidar_return(other, 200, math.pi / 2, world) == (70, 80)
+
+    elevator.vy = 1
+    elevator.run_physics(world)
+    assert len(g_ray_cache.profiles) == 1
+    assert g_ray_cache.get_lidar_return(elevator, 200, math.pi / 2, world) == (100, 150)
+    assert g_ray_cache.get_lidar_return(other, 200, math.pi / 2, world) == (70, 81)
+    assert g_ray_cache.hits == 1
+
+    # over terrain, the platform covers pixels that the elevator's rays would scatter from
+    elevator.y = 128
+    elevator.run_physics(world)
+    assert len(g_ray_cache.profiles) == 0
@@ -0,0 +1,67 @@
+import types
+
+import numpy as np
+import pygame
+import pytest
+
+import game
+from roller.calculations import screen2world, world2screen
+from roller.camera import Camera
+from roller.datatypes import Point
+
+
+def make_view(scale, x=0, y=0):
+    return types.SimpleNamespace(scale=scale, x=x, y=y)
+
+
+def make_checkerboard(width, height, block):
+    """A surface of block x block squares, each with its own color"""
+    xs, ys = np.meshgrid(np.arange(width) // block, np.arange(height) // block, indexing="ij")
+    channels = np.stack([xs * 20 % 256, ys * 20 % 256, (xs + ys) % 2 * 255], axis=-1).astype(np.uint8)
+    return pygame.surfarray.make_surface(channels)
+
+
+@pytest.mark.parametrize("scale", [1.0, 0.5, 0.25, 2.0])
+def test_screen_and_world_coordinates_round_trip(scale):
+    world = make_view(scale, x=-37.5, y=12)
+    point = Point(123.25, 45.5)
+    assert screen2world(world2screen(point, world), world) == pytest.approx(point)
+    assert world2screen(point, world) == pytest.approx((123.25 * scale - 37.5, 45.5 * scale + 12))
+
+
+@pytest.mark.parametrize("scale", [1.0, 0.5, 0.75])
+def test_camera_centers_its_position_at_any_scale(scale):
+    screen = pygame.Surface((320, 180))
+    world = make_view(scale)
+    camera = Camera(500, 300)
+    camera.move(world, screen)
+    assert world2screen(Point(500, 300), world) == pytest.approx((160, 90))
+
+
+@pytest.mark.parametrize("scale", [1.0, 0.5, 0.25])
+def test_world_layer_is_drawn_scaled_where_the_camera_looks(scale):
+    surface = make_checkerboard(800, 600, 16)
+    screen = pygame.Surface((160, 120))
+    world = make_view(scale)
+    Camera(400, 300).move(world, screen)
+    game.blit_world_layer(screen, surface, world)
+
+    pixels = pygame.surfarray.array3d(screen)
+    source = pygame.surfarray.array3d(surface)
+    checked = 0
+    for bx in range(0, 800, 16):
+        for by in range(0, 600, 16):
+            center = world2screen(Point(bx + 8, by + 8), world)
+            sx, sy = int(center.x), int(center.y)
+            if 0 <= sx < 160 and 0 <= sy < 120:
+                assert (pixels[sx, sy] == source[bx + 8, by + 8]).all(), (bx, by)
+                checked += 1
+    assert checked >= 160 * 120 * scale**2 / 16**2 - 60
+
+
+def test_world_layer_outside_the_screen_is_not_drawn():
+    surface = make_checkerboard(200, 200, 16)
+    screen = pygame.Surface((100, 100))
+    screen.fill((1, 2, 3))
+    game.blit_world_layer(screen, surface, make_view(0.5, x=-1000, y=0))
+    assert (pygame.surfarray.array3d(screen) == (1, 2, 3)).all()
@@ -0,0 +1,121 @@
+import random
+
+import numpy as np
+import pygame
+
+from conftest import make_flat_world
+from roller import sensors
+from roller.bots import Spherebot
+from roller.camera import Camera
+from roller.config import g_config
+from roller.dirtytiles import DirtyTiles
+from roller.memory import OccupancyMemory
+from roller.snapshots import ArrayHistory, ListHistory, SnapshotRing
+
+
+def draw_random(surface, dirty, rng):
+    """Draw a few random shapes onto the surface, marking the tiles they touch"""
+    for _ in range(rng.randrange(1, 5)):
+        color = rng.choice([(0, 0, 0), (255, 0, 0), (0, 255, 0)])
+        center = (rng.randrange(surface.get_width()), rng.randrange(surface.get_height()))
+        if rng.random() < 0.5:
+            dirty.add(pygame.draw.circle(surface, color, center, rng.randrange(1, 20)))
+        else:
+            end = (rng.randrange(surface.get_width()), rng.randrange(surface.get_height()))
+            dirty.add(pygame.draw.line(surface, color, center, end))
+
+
+def test_surface_restores_exactly_from_dirty_tiles():
+    rng = random.Random(1)
+    surface = pygame.Surface((200, 120))
+    dirty = DirtyTiles(32)
+    draw_random(surface, dirty, rng)
+    history = ArrayHistory(pygame.surfarray.pixels2d(surface), 32)
+    dirty.pop()
+
+    deltas, copies = [], []
+    for _ in range(30):
+        draw_random(surface, dirty, rng)
+        pixels = pygame.surfarray.pixels2d(surface)
+        deltas.append(history.capture(pixels, dirty.pop()))
+        copies.append(pixels.copy())
+        del pixels
+        if len(deltas) % 7 == 0:
+            # draw some more after the capture, then go back
+            draw_random(surface, dirty, rng)
+            index = rng.randrange(len(deltas))
+            pixels = pygame.surfarray.pixels2d(surface)
+            history.restore(pixels, deltas, index, dirty.pop())
+            assert np.array_equal(pixels, copies[index])
+            del pixels
+            del deltas[index + 1:], copies[index + 1:]
+
+
+def test_only_dirty_tiles_are_compared():
+    array = np.zeros((64, 64), np.float32)
+    history = ArrayHistory(array, 16)
+    array[5, 5] = 1
+    array[40, 40] = 1
+    delta = history.capture(array, {(0, 0)})
+    assert list(delta) == [(0, 0)]
+
+
+def test_list_restores_changed_items_and_lengths():
+    items = list(range(10))
+    history = ListHistory(items)
+    deltas = [history.capture(items)]
+    items[3] = "a"
+    deltas.append(history.capture(items))
+    items.append("b")
+    deltas.append(history.capture(items))
+    items[0] = "c"
+
+    assert history.restore(items, deltas, 1) == [0, 1, 2, "a", 4, 5, 6, 7, 8, 9]
+    assert history.restore(items, deltas[:2], 0) == list(range(10))
+
+
+def test_recording_can_be_turned_off(monkeypatch):
+    ring = SnapshotRing()
+    captured = []
+    monkeypatch.setattr(ring, "capture", lambda *args: captured.append(ring.tick))
+    monkeypatch.setattr(g_config, "snapshot_period_ticks", 2)
+    monkeypatch.setattr(g_config, "snapshot_enabled", False)
+    for _ in range(4):
+        ring.update([], None, None)
+    assert captured == [] and ring.tick == 0
+
+    monkeypatch.setattr(g_config, "snapshot_enabled", True)
+    for _ in range(4):
+        ring.update([], None, None)
+    assert captured == [2, 4]
+
+
+def test_sonar_buffers_are_recorded(monkeypatch):
+    world = make_flat_world(width=400, height=400, floor=300)
+    world.interpretation = pygame.Surface((400, 400), pygame.SRCALPHA)
+    world.interpretation_dirty = DirtyTiles(g_config.snapshot_tile_size)
+    world.memory_grid = OccupancyMemory((400, 400))
+    sonar = sensors.Sonar(color=(255, 0, 255))
+    bot = Spherebot(x=200, y=200, radius=10, sensors=[sonar])
+    camera = Camera()
+    now = [0]
+    monkeypatch.setattr(pygame.time, "get_ticks", lambda: now[0])
+    ring = SnapshotRing()
+
+    # a bot that doesn't move gets the same echoes, at the same places, on every ping
+    for ping in range(3):
+        for _ in range(100):
+            sonar.run(bot, world)
+        now[0] += 1000
+        sonar.run(bot, world)
+        ring.capture([bot], camera, world)
+        assert len(sonar.drawn_over) > 0
+    drawn_over = list(sonar.drawn_over)
+    pixels = pygame.surfarray.array2d(world.interpretation)
+
+    now[0] += 1000
+    sonar.run(bot, world)
+    assert sonar.drawn_over == []
+    assert ring.restore(len(ring.snapshots) - 1, [bot], camera, world)
+    assert all(a is b for a, b in zip(sonar.drawn_over, drawn_over)) and len(sonar.drawn_over) == len(drawn_over)
+    assert np.array_equal(pygame.surfarray.array2d(world.interpretation), pixels)
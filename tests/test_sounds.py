@@ -0,0 +1,73 @@
+import pygame
+import pytest
+
+from conftest import make_flat_world
+from roller import sensors, sounds
+from roller.bots import Spherebot, collide_bots
+from roller.sounds import SoundManager, generate_sine_wave
+from roller.spatial import SpatialHash
+
+
+@pytest.fixture
+def manager():
+    # the tests use SDL's dummy audio driver, where sounds play in real time without output
+    if pygame.mixer.get_init() is None:
+        pygame.mixer.init()
+    manager = SoundManager(voice_count=2, cache_capacity=2)
+    manager.init()
+    yield manager
+    for voice in manager.voices:
+        voice.stop()
+
+
+def test_sounds_are_cached_least_recently_used_first(manager):
+    a = manager.get_sound(generate_sine_wave, 440, 0.1)
+    manager.get_sound(generate_sine_wave, 550, 0.1)
+    assert manager.get_sound(generate_sine_wave, 440, 0.1) is a
+    manager.get_sound(generate_sine_wave, 660, 0.1)
+    assert [key[1] for key in manager.cache] == [(440, 0.1), (660, 0.1)]
+    assert (manager.hits, manager.misses) == (1, 3)
+    assert manager.get_sound(generate_sine_wave, 440, 0.1) is a
+
+
+def test_busy_voices_are_taken_by_priority(manager):
+    low = manager.play(generate_sine_wave, 440, 5, priority=1)
+    high = manager.play(generate_sine_wave, 550, 5, priority=2)
+    assert low is not high and low.get_busy() and high.get_busy()
+
+    # all voices are busy, and nothing plays at a lower priority
+    assert manager.play(generate_sine_wave, 660, 5, priority=0) is None
+    assert manager.dropped == 1
+    # an equally important sound takes over the oldest voice of the lowest priority
+    assert manager.play(generate_sine_wave, 660, 5, priority=1) is low
+    assert manager.play(generate_sine_wave, 770, 5, priority=1) is low
+    assert manager.play(generate_sine_wave, 880, 5, priority=3) is low
+    assert manager.play(generate_sine_wave, 990, 5, priority=2) is high
+    assert manager.steals == 4
+
+
+def test_bots_hitting_each_other_make_a_sound(monkeypatch):
+    played = []
+    monkeypatch.setattr(sounds.g_sounds, "play", lambda generator, *args, priority=0, **kwargs: played.append((generator, priority)))
+    a = Spherebot(x=100, y=100, radius=10, vx=3)
+    b = Spherebot(x=118, y=100, radius=10, vx=-3)
+    index = SpatialHash()
+    index.rebuild([a, b])
+    collide_bots(index)
+    assert played == [(sounds.generate_white_noise, sounds.COLLISION_PRIORITY)]
+
+    # bots that rest against each other are quiet
+    a.vx = b.vx = 0
+    a.x, b.x = 100, 118
+    index.rebuild([a, b])
+    collide_bots(index)
+    assert len(played) == 1
+
+
+def test_sonar_pings_make_a_sound(monkeypatch):
+    played = []
+    monkeypatch.setattr(sounds.g_sounds, "play", lambda generator, *args, priority=0, **kwargs: played.append((generator, priority)))
+    world = make_flat_world(width=400, height=300, floor=200)
+    sonar = sensors.Sonar()
+    sonar.ping(Spherebot(x=200, y=100, radius=10), world, 0)
+    assert played == [(sounds.generate_modulated_sine_wave, sounds.SONAR_PING_PRIORITY)]
@@ -0,0 +1,68 @@
+import math
+import random
+import types
+
+import pytest
+
+from conftest import make_flat_world
+from roller import calculations
+from roller.spatial import SpatialHash, ray_circle_intersection
+
+
+def make_entities(count, seed):
+    rng = random.Random(seed)
+    return [types.SimpleNamespace(x=rng.uniform(0, 1000), y=rng.uniform(0, 600), radius=rng.uniform(5, 60))
+            for _ in range(count)]
+
+
+def raycast_all(entities, origin, theta, max_range, exclude=None):
+    """The closest hit found by testing every entity"""
+    hits = []
+    for entity in entities:
+        if entity is exclude:
+            continue
+        t = ray_circle_intersection(origin.x, origin.y, math.cos(theta), math.sin(theta), entity.x, entity.y, entity.radius)
+        if t is not None and t <= max_range:
+            hits.append((t, entity))
+    return min(hits, key=lambda hit: hit[0], default=None)
+
+
+def test_raycast_finds_the_closest_entity():
+    entities = make_entities(60, 0)
+    index = SpatialHash(cell_size=64)
+    index.rebuild(entities)
+    rng = random.Random(1)
+    for _ in range(500):
+        origin = rng.choice(entities)
+        theta = rng.uniform(0, 2 * math.pi)
+        hit = index.raycast(origin, theta, 400, exclude=origin)
+        expected = raycast_all(entities, origin, theta, 400, exclude=origin)
+        if expected is None:
+            assert hit is None
+        else:
+            assert hit[0] == pytest.approx(expected[0]) and hit[1] is expected[1]
+
+
+def test_overlapping_pairs_are_found_once():
+    entities = make_entities(80, 2)
+    index = SpatialHash(cell_size=32)
+    index.rebuild(entities)
+    pairs = {frozenset((id(a), id(b))) for a, b in index.get_overlapping_pairs()}
+    expected = {frozenset((id(a), id(b))) for i, a in enumerate(entities) for b in entities[i + 1:]
+                if math.hypot(a.x - b.x, a.y - b.y) < a.radius + b.radius}
+    assert pairs == expected and len(index.get_overlapping_pairs()) == len(expected)
+
+
+def test_lidar_rays_stop_at_bots():
+    world = make_flat_world(width=400, height=200, floor=150)
+    world.entity_index = SpatialHash()
+    origin = types.SimpleNamespace(x=50, y=100, radius=10)
+    bot = types.SimpleNamespace(x=150, y=100, radius=20)
+    world.entity_index.rebuild([origin, bot])
+    # the ray hits the near side of the bot instead of the ground behind it
+    assert calculations.get_lidar_return(origin, 300, 0, world) == (130, 100)
+    # rays that miss the bot hit the ground
+    assert calculations.get_lidar_return(origin, 300, math.pi / 2, world) == (50, 150)
+    # terrain in front of the bot is hit first
+    world.layers.scatter[100, 90:110] = 1
+    assert calculations.get_lidar_return(origin, 300, 0, world) == (100, 100)
@@ -0,0 +1,45 @@
+import math
+
+import numpy as np
+import pytest
+
+from roller import spatial, terrain
+from roller.bots import Elevator
+from roller.raycache import RayProfileCache
+
+from conftest import make_flat_world
+
+
+def test_removed_sprite_keeps_edits_made_under_it():
+    world = make_flat_world(width=200, height=200, floor=150)
+    sprite = terrain.TerrainSprite.filled(40, 6)
+    sprite.place(world, 50, 100)
+    assert world.layers.ground[50:90, 100:106].all()
+    # something else draws over part of the platform, and digs away another part
+    terrain.fill(world, (50, 100, 10, 6), (0, 0, 255))
+    terrain.erase(world, (80, 100, 10, 6))
+    sprite.place(world, 50, 120)
+    assert world.layers.water[50:60, 100:106].all()
+    assert not world.layers.ground[50:90, 100:106].any()
+    assert world.layers.ground[50:90, 120:126].all()
+
+
+def test_elevator_platform_size_is_keyword_only():
+    with pytest.raises(TypeError):
+        Elevator((80, 6), x=100, y=100)
+    assert Elevator(x=100, y=100, platform_size=(80, 6)).platform.channels.shape[:2] == (80, 6)
+
+
+def test_elevator_sees_through_its_own_platform():
+    world = make_flat_world(width=200, height=200, floor=150)
+    world.entity_index = spatial.SpatialHash()
+    elevator = Elevator(x=100, y=60, platform_size=(80, 6))
+    elevator.run_physics(world)
+    world.entity_index.rebuild([elevator])
+    cache = RayProfileCache()
+    point = cache.get_lidar_return(elevator, 200, math.pi / 2, world)
+    assert point.y == 150
+    # other bots' rays are stopped by the platform
+    other = Elevator(x=70, y=20)
+    point = cache.get_lidar_return(other, 200, math.pi / 2, world)
+    assert point.y == 80
@@ -0,0 +1,42 @@
+import types
+
+import numpy as np
+
+from conftest import make_world
+from roller import sensors
+from roller.thermal import ThermalModel
+
+
+def make_bots():
+    """Bots at places of different temperatures, with sensors that draw different amounts of power"""
+    bots = []
+    for i in range(4):
+        bot_sensors = [sensors.SpectraScan_LX1(), sensors.SpectraScan_SX30(), sensors.Sonar()]
+        for j, sensor in enumerate(bot_sensors):
+            sensor.power_draw = 1 + 5 * i + j
+            sensor.temperature = 10 + 3 * j
+            sensor.is_enabled = (i + j) % 3 != 0
+        bots.append(types.SimpleNamespace(x=20 + 50 * i, y=30, lod_steps=1 + i % 2, sensors=bot_sensors))
+    return bots
+
+
+def test_model_steps_like_each_sensor():
+    channels = np.zeros((200, 60, 3), np.uint8)
+    channels[:, :, 0] = np.arange(200)[:, None]
+    world = make_world(channels)
+    model = ThermalModel()
+    bots = make_bots()
+    model.register(bots)
+    reference = make_bots()
+
+    for _ in range(100):
+        model.step(bots, world, 0.05)
+        for bot in reference:
+            for sensor in bot.sensors:
+                sensor.update_temperature(float(world.layers.temperature[bot.x, bot.y]), 0.05 * bot.lod_steps)
+
+    temperatures = [sensor.temperature for bot in bots for sensor in bot.sensors]
+    expected = [sensor.temperature for bot in reference for sensor in bot.sensors]
+    assert np.allclose(temperatures, expected)
+    # the sensors did warm up and cool down
+    assert not np.allclose(expected, [sensor.temperature for bot in make_bots() for sensor in bot.sensors])
@@ -0,0 +1,63 @@
+import math
+import random
+import types
+
+import numpy as np
+import pygame
+
+from conftest import make_world
+from roller import calculations
+from roller.spatial import SpatialHash
+from roller.visibility import VisibilityPolygon, create_opacity_grid
+
+
+def make_scattering_world(seed):
+    """Air with scattered low-scatter pixels, thin low-scatter diagonals and a few opaque blocks"""
+    rng = np.random.default_rng(seed)
+    channels = np.full((300, 240, 3), 255, np.uint8)
+    # a scatter channel of 200 scatters light with a probability of about 0.05
+    specks = rng.random((300, 240)) < 0.002
+    channels[specks, 1] = 200
+    for offset in range(0, 300, 60):
+        for i in range(120):
+            if 0 <= offset + i < 300:
+                channels[offset + i, 20 + i, 1] = 200
+    for _ in range(6):
+        x, y = rng.integers(0, 280), rng.integers(0, 220)
+        channels[x:x + 20, y:y + 20, 1] = 0
+    world = make_world(channels)
+    world.entity_index = SpatialHash()
+    world.opacity = create_opacity_grid(world.layers)
+    return world
+
+
+def test_returns_match_tracing_each_ray(monkeypatch):
+    # pixels scatter light when their probability is above a fixed draw, so both ways are deterministic
+    monkeypatch.setattr(random, "random", lambda: 0.03)
+    thetas = np.linspace(0, 2 * math.pi, 1000, endpoint=False)
+    for seed in range(3):
+        world = make_scattering_world(seed)
+        for x, y in [(150.5, 120.25), (31.7, 200.0), (270.0, 15.5)]:
+            origin = types.SimpleNamespace(x=x, y=y)
+            polygon = VisibilityPolygon(origin, 200, world.opacity)
+            for theta in thetas:
+                expected = calculations.get_lidar_return(origin, 200, theta, world)
+                assert polygon.get_lidar_return(theta, world) == expected, (seed, x, y, theta)
+
+
+def test_rays_pass_through_own_terrain(monkeypatch):
+    monkeypatch.setattr(random, "random", lambda: 0.03)
+    world = make_scattering_world(0)
+    own_terrain = pygame.Rect(100, 110, 100, 30)
+    origin = types.SimpleNamespace(x=150.5, y=120.25, own_terrain=own_terrain)
+    world.layers.scatter[100:200, 110:140] = 1
+    world.opacity = create_opacity_grid(world.layers)
+    polygon = VisibilityPolygon(origin, 200, world.opacity)
+
+    # the same world without the terrain the origin carries
+    cleared = make_scattering_world(0)
+    cleared.layers.scatter[100:200, 110:140] = 0
+    for theta in np.linspace(0, 2 * math.pi, 500, endpoint=False):
+        point = polygon.get_lidar_return(theta, world)
+        assert point == calculations.get_lidar_return(origin, 200, theta, cleared)
+        assert point is None or not own_terrain.collidepoint(point)
@@ -0,0 +1,58 @@
+import numpy as np
+
+from roller import terrain
+from roller.water import DRY, WaterSimulation
+
+from conftest import make_world
+
+
+def make_pool(width=160, height=80):
+    """A closed basin with a pile of water in it"""
+    channels = np.full((width, height, 3), 255, np.uint8)
+    channels[:, height - 10:] = 0
+    channels[:10] = 0
+    channels[width - 10:] = 0
+    channels[30:70, 10:50] = (0, 0, 255)
+    return make_world(channels)
+
+
+def get_levels(simulation, width, height):
+    water = simulation.read_water(0, 0, width, height) != DRY
+    return np.array([np.argmax(water[x]) for x in range(10, width - 10)]), np.count_nonzero(water)
+
+
+def test_pile_of_water_settles_into_a_level_pool():
+    world = make_pool()
+    simulation = WaterSimulation(world.layers, chunk_size=32)
+    _, pixels = get_levels(simulation, 160, 80)
+    for tick in range(3000):
+        if not simulation.active:
+            break
+        simulation.step()
+    assert not simulation.active
+    levels, settled_pixels = get_levels(simulation, 160, 80)
+    assert settled_pixels == pixels
+    assert levels.max() - levels.min() <= 2
+
+
+def test_level_pool_is_never_active():
+    channels = np.full((128, 64, 3), 255, np.uint8)
+    channels[:, 60:] = 0
+    channels[:, 30:60] = (0, 0, 255)
+    simulation = WaterSimulation(make_world(channels).layers, chunk_size=32)
+    for _ in range(100):
+        simulation.step()
+    assert not simulation.active
+
+
+def test_moved_water_is_drawn_into_the_world():
+    world = make_pool()
+    world.water = simulation = WaterSimulation(world.layers, chunk_size=32)
+    for _ in range(100):
+        simulation.update(world)
+    water = simulation.read_water(0, 0, 160, 80) != DRY
+    assert np.array_equal(world.layers.water, water)
+    # water scatters light, the air left behind doesn't
+    assert np.all(world.layers.scatter[water] == 1)
+    assert np.all(world.layers.scatter[30:70, 10:20] == 0)
+    assert tuple(world.layers.channels[30, 10]) == terrain.AIR
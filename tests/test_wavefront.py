@@ -0,0 +1,106 @@
+import math
+import types
+
+import numpy as np
+import pygame
+
+from conftest import make_flat_world, make_world
+from roller import sensors
+from roller.config import g_config
+from roller.wavefront import Wavefront
+
+
+def run_to_end(wavefront):
+    echoes = wavefront.advance(1000)
+    assert wavefront.is_done
+    return echoes
+
+
+def test_echo_times_follow_the_distance():
+    world = make_flat_world(width=400, height=400, floor=300)
+    wavefront = Wavefront(200, 200, 250, world.occupancy)
+    xs, ys, times, thetas = run_to_end(wavefront)
+
+    # the wave doesn't enter the ground, so only the top row of ground cells echoes
+    size = world.occupancy.cell_size
+    assert len(xs) > 0 and np.all((ys > 300 - size) & (ys < 300 + size))
+    # the octagonal front is within ~10% of the straight line distance, plus a cell for the echo's cell
+    distances = np.hypot(xs - 200, ys - 200)
+    travelled = times * g_config.sonar_speed_of_sound / 2
+    assert np.all(np.abs(travelled - distances) <= 0.1 * distances + 2 * size)
+    below = np.argmin(np.abs(xs - 200))
+    assert times[below] == times.min() and abs(thetas[below] - math.pi / 2) < 0.1
+
+
+def test_wave_goes_around_walls_but_not_through():
+    channels = np.full((400, 400, 3), 255, np.uint8)
+    # a closed box around the origin
+    channels[150:250, 150:154] = 0
+    channels[150:250, 246:250] = 0
+    channels[150:154, 150:250] = 0
+    channels[246:250, 150:250] = 0
+    world = make_world(channels)
+    xs, ys, times, thetas = run_to_end(Wavefront(200, 200, 390, world.occupancy))
+    # only the walls of the box echo
+    assert np.all((xs >= 136) & (xs <= 264) & (ys >= 136) & (ys <= 264))
+
+    channels = np.full((400, 400, 3), 255, np.uint8)
+    # a wall with a gap above it, and a block behind the wall
+    channels[300:304, 50:400] = 0
+    channels[100:120, 200:220] = 0
+    world = make_world(channels)
+    xs, ys, times, thetas = run_to_end(Wavefront(350, 200, 390, world.occupancy))
+    block = xs < 150
+    assert block.any()
+    # the echo of the block took the way through the gap, which is much longer than the straight line
+    travelled = times[block] * g_config.sonar_speed_of_sound / 2
+    assert np.all(travelled > 1.4 * np.hypot(xs[block] - 350, ys[block] - 200))
+
+
+def test_echoes_are_drawn_once_they_returned(monkeypatch):
+    world = make_flat_world(width=400, height=400, floor=300)
+    world.interpretation = pygame.Surface((400, 400), pygame.SRCALPHA)
+    bot = types.SimpleNamespace(x=200, y=200)
+    now = [0]
+    monkeypatch.setattr(pygame.time, "get_ticks", lambda: now[0])
+    sonar = sensors.Sonar(color=(255, 0, 255))
+
+    sonar.run(bot, world)
+    for _ in range(200):
+        sonar.run(bot, world)
+    assert sonar.wavefront.is_done
+    # the wave reached the floor, but no time has passed for the echoes to return
+    assert sonar.echoes == [] and sonar.data == [] and sonar.in_flight
+
+    first = min(echo[0] for echo in sonar.in_flight)
+    now[0] = int(first * 1000) + 1
+    sonar.run(bot, world)
+    assert 0 < len(sonar.echoes) < len(sonar.echoes) + len(sonar.in_flight)
+    assert all(time <= now[0] / 1000 for time, _ in sonar.echoes)
+
+
+def test_ping_erases_only_its_own_echoes(monkeypatch):
+    world = make_flat_world(width=400, height=400, floor=300)
+    world.interpretation = pygame.Surface((400, 400), pygame.SRCALPHA)
+    bot = types.SimpleNamespace(x=200, y=200)
+    now = [0]
+    monkeypatch.setattr(pygame.time, "get_ticks", lambda: now[0])
+    sonar = sensors.Sonar(color=(255, 0, 255))
+    for _ in range(200):
+        sonar.run(bot, world)
+    now[0] = 1000
+    sonar.run(bot, world)
+    echo = sonar.data[0]
+    assert world.interpretation.get_at(echo)[:3] == (255, 0, 255)
+
+    # another sensor draws over one echo, and next to another
+    world.interpretation.set_at(echo, (0, 255, 0))
+    other = (sonar.data[-1].x + 5, sonar.data[-1].y)
+    world.interpretation.set_at(other, (0, 255, 0))
+    drawn = list(sonar.data)
+    now[0] = 3000
+    sonar.run(bot, world)
+    assert sonar.echoes == [] and sonar.data == []
+    assert world.interpretation.get_at(echo)[:3] == (0, 255, 0)
+    assert world.interpretation.get_at(other)[:3] == (0, 255, 0)
+    assert all(world.interpretation.get_at(point)[:3] != (255, 0, 255) for point in drawn)